@@ -6,671 +6,377 @@ from aiohttp import web
 import time
 import os
 import asyncio
+import sqlite3
 import auth_utils
-#from auth_utils import hashPassword, verifyPassword
+from request_pipeline import endpoint
+from json_codec import json_response
 from moderation_service import validate_username
-from game_database import get_account_by_username
+from database_manager import run_in_db
+from game_database import get_account_by_username_async, update_password_async, rename_player_async
 from friends import addFriendDirect, removeFriend, getFriends, sendFriendRequest, getFriendRequests, acceptFriendRequest, rejectFriendRequest, cancelFriendRequest
-from avatar_service import getFullAvatar, getAccessory, buyItem, listMarketItems, getUserAccessories, equipAccessory, unequipAccessory
-from currency_system import creditCurrency, debitCurrency, getCurrency, transferCurrency
-from player_data import getPlayerData, savePlayerData, createPlayerData, updatePlayerAvatar, setPlayerServer, getPlayerFullProfile
+from avatar_service import getFullAvatar, getAccessoryAsync, buyItem, listMarketItems, getUserAccessories, equipAccessory, unequipAccessory
+from currency_system import creditCurrency, debitCurrency, getCurrencyAsync, transferCurrency
+from player_data import getPlayerDataAsync, getPlayerRowAsync, invalidate_player_cache, savePlayerData, createPlayerData, updatePlayerAvatar, setPlayerServer, getPlayerFullProfileAsync
 from pfp_service import getPfp, updateUserPfp
+from player_save_tracker import save_tracker
 
-def checkRateLimit(clientIp):
-    return auth_utils.checkRateLimit(clientIp)
-
-def validateToken(token):
-    return auth_utils.validateToken(token)
-
-def getUserIdFromToken(token):
-    username = auth_utils.getUsernameFromToken(token)
-    if not username:
-        return None
-
-    result = get_account_by_username(username)
-    return result["user_id"] if result else None
-
-async def addFriendEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
-
-    userId = getUserIdFromToken(token)
-    friendId = requestData.get("friendId")
+@endpoint()
+async def addFriendEndpoint(httpRequest, ctx):
+    userId = ctx.user_id
+    friendId = ctx.body.get("friendId")
 
     if not userId or not friendId:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
-    result = addFriendDirect(userId, friendId)
+    result = await run_in_db(addFriendDirect, userId, friendId)
     if result["success"]:
-        return web.json_response(result)
+        return json_response(result)
     else:
-        return web.json_response(result, status=400)
+        return json_response(result, status=400)
 
-async def removeFriendEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
-
-    userId = getUserIdFromToken(token)
-    friendId = requestData.get("friendId")
+@endpoint()
+async def removeFriendEndpoint(httpRequest, ctx):
+    userId = ctx.user_id
+    friendId = ctx.body.get("friendId")
 
     if not userId or not friendId:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
-
-    result = removeFriend(userId, friendId)
-    return web.json_response(result)
-
-async def getFriendsEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
-    userId = getUserIdFromToken(token)
-    if not userId:
-        return web.json_response({"error": "user_not_found"}, status=404)
-
-    friends = getFriends(userId)
-    return web.json_response({"success": True, "data": friends})
+    result = await run_in_db(removeFriend, userId, friendId)
+    return json_response(result)
 
-async def getFullAvatarEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
+@endpoint()
+async def getFriendsEndpoint(httpRequest, ctx):
+    userId = ctx.user_id
 
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
+    friends = await run_in_db(getFriends, userId)
+    return json_response({"success": True, "data": friends})
 
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
-
-    userId = requestData.get("userId")
+@endpoint()
+async def getFullAvatarEndpoint(httpRequest, ctx):
+    userId = ctx.body.get("userId")
     if not userId:
-        userId = getUserIdFromToken(token)
+        userId = ctx.user_id
 
     if not userId:
-        return web.json_response({"error": "user_not_found"}, status=404)
-
-    avatar = getFullAvatar(userId)
-    return web.json_response({"success": True, "data": avatar})
+        return json_response({"error": "user_not_found"}, status=404)
 
-async def getAccessoryEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
+    avatar = await run_in_db(getFullAvatar, userId)
+    return json_response({"success": True, "data": avatar})
 
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    #token = requestData.get("token")
+@endpoint(auth=False)
+async def getAccessoryEndpoint(httpRequest, ctx):
+    #token = ctx.body.get("token")
     #if not token or not validateToken(token):
-    #    return web.json_response({"error": "invalid_token"}, status=401)
+    #    return json_response({"error": "invalid_token"}, status=401)
 
-    accessoryId = requestData.get("accessoryId")
+    accessoryId = ctx.body.get("accessoryId")
     if not accessoryId:
-        return web.json_response({"error": "missing_accessory_id"}, status=400)
+        return json_response({"error": "missing_accessory_id"}, status=400)
 
-    accessory = getAccessory(accessoryId)
+    accessory = await getAccessoryAsync(accessoryId)
     if accessory:
-        return web.json_response({"success": True, "data": accessory})
+        return json_response({"success": True, "data": accessory})
     else:
-        return web.json_response({"success": False, "error": {"code": "NOT_FOUND", "message": "Accessory not found"}}, status=404)
+        return json_response({"success": False, "error": {"code": "NOT_FOUND", "message": "Accessory not found"}}, status=404)
 
-async def buyItemEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
-
-    userId = getUserIdFromToken(token)
-    itemId = requestData.get("itemId")
+@endpoint()
+async def buyItemEndpoint(httpRequest, ctx):
+    userId = ctx.user_id
+    itemId = ctx.body.get("itemId")
 
     if not userId or not itemId:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
     result = await buyItem(userId, itemId)
     if result["success"]:
-        return web.json_response(result)
+        return json_response(result)
     else:
-        return web.json_response(result, status=400)
-
-async def equipAccessoryEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
+        return json_response(result, status=400)
 
-    userId = getUserIdFromToken(token)
-    accessoryId = requestData.get("accessoryId")
+@endpoint()
+async def equipAccessoryEndpoint(httpRequest, ctx):
+    userId = ctx.user_id
+    accessoryId = ctx.body.get("accessoryId")
 
     if not userId or not accessoryId:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
     result = await equipAccessory(userId, accessoryId)
     if result["success"]:
         asyncio.create_task(updateUserPfp(userId))
-        return web.json_response(result)
+        return json_response(result)
     else:
-        return web.json_response(result, status=400)
-
-async def unequipAccessoryEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
+        return json_response(result, status=400)
 
-    userId = getUserIdFromToken(token)
-    accessoryId = requestData.get("accessoryId")
+@endpoint()
+async def unequipAccessoryEndpoint(httpRequest, ctx):
+    userId = ctx.user_id
+    accessoryId = ctx.body.get("accessoryId")
 
     if not userId or not accessoryId:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
     result = await unequipAccessory(userId, accessoryId)
     if result["success"]:
         asyncio.create_task(updateUserPfp(userId))
-        return web.json_response(result)
+        return json_response(result)
     else:
-        return web.json_response(result, status=400)
-
-async def listMarketItemsEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
+        return json_response(result, status=400)
 
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
+@endpoint()
+async def listMarketItemsEndpoint(httpRequest, ctx):
+    filterData = ctx.body.get("filter")
+    pagination = ctx.body.get("pagination")
 
-    filterData = requestData.get("filter")
-    pagination = requestData.get("pagination")
-
-    result = listMarketItems(filterData, pagination)
-    return web.json_response(result)
-
-async def getUserAccessoriesEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
+    result = await run_in_db(listMarketItems, filterData, pagination)
+    return json_response(result)
 
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
-
-    userId = requestData.get("userId")
+@endpoint()
+async def getUserAccessoriesEndpoint(httpRequest, ctx):
+    userId = ctx.body.get("userId")
     if not userId:
-        userId = getUserIdFromToken(token)
+        userId = ctx.user_id
 
     if not userId:
-        return web.json_response({"error": "user_not_found"}, status=404)
-
-    accessories = getUserAccessories(userId)
-    return web.json_response({"success": True, "data": accessories})
-
-async def creditCurrencyEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
+        return json_response({"error": "user_not_found"}, status=404)
 
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
+    accessories = await run_in_db(getUserAccessories, userId)
+    return json_response({"success": True, "data": accessories})
 
-    userId = getUserIdFromToken(token)
-    amount = requestData.get("amount")
+@endpoint()
+async def creditCurrencyEndpoint(httpRequest, ctx):
+    userId = ctx.user_id
+    amount = ctx.body.get("amount")
 
     if not userId or not amount:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
     result = await creditCurrency(userId, amount)
     if result["success"]:
-        return web.json_response(result)
+        return json_response(result)
     else:
-        return web.json_response(result, status=400)
-
-async def debitCurrencyEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
+        return json_response(result, status=400)
 
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
-
-    userId = getUserIdFromToken(token)
-    amount = requestData.get("amount")
+@endpoint()
+async def debitCurrencyEndpoint(httpRequest, ctx):
+    userId = ctx.user_id
+    amount = ctx.body.get("amount")
 
     if not userId or not amount:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
     result = await debitCurrency(userId, amount)
     if result["success"]:
-        return web.json_response(result)
+        return json_response(result)
     else:
-        return web.json_response(result, status=400)
-
-async def getCurrencyEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
+        return json_response(result, status=400)
 
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
+@endpoint()
+async def getCurrencyEndpoint(httpRequest, ctx):
+    userId = ctx.user_id
 
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
+    result = await getCurrencyAsync(userId)
+    return json_response(result)
 
-    userId = getUserIdFromToken(token)
+@endpoint()
+async def getPfpEndpoint(httpRequest, ctx):
+    userId = ctx.body.get("userId")
     if not userId:
-        return web.json_response({"error": "user_not_found"}, status=404)
-
-    result = getCurrency(userId)
-    return web.json_response(result)
-
-async def getPfpEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
+        userId = ctx.user_id
 
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
-
-    userId = requestData.get("userId")
     if not userId:
-        userId = getUserIdFromToken(token)
+        return json_response({"error": "user_not_found"}, status=404)
 
-    if not userId:
-        return web.json_response({"error": "user_not_found"}, status=404)
+    pfpUrl = await run_in_db(getPfp, userId)
+    return json_response({"success": True, "data": {"pfp": pfpUrl}})
 
-    pfpUrl = getPfp(userId)
-    return web.json_response({"success": True, "data": {"pfp": pfpUrl}})
-
-async def updateAvatarEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
-
-    userId = getUserIdFromToken(token)
-    avatarData = requestData.get("avatar")
+@endpoint()
+async def updateAvatarEndpoint(httpRequest, ctx):
+    userId = ctx.user_id
+    avatarData = ctx.body.get("avatar")
 
     if not userId or not avatarData:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
     result = await updatePlayerAvatar(userId, avatarData)
 
     if result["success"]:
         await updateUserPfp(userId)
 
-    return web.json_response(result)
-
-async def getPlayerProfileEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
+    return json_response(result)
 
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
-
-    userId = requestData.get("userId")
+@endpoint()
+async def getPlayerProfileEndpoint(httpRequest, ctx):
+    userId = ctx.body.get("userId")
     if not userId:
-        userId = getUserIdFromToken(token)
+        userId = ctx.user_id
 
     if not userId:
-        return web.json_response({"error": "user_not_found"}, status=404)
-
-    result = getPlayerFullProfile(userId)
-    return web.json_response(result)
-
-async def setPlayerServerEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
+        return json_response({"error": "user_not_found"}, status=404)
 
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
+    result = await getPlayerFullProfileAsync(userId)
+    return json_response(result)
 
-    userId = getUserIdFromToken(token)
-    serverId = requestData.get("serverId")
+@endpoint()
+async def setPlayerServerEndpoint(httpRequest, ctx):
+    userId = ctx.user_id
+    serverId = ctx.body.get("serverId")
 
     if not userId:
-        return web.json_response({"error": "user_not_found"}, status=404)
+        return json_response({"error": "user_not_found"}, status=404)
 
     result = await setPlayerServer(userId, serverId)
-    return web.json_response(result)
-
-async def sendFriendRequestEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
+    return json_response(result)
 
-    fromUserId = getUserIdFromToken(token)
-    toUserId = requestData.get("toUserId")
+@endpoint()
+async def sendFriendRequestEndpoint(httpRequest, ctx):
+    fromUserId = ctx.user_id
+    toUserId = ctx.body.get("toUserId")
 
     if not fromUserId or not toUserId:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
-    result = sendFriendRequest(fromUserId, toUserId)
+    result = await run_in_db(sendFriendRequest, fromUserId, toUserId)
     if result["success"]:
-        return web.json_response(result)
+        return json_response(result)
     else:
-        return web.json_response(result, status=400)
-
-async def getFriendRequestsEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
-
-    userId = getUserIdFromToken(token)
-    if not userId:
-        return web.json_response({"error": "user_not_found"}, status=404)
-
-    result = getFriendRequests(userId)
-    return web.json_response(result)
-
-async def acceptFriendRequestEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
+        return json_response(result, status=400)
 
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
+@endpoint()
+async def getFriendRequestsEndpoint(httpRequest, ctx):
+    userId = ctx.user_id
 
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
+    result = await run_in_db(getFriendRequests, userId)
+    return json_response(result)
 
-    userId = getUserIdFromToken(token)
-    requesterId = requestData.get("requesterId")
+@endpoint()
+async def acceptFriendRequestEndpoint(httpRequest, ctx):
+    userId = ctx.user_id
+    requesterId = ctx.body.get("requesterId")
 
     if not userId or not requesterId:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
-    result = acceptFriendRequest(userId, requesterId)
+    result = await run_in_db(acceptFriendRequest, userId, requesterId)
     if result["success"]:
-        return web.json_response(result)
+        return json_response(result)
     else:
-        return web.json_response(result, status=400)
-
-async def rejectFriendRequestEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
+        return json_response(result, status=400)
 
-    userId = getUserIdFromToken(token)
-    requesterId = requestData.get("requesterId")
+@endpoint()
+async def rejectFriendRequestEndpoint(httpRequest, ctx):
+    userId = ctx.user_id
+    requesterId = ctx.body.get("requesterId")
 
     if not userId or not requesterId:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
-    result = rejectFriendRequest(userId, requesterId)
+    result = await run_in_db(rejectFriendRequest, userId, requesterId)
     if result["success"]:
-        return web.json_response(result)
+        return json_response(result)
     else:
-        return web.json_response(result, status=400)
-
-async def cancelFriendRequestEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
+        return json_response(result, status=400)
 
-    userId = getUserIdFromToken(token)
-    targetUserId = requestData.get("targetUserId")
+@endpoint()
+async def cancelFriendRequestEndpoint(httpRequest, ctx):
+    userId = ctx.user_id
+    targetUserId = ctx.body.get("targetUserId")
 
     if not userId or not targetUserId:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
-    result = cancelFriendRequest(userId, targetUserId)
+    result = await run_in_db(cancelFriendRequest, userId, targetUserId)
     if result["success"]:
-        return web.json_response(result)
+        return json_response(result)
     else:
-        return web.json_response(result, status=400)
+        return json_response(result, status=400)
 
-async def checkFreeUsername(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
+@endpoint()
+async def checkFreeUsername(httpRequest, ctx):
 
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
-
-    username = auth_utils.getUsernameFromToken(token)
-    user_data = get_account_by_username(username)
+    username = ctx.username
+    user_data = await get_account_by_username_async(username)
 
     if not user_data:
-        return web.json_response({"error": "user_not_found"}, status=404)
+        return json_response({"error": "user_not_found"}, status=404)
 
-    user_id = user_data["user_id"]
-    username_changes = user_data.get("username_changes", 0)
+    user_id = user_data.user_id
+    username_changes = user_data.username_changes or 0
 
     cost = 0 if username_changes == 0 else 150
 
-    return web.json_response({
+    return json_response({
         "required": cost
     })
 
-async def changeUsername(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    new_username = requestData.get("new_username", "").strip()
-
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
+@endpoint()
+async def changeUsername(httpRequest, ctx):
+    new_username = ctx.body.get("new_username", "").strip()
 
     if not new_username:
-        return web.json_response({"error": "missing_new_username"}, status=400)
+        return json_response({"error": "missing_new_username"}, status=400)
 
     validation = validate_username(new_username)
     if not validation["valid"]:
-        return web.json_response({"error": validation["error"]}, status=400)
+        return json_response({"error": validation["error"]}, status=400)
 
-    username = auth_utils.getUsernameFromToken(token)
-    user_data = get_account_by_username(username)
+    username = ctx.username
+    user_data = await get_account_by_username_async(username)
 
     if not user_data:
-        return web.json_response({"error": "user_not_found"}, status=404)
+        return json_response({"error": "user_not_found"}, status=404)
 
-    user_id = user_data["user_id"]
-    old_username = user_data["username"]
-    username_changes = user_data.get("username_changes", 0)
+    user_id = user_data.user_id
+    old_username = user_data.username
+    username_changes = user_data.username_changes or 0
 
-    existing = get_account_by_username(new_username)
+    existing = await get_account_by_username_async(new_username)
     if existing:
-        return web.json_response({"error": "username_taken"}, status=409)
+        return json_response({"error": "username_taken"}, status=409)
 
     cost = 0 if username_changes == 0 else 150
 
-    if cost > 0:
-        from currency_system import getCurrency, debitCurrency
-        currency_result = getCurrency(user_id)
-        if not currency_result["success"]:
-            return web.json_response({"error": "failed_to_check_balance"}, status=500)
+    player_row = await getPlayerRowAsync(user_id)
+    if not player_row:
+        return json_response({"error": "user_not_found"}, status=404)
 
-        balance = currency_result["data"]["balance"]
-        if balance < cost:
-            return web.json_response({
-                "error": "insufficient_funds",
-                "required": cost,
-                "balance": balance
-            }, status=400)
-
-        debit_result = await debitCurrency(user_id, cost)
-        if not debit_result["success"]:
-            return web.json_response(debit_result, status=400)
-
-    from game_database import update_username
-    update_username(user_id, new_username)
-
-    from database_manager import execute_query
-    query = "UPDATE tokens SET username = ? WHERE username = ?"
-    execute_query(query, (new_username, old_username))
+    if player_row.currency < cost:
+        return json_response({
+            "error": "insufficient_funds",
+            "required": cost,
+            "balance": player_row.currency
+        }, status=400)
 
-    from player_data import getPlayerData, savePlayerData
-    player_data = getPlayerData(user_id)
-    if player_data:
-        player_data["username"] = new_username
-        await savePlayerData(user_id, player_data)
+    # fee, account, tokens and player row all commit together. the fee is
+    # taken in sql, so a credit or purchase landing meanwhile isn't undone
+    save_id = await save_tracker.start_save(user_id, "change_username")
+    try:
+        new_balance = await rename_player_async(user_id, old_username, new_username, cost)
+    except sqlite3.IntegrityError:
+        await save_tracker.complete_save(save_id, success=False)
+        # somebody grabbed the name between the check above and the write
+        return json_response({"error": "username_taken"}, status=409)
+    except Exception:
+        await save_tracker.complete_save(save_id, success=False)
+        raise
+    await save_tracker.complete_save(save_id, success=new_balance is not None)
+    invalidate_player_cache(user_id)
+
+    if new_balance is None:
+        # spent elsewhere since the check above
+        player_row = await getPlayerRowAsync(user_id)
+        return json_response({
+            "error": "insufficient_funds",
+            "required": cost,
+            "balance": player_row.currency if player_row else 0
+        }, status=400)
 
-    auth_utils.clear_token_cache()
+    from currency_system import _invalidate_currency_cache
+    _invalidate_currency_cache(user_id)
+    auth_utils.renameSessions(user_id, new_username)
 
-    return web.json_response({
+    return json_response({
         "success": True,
         "new_username": new_username,
         "cost": cost,
@@ -678,75 +384,59 @@ async def changeUsername(httpRequest):
         "token_still_valid": True
     })
 
-async def changePassword(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    old_password = requestData.get("old_password", "")
-    new_password = requestData.get("new_password", "")
-
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
+@endpoint()
+async def changePassword(httpRequest, ctx):
+    old_password = ctx.body.get("old_password", "")
+    new_password = ctx.body.get("new_password", "")
 
     if not old_password or not new_password:
-        return web.json_response({"error": "missing_passwords"}, status=400)
+        return json_response({"error": "missing_passwords"}, status=400)
 
     if len(new_password) < 6:
-        return web.json_response({"error": "password_too_short"}, status=400)
+        return json_response({"error": "password_too_short"}, status=400)
 
-    username = auth_utils.getUsernameFromToken(token)
-    user_data = get_account_by_username(username)
+    username = ctx.username
+    user_data = await get_account_by_username_async(username)
 
     if not user_data:
-        return web.json_response({"error": "user_not_found"}, status=404)
+        return json_response({"error": "user_not_found"}, status=404)
 
-    if not verifyPassword(old_password, user_data["password"]):
-        return web.json_response({"error": "incorrect_old_password"}, status=401)
+    try:
+        valid, _ = await auth_utils.checkPasswordAsync(old_password, user_data.password)
+        if not valid:
+            return json_response({"error": "incorrect_old_password"}, status=401)
 
-    hashed_new_password = hashPassword(new_password)
+        hashed_new_password = await auth_utils.hashPasswordAsync(new_password)
+    except auth_utils.PasswordHashBusy:
+        return json_response({"error": "server_busy"}, status=503, headers={"Retry-After": "1"})
 
-    from game_database import update_password
-    update_password(user_data["user_id"], hashed_new_password)
+    await update_password_async(user_data.user_id, hashed_new_password)
+    # sessions made with the old password (maybe by whoever knew it) end
+    # here, signed ones included. this client carries on with a new token
+    await auth_utils.revokeUserSessions(user_data.user_id, user_data.username)
+    token = await auth_utils.issueSession(user_data.user_id, user_data.username)
 
-    return web.json_response({
+    return json_response({
         "success": True,
-        "message": "Password changed successfully"
+        "message": "Password changed successfully",
+        "token": token
     })
 
-async def joinFriendServer(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
-
-    userId = getUserIdFromToken(token)
-    friendId = requestData.get("friendId")
+@endpoint()
+async def joinFriendServer(httpRequest, ctx):
+    userId = ctx.user_id
+    friendId = ctx.body.get("friendId")
 
     if not userId or not friendId:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
-    friendData = getPlayerData(friendId)
+    friendData = await getPlayerDataAsync(friendId)
     if not friendData:
-        return web.json_response({"error": "friend_not_found"}, status=404)
+        return json_response({"error": "friend_not_found"}, status=404)
 
     serverId = friendData.get("serverId")
     if not serverId:
-        return web.json_response({"error": "friend_not_in_server"}, status=400)
+        return json_response({"error": "friend_not_in_server"}, status=400)
 
     from vm_lifecycle_manager import vm_registry, vm_registry_lock
     import asyncio
@@ -761,11 +451,11 @@ async def joinFriendServer(httpRequest):
                 # if plr count is 7 we wont let anyone else join
                 # nvm, thinking about it again, we will let player count be at its max ONLY if it is a friend
                 if player_count >= 8: # TODO: Make this configurable on the .env
-                    return web.json_response({"error": "server_full"}, status=400)
+                    return json_response({"error": "server_full"}, status=400)
 
                 await setPlayerServer(userId, serverId)
 
-                return web.json_response({
+                return json_response({
                     "success": True,
                     "data": {
                         "uid": serverId,
@@ -775,41 +465,26 @@ async def joinFriendServer(httpRequest):
                     }
                 })
 
-    return web.json_response({"error": "server_not_found"}, status=404)
+    return json_response({"error": "server_not_found"}, status=404)
 
-async def subscribePrivateServer(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
-
-    userId = getUserIdFromToken(token)
-    if not userId:
-        return web.json_response({"error": "user_not_found"}, status=404)
+@endpoint()
+async def subscribePrivateServer(httpRequest, ctx):
+    userId = ctx.user_id
 
     # TODO: THESE MUST BE CONFIGURABLE!!!!!!
     PRIVATE_SERVER_COST = 250
     SUBSCRIPTION_DAYS = 30
 
-    from currency_system import getCurrency, debitCurrency
-    from player_data import getPlayerData, savePlayerData
+    from currency_system import debitCurrency
     import time
 
-    currency_result = getCurrency(userId)
+    currency_result = await getCurrencyAsync(userId)
     if not currency_result["success"]:
-        return web.json_response({"error": "failed_to_check_balance"}, status=500)
+        return json_response({"error": "failed_to_check_balance"}, status=500)
 
     balance = currency_result["data"]["balance"]
     if balance < PRIVATE_SERVER_COST:
-        return web.json_response({
+        return json_response({
             "error": "insufficient_funds",
             "required": PRIVATE_SERVER_COST,
             "balance": balance
@@ -817,11 +492,11 @@ async def subscribePrivateServer(httpRequest):
 
     debit_result = await debitCurrency(userId, PRIVATE_SERVER_COST)
     if not debit_result["success"]:
-        return web.json_response(debit_result, status=400)
+        return json_response(debit_result, status=400)
 
-    playerData = getPlayerData(userId)
+    playerData = await getPlayerDataAsync(userId)
     if not playerData:
-        return web.json_response({"error": "user_not_found"}, status=404)
+        return json_response({"error": "user_not_found"}, status=404)
 
     current_time = time.time()
     expires_time = current_time + (SUBSCRIPTION_DAYS * 86400)  # 30 days
@@ -831,9 +506,9 @@ async def subscribePrivateServer(httpRequest):
     await savePlayerData(userId, playerData)
 
     from vm_game_server_manager import spawn_game_server
-    from config import SERVER_PUBLIC_IP
+    from config import get_server_public_ip
 
-    master_vm_id = f"main-{SERVER_PUBLIC_IP}"
+    master_vm_id = f"main-{get_server_public_ip()}"
 
     from vm_lifecycle_manager import vm_registry, vm_registry_lock
 
@@ -849,7 +524,7 @@ async def subscribePrivateServer(httpRequest):
             success = await spawn_game_server(server_uid, next_port, owner_id=userId)
 
             if success:
-                return web.json_response({
+                return json_response({
                     "success": True,
                     "data": {
                         "cost": PRIVATE_SERVER_COST,
@@ -860,41 +535,25 @@ async def subscribePrivateServer(httpRequest):
                     }
                 })
 
-    return web.json_response({"error": "failed_to_create_private_server"}, status=500)
-
-async def cancelPrivateServer(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
-
-    userId = getUserIdFromToken(token)
-    if not userId:
-        return web.json_response({"error": "user_not_found"}, status=404)
+    return json_response({"error": "failed_to_create_private_server"}, status=500)
 
-    from player_data import getPlayerData, savePlayerData
+@endpoint()
+async def cancelPrivateServer(httpRequest, ctx):
+    userId = ctx.user_id
 
-    playerData = getPlayerData(userId)
+    playerData = await getPlayerDataAsync(userId)
     if not playerData:
-        return web.json_response({"error": "user_not_found"}, status=404)
+        return json_response({"error": "user_not_found"}, status=404)
 
     if not playerData.get("private_server_active", False):
-        return web.json_response({"error": "no_active_subscription"}, status=400)
+        return json_response({"error": "no_active_subscription"}, status=400)
 
     # Stop the private server
     from vm_lifecycle_manager import vm_registry, vm_registry_lock
     from vm_game_server_manager import stop_game_server
-    from config import SERVER_PUBLIC_IP
+    from config import get_server_public_ip
 
-    master_vm_id = f"main-{SERVER_PUBLIC_IP}"
+    master_vm_id = f"main-{get_server_public_ip()}"
     server_uid = f"private_{userId}_{master_vm_id}"
 
     async with vm_registry_lock:
@@ -907,35 +566,20 @@ async def cancelPrivateServer(httpRequest):
     playerData["private_server_expires"] = 0
     await savePlayerData(userId, playerData)
 
-    return web.json_response({
+    return json_response({
         "success": True,
         "message": "Private server subscription cancelled"
     })
 
-async def getPrivateServerStatus(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
-
-    userId = getUserIdFromToken(token)
-    if not userId:
-        return web.json_response({"error": "user_not_found"}, status=404)
+@endpoint()
+async def getPrivateServerStatus(httpRequest, ctx):
+    userId = ctx.user_id
 
-    from player_data import getPlayerData
     import time
 
-    playerData = getPlayerData(userId)
+    playerData = await getPlayerDataAsync(userId)
     if not playerData:
-        return web.json_response({"error": "user_not_found"}, status=404)
+        return json_response({"error": "user_not_found"}, status=404)
 
     active = playerData.get("private_server_active", False)
     expires = playerData.get("private_server_expires", 0)
@@ -949,7 +593,7 @@ async def getPrivateServerStatus(httpRequest):
         await savePlayerData(userId, playerData)
         active = False
 
-    return web.json_response({
+    return json_response({
         "success": True,
         "data": {
             "active": active,
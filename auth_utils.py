@@ -1,125 +1,550 @@
+import os
 import time
-from collections import deque
-from database_manager import execute_query
+import hmac
+import base64
+import asyncio
+import hashlib
+import secrets
+from itertools import islice
+from collections import OrderedDict
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+from database_manager import execute_query, execute_query_async, storage, DATA_DIR
+from game_database import hash_token, save_token_async
+import shared_state
 
 from config import (
-    RATELIMIT_MAX,
-    RATE_LIMIT_WINDOW,
+    RATE_LIMITS,
     CACHE_TTL,
-    get_server_ip,
+    TOKEN_MAX_AGE,
+    TOKEN_CACHE_SIZE,
+    TOKEN_NEGATIVE_TTL,
+    SESSION_TOKEN_FORMAT,
+    SESSION_SIGNING_KEYS,
+    get_server_public_ip,
 )
 
-rateLimitDict = {}
-token_cache = {}
-username_to_token = {}
 blockedIps = {}
-CLEANUP_INTERVAL = 120
-last_cleanup = 0
+
+# loopback, this server and every VM we created. built by startup.py once
+# the public ip is known and rebuilt by vm_lifecycle_manager when a VM with
+# a known ip is added or removed, so checkRateLimit is one set lookup and
+# never resolves anything
+trusted_ips = frozenset(("127.0.0.1", "::1", "localhost"))
+
+def refreshTrustedIps(vm_ips=(), publish=True):
+    global trusted_ips
+    ips = {"127.0.0.1", "::1", "localhost", get_server_public_ip()}
+    ips.update(vm_ips)
+    ips.discard(None)
+    trusted_ips = frozenset(ips)
+    # the primary worker tracks the VMs, the others take its list
+    if publish and shared_state.is_primary():
+        shared_state.publish("trusted_ips", sorted(ip for ip in vm_ips if ip), retain=1)
+
+shared_state.subscribe("trusted_ips", lambda vm_ips: refreshTrustedIps(vm_ips, publish=False))
 
 def isServerIp(clientIp):
-    server_ips = ["127.0.0.1", "::1", get_server_ip(), "localhost"]
-    if clientIp in server_ips:
-        return True
-    return False
+    return clientIp in trusted_ips
+
+# token buckets (GCRA): each key stores a single float, the time its bucket
+# is full again. a request is allowed while that stays within burst * interval
+# of now. keys live in two generations swapped every burst window, anything
+# left in the old one is already full again, so idle keys are dropped
+# without ever walking the dict
+class RateBucket:
+    __slots__ = ("interval", "tolerance", "current", "previous", "rotated")
+
+    def __init__(self, burst, per_second):
+        self.interval = 1.0 / per_second
+        self.tolerance = burst * self.interval
+        self.current = {}
+        self.previous = {}
+        self.rotated = time.monotonic()
+
+    # 0 when allowed, otherwise seconds until the next request would be
+    def take(self, key, now):
+        if now - self.rotated > self.tolerance:
+            self.previous = self.current
+            self.current = {}
+            self.rotated = now
+        tat = self.current.get(key)
+        if tat is None:
+            tat = self.previous.pop(key, now)
+        if tat < now:
+            tat = now
+        new_tat = tat + self.interval
+        wait = new_tat - now - self.tolerance
+        if wait > 0:
+            self.current[key] = tat
+            return wait
+        self.current[key] = new_tat
+        return 0
+
+    def used(self, key, now):
+        tat = self.current.get(key, self.previous.get(key, now))
+        return max(0, round((tat - now) / self.interval))
+
+    def __len__(self):
+        return len(self.current) + len(self.previous)
+
+rate_buckets = {group: RateBucket(burst, per_second) for group, (burst, per_second, _) in RATE_LIMITS.items()}
 
-# todo: this looks super ugly to me
-# pls change in the future
-def checkRateLimit(clientIp):
-    global last_cleanup
+# seconds to wait (0 = go ahead) for key in a RATE_LIMITS group
+def rateLimitWait(key, group="default"):
+    if key in blockedIps:
+        if time.time() < blockedIps[key]:
+            return blockedIps[key] - time.time()
+        del blockedIps[key]
+    return rate_buckets[group].take(key, time.monotonic())
+
+def checkRateLimit(clientIp, group="default"):
     if isServerIp(clientIp):
         return True
-    currentTime = time.time()
-    if clientIp in blockedIps:
-        if currentTime < blockedIps[clientIp]:
+    return rateLimitWait(clientIp, group) == 0
+
+def get_rate_limit_entries(limit=100):
+    now = time.monotonic()
+    entries = []
+    for group, bucket in rate_buckets.items():
+        for key in islice(bucket.current, limit):
+            used = bucket.used(key, now)
+            if used:
+                entries.append({"key": key, "group": group, "requests": used})
+    return entries
+
+def get_rate_limit_stats():
+    return {group: {"keys": len(bucket), "burst": RATE_LIMITS[group][0], "per_second": RATE_LIMITS[group][1],
+                    "key": RATE_LIMITS[group][2]} for group, bucket in rate_buckets.items()}
+
+# sha256(token) -> (Session, expiry), least recently used first. bounded by
+# TOKEN_CACHE_SIZE, unknown tokens are remembered for TOKEN_NEGATIVE_TTL so
+# garbage tokens don't reach sqlite on every request
+class Session(NamedTuple):
+    user_id: int
+    username: str
+    created: float
+
+token_cache = OrderedDict()
+negative_token_cache = OrderedDict()
+token_cache_stats = {"hits": 0, "misses": 0, "negative_hits": 0, "evictions": 0,
+                     "negative_evictions": 0, "username_evictions": 0}
+
+SESSION_QUERY = """
+    SELECT a.user_id, t.username, t.created FROM tokens t
+    JOIN accounts a ON a.username = t.username WHERE t.token = ?
+"""
+
+def _get_cached_session(token_hash, currentTime):
+    entry = token_cache.get(token_hash)
+    if entry:
+        if currentTime < entry[1]:
+            token_cache.move_to_end(token_hash)
+            token_cache_stats["hits"] += 1
+            return entry[0]
+        del token_cache[token_hash]
+    elif token_hash in negative_token_cache:
+        if currentTime < negative_token_cache[token_hash]:
+            token_cache_stats["negative_hits"] += 1
             return False
-        else:
-            del blockedIps[clientIp]
-    if currentTime - last_cleanup > CLEANUP_INTERVAL:
-        _cleanup_old_entries(currentTime)
-        last_cleanup = currentTime
-    if clientIp not in rateLimitDict:
-        rateLimitDict[clientIp] = deque(maxlen=RATELIMIT_MAX)
-    timestamps = rateLimitDict[clientIp]
-    cutoff = currentTime - RATE_LIMIT_WINDOW
-    while timestamps and timestamps[0] < cutoff:
-        timestamps.popleft()
-    if len(timestamps) >= RATELIMIT_MAX:
-        return False
-    timestamps.append(currentTime)
-    return True
+        del negative_token_cache[token_hash]
+    token_cache_stats["misses"] += 1
+    return None
 
-def _cleanup_old_entries(currentTime):
-    cutoff = currentTime - (RATE_LIMIT_WINDOW * 2)
-    to_delete = []
-    for ip in rateLimitDict:
-        if rateLimitDict[ip] and rateLimitDict[ip][-1] < cutoff:
-            to_delete.append(ip)
-    for ip in to_delete:
-        del rateLimitDict[ip]
+# stat is the token_cache_stats counter for this cache's evictions
+def _bounded_set(cache, key, value, stat):
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > TOKEN_CACHE_SIZE:
+        cache.popitem(last=False)
+        token_cache_stats[stat] += 1
 
-def validateToken(token):
+def cacheSession(token, user_id, username, created=None):
+    if created is None:
+        created = time.time()
+    token_hash = hash_token(token)
+    session = Session(user_id, username, created)
+    _bounded_set(token_cache, token_hash, (session, min(time.time() + CACHE_TTL, created + TOKEN_MAX_AGE)), "evictions")
+    negative_token_cache.pop(token_hash, None)
+    return session
+
+def _cache_session_row(token_hash, result, currentTime):
+    if not result or currentTime - result[2] > TOKEN_MAX_AGE:
+        _bounded_set(negative_token_cache, token_hash, currentTime + TOKEN_NEGATIVE_TTL, "negative_evictions")
+        return None
+    session = Session(*result)
+    _bounded_set(token_cache, token_hash, (session, min(currentTime + CACHE_TTL, session.created + TOKEN_MAX_AGE)), "evictions")
+    return session
+
+# Session for a token, None if it's unknown, expired or revoked
+def getSession(token):
+    if not token or not isinstance(token, str):
+        return None
+    if token.startswith(SIGNED_TOKEN_PREFIX):
+        claims = verifySignedToken(token)
+        if not claims:
+            return None
+        username = _get_cached_username(claims[0])
+        if username is None:
+            result = execute_query(USERNAME_QUERY, (claims[0],), fetch_one=True)
+            username = _cache_username(claims[0], result)
+        return Session(claims[0], username, claims[1]) if username else None
     currentTime = time.time()
-    if token in token_cache:
-        cached_data = token_cache[token]
-        if currentTime < cached_data['expiry']:
-            return True
+    token_hash = hash_token(token)
+    session = _get_cached_session(token_hash, currentTime)
+    if session is not None:
+        return session or None
+    return _cache_session_row(token_hash, execute_query(SESSION_QUERY, (token_hash,), fetch_one=True), currentTime)
+
+# same but a cache miss goes to the db executor instead of blocking the
+# event loop, handlers should use this
+async def getSessionAsync(token):
+    if not token or not isinstance(token, str):
+        return None
+    if token.startswith(SIGNED_TOKEN_PREFIX):
+        claims = verifySignedToken(token)
+        if not claims:
+            return None
+        username = _get_cached_username(claims[0])
+        if username is None:
+            result = await execute_query_async(USERNAME_QUERY, (claims[0],), fetch_one=True)
+            username = _cache_username(claims[0], result)
+        return Session(claims[0], username, claims[1]) if username else None
+    currentTime = time.time()
+    token_hash = hash_token(token)
+    session = _get_cached_session(token_hash, currentTime)
+    if session is not None:
+        return session or None
+    result = await execute_query_async(SESSION_QUERY, (token_hash,), fetch_one=True)
+    return _cache_session_row(token_hash, result, currentTime)
+
+def validateToken(token):
+    return getSession(token) is not None
+
+def getUsernameFromToken(token):
+    session = getSession(token)
+    return session.username if session else None
+
+async def validateTokenAsync(token):
+    return await getSessionAsync(token) is not None
+
+async def getUsernameFromTokenAsync(token):
+    session = await getSessionAsync(token)
+    return session.username if session else None
+
+# signed tokens (SESSION_TOKEN_FORMAT=signed): "s1.<key id>.<payload>.<mac>"
+# with payload "user_id:issued:nonce", HMAC-SHA256 under SESSION_SIGNING_KEYS.
+# checking one is pure cpu, no tokens table and no master db, so any worker
+# or VM with the keys can do it. the username isn't in the token (it can
+# change), it comes from a small user_id -> username cache instead.
+# revocation is a denylist in revoked_sessions: a nonce for one token or
+# "user:<id>" for everything that user was issued before then. it is tiny
+# (rows go away once the tokens they cover would have expired anyway) and
+# every process reloads it in cleanupTask.
+# opaque tokens keep working in both modes, in signed mode /auth/validate
+# hands out a signed replacement and the old ones age out of the tokens table
+SIGNED_TOKEN_PREFIX = "s1."
+USERNAME_QUERY = "SELECT username FROM accounts WHERE user_id = ?"
+SIGNING_KEY_FILE = os.path.join(DATA_DIR, "session_signing.key")
+
+signing_keys = None
+signing_key_id = None
+user_names = OrderedDict()
+revoked_nonces = set()
+revoked_users = {}
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _unb64(data):
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+# "kid:secret,kid:secret" from the env, first one signs new tokens. without
+# it a key is made once and kept next to the db (single server setups)
+def get_signing_keys():
+    global signing_keys, signing_key_id
+    if signing_keys is None:
+        keys = {}
+        for entry in SESSION_SIGNING_KEYS.split(","):
+            if ":" in entry:
+                kid, secret = entry.strip().split(":", 1)
+                keys[kid] = secret.encode()
+        if keys:
+            signing_key_id = next(iter(keys))
         else:
-            username = cached_data.get('username')
-            if username and username in username_to_token:
-                del username_to_token[username]
-            del token_cache[token]
-    result = execute_query(
-        "SELECT username, created FROM tokens WHERE token = ?",
-        (token,), fetch_one=True
-    )
+            signing_key_id = "0"
+            keys[signing_key_id] = _local_signing_key()
+        signing_keys = keys
+    return signing_keys
+
+def _local_signing_key():
+    if not storage.persistent:
+        return secrets.token_bytes(32)
+    os.makedirs(DATA_DIR, exist_ok=True)
+    if not os.path.exists(SIGNING_KEY_FILE):
+        key = secrets.token_bytes(32)
+        with open(SIGNING_KEY_FILE, "wb") as f:
+            f.write(key)
+        os.chmod(SIGNING_KEY_FILE, 0o600)
+        return key
+    with open(SIGNING_KEY_FILE, "rb") as f:
+        return f.read()
+
+def _mac(key, message):
+    return _b64(hmac.new(key, message.encode(), hashlib.sha256).digest())
+
+def signSessionToken(user_id, username, issued=None):
+    keys = get_signing_keys()
+    if issued is None:
+        # issued is whole seconds and revokeUserSessions rejects everything up
+        # to its second, so a token made in that second goes just past it
+        issued = max(int(time.time()), revoked_users.get(user_id, -1) + 1)
+    payload = _b64(f"{user_id}:{int(issued)}:{secrets.token_hex(8)}".encode())
+    message = f"{SIGNED_TOKEN_PREFIX}{signing_key_id}.{payload}"
+    _cache_username(user_id, (username,))
+    return f"{message}.{_mac(keys[signing_key_id], message)}"
+
+# (user_id, issued, nonce) if the mac checks out and it's not expired or
+# revoked, None otherwise
+def verifySignedToken(token):
+    try:
+        message, mac = token.rsplit(".", 1)
+        kid, payload = message[len(SIGNED_TOKEN_PREFIX):].split(".", 1)
+        key = get_signing_keys().get(kid)
+        if not key or not hmac.compare_digest(_mac(key, message), mac):
+            return None
+        user_id, issued, nonce = _unb64(payload).decode().split(":")
+        user_id, issued = int(user_id), int(issued)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if time.time() - issued > TOKEN_MAX_AGE:
+        return None
+    if nonce in revoked_nonces or issued <= revoked_users.get(user_id, -1):
+        return None
+    return user_id, issued, nonce
+
+def _get_cached_username(user_id):
+    username = user_names.get(user_id)
+    if username is not None:
+        user_names.move_to_end(user_id)
+    return username
+
+def _cache_username(user_id, result):
     if not result:
-        return False
-    if currentTime - result[1] > 2592000:
-        return False
-    token_cache[token] = {
-        'username': result[0],
-        'expiry': currentTime + CACHE_TTL,
-        'created': result[1]
-    }
-    username_to_token[result[0]] = token
+        return None
+    _bounded_set(user_names, user_id, result[0], "username_evictions")
+    return result[0]
+
+# after a rename, cached sessions of that user carry the new name
+def renameSessions(user_id, new_username):
+    _rename_cached_sessions(user_id, new_username)
+    shared_state.publish("sessions", ["rename", user_id, new_username])
+
+def _rename_cached_sessions(user_id, new_username):
+    if user_id in user_names:
+        user_names[user_id] = new_username
+    for token_hash, (session, expiry) in token_cache.items():
+        if session.user_id == user_id:
+            token_cache[token_hash] = (session._replace(username=new_username), expiry)
+
+# the Session if it can be resolved without the db (cache or signature),
+# None otherwise. the rate limiter uses it to key by user
+def peekSession(token):
+    if not isinstance(token, str):
+        return None
+    if token.startswith(SIGNED_TOKEN_PREFIX):
+        claims = verifySignedToken(token)
+        username = claims and user_names.get(claims[0])
+        return Session(claims[0], username, claims[1]) if username else None
+    entry = token_cache.get(hash_token(token))
+    if entry and time.time() < entry[1]:
+        return entry[0]
+    return None
+
+REVOKE_QUERY = "INSERT OR REPLACE INTO revoked_sessions (token_id, user_id, revoked, expires) VALUES (?, ?, ?, ?)"
+
+# revoke a single token, signed ones go on the denylist, opaque ones are
+# just deleted
+async def revokeToken(token):
+    if token.startswith(SIGNED_TOKEN_PREFIX):
+        claims = verifySignedToken(token)
+        if not claims:
+            return False
+        user_id, issued, nonce = claims
+        revoked_nonces.add(nonce)
+        shared_state.publish("sessions", ["nonce", nonce])
+        await execute_query_async(REVOKE_QUERY, (nonce, user_id, time.time(), issued + TOKEN_MAX_AGE))
+        return True
+    invalidate_token_cache(token)
+    await execute_query_async("DELETE FROM tokens WHERE token = ?", (hash_token(token),))
     return True
 
-def getUsernameFromToken(token):
-    currentTime = time.time()
-    if token in token_cache:
-        cached_data = token_cache[token]
-        if currentTime < cached_data['expiry']:
-            return cached_data['username']
+# every token issued to the user until now, signed and opaque
+async def revokeUserSessions(user_id, username):
+    now = time.time()
+    revoked_users[user_id] = int(now)
+    await execute_query_async(REVOKE_QUERY, (f"user:{user_id}", user_id, int(now), now + TOKEN_MAX_AGE))
+    await execute_query_async("DELETE FROM tokens WHERE username = ?", (username,))
+    _drop_user_sessions(user_id)
+    shared_state.publish("sessions", ["user", user_id, int(now)])
+
+# new login token in the configured SESSION_TOKEN_FORMAT
+async def issueSession(user_id, username):
+    if SESSION_TOKEN_FORMAT == "signed":
+        return signSessionToken(user_id, username)
+    token = secrets.token_urlsafe(32)
+    invalidate_token_hashes(await save_token_async(token, username))
+    cacheSession(token, user_id, username)
+    return token
+
+def _drop_user_sessions(user_id):
+    for token_hash in [token_hash for token_hash, (session, _) in token_cache.items() if session.user_id == user_id]:
+        del token_cache[token_hash]
+
+# drop expired denylist rows and pick up ones written by other processes
+async def refreshRevocations():
+    global revoked_nonces, revoked_users
+    now = time.time()
+    await execute_query_async("DELETE FROM revoked_sessions WHERE expires < ?", (now,))
+    rows = await execute_query_async("SELECT token_id, user_id, revoked FROM revoked_sessions WHERE expires >= ?",
+                                     (now,), fetch_all=True)
+    nonces = set()
+    users = {}
+    for token_id, user_id, revoked in rows or ():
+        if token_id.startswith("user:"):
+            users[user_id] = max(users.get(user_id, -1), int(revoked))
         else:
-            username = cached_data.get('username')
-            if username and username in username_to_token:
-                del username_to_token[username]
-            del token_cache[token]
-    result = execute_query(
-        "SELECT username, created FROM tokens WHERE token = ?",
-        (token,), fetch_one=True
-    )
-    if result:
-        token_cache[token] = {
-            'username': result[0],
-            'expiry': currentTime + CACHE_TTL,
-            'created': result[1]
-        }
-        username_to_token[result[0]] = token
-        return result[0]
-    return None
+            nonces.add(token_id)
+    revoked_nonces, revoked_users = nonces, users
+
+def get_revocation_stats():
+    return {"format": SESSION_TOKEN_FORMAT, "revoked_tokens": len(revoked_nonces),
+            "revoked_users": len(revoked_users), "usernames_cached": len(user_names)}
+
+# pbkdf2 runs on its own small pool instead of the event loop (100k rounds
+# is ~50ms of cpu). hashlib drops the GIL while it works, so threads hash
+# in parallel. past PASSWORD_HASH_MAX_PENDING queued+running jobs the
+# async versions raise PasswordHashBusy and handlers answer 503
+PASSWORD_HASH_ITERATIONS = int(os.environ.get("PASSWORD_HASH_ITERATIONS", 100000))
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", os.cpu_count() or 2))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 64))
+# hashes without an iteration count ("salt:hash") are from before it was stored
+LEGACY_HASH_ITERATIONS = 100000
+
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="pwhash_")
+password_jobs = 0
+password_stats = {"jobs": 0, "rejected": 0, "rehashed": 0}
+
+class PasswordHashBusy(Exception):
+    pass
+
+def _pbkdf2(password, salt, iterations):
+    password_hash = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), iterations)
+    return base64.b64encode(password_hash).decode()
+
+# stored as "iterations:salt:hash"
+def hashPassword(password):
+    salt = secrets.token_hex(16)
+    return f"{PASSWORD_HASH_ITERATIONS}:{salt}:{_pbkdf2(password, salt, PASSWORD_HASH_ITERATIONS)}"
+
+def _parseHash(stored_hash):
+    parts = stored_hash.split(":")
+    if len(parts) == 2:
+        return LEGACY_HASH_ITERATIONS, parts[0], parts[1]
+    return int(parts[0]), parts[1], parts[2]
+
+def verifyPassword(password, stored_hash):
+    try:
+        iterations, salt, hash_part = _parseHash(stored_hash)
+        return hmac.compare_digest(_pbkdf2(password, salt, iterations), hash_part)
+    except:
+        return False
+
+def needsRehash(stored_hash):
+    try:
+        return _parseHash(stored_hash)[0] != PASSWORD_HASH_ITERATIONS
+    except:
+        return False
+
+# verify, and if the hash was made with another work factor hash it again
+# in the same job. returns (valid, new_hash or None)
+def checkPassword(password, stored_hash):
+    if not verifyPassword(password, stored_hash):
+        return False, None
+    if needsRehash(stored_hash):
+        return True, hashPassword(password)
+    return True, None
+
+async def _runPasswordJob(func, *args):
+    global password_jobs
+    if password_jobs >= PASSWORD_HASH_MAX_PENDING:
+        password_stats["rejected"] += 1
+        raise PasswordHashBusy()
+    password_jobs += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(password_executor, func, *args)
+    finally:
+        password_jobs -= 1
+        password_stats["jobs"] += 1
+
+async def hashPasswordAsync(password):
+    return await _runPasswordJob(hashPassword, password)
+
+async def checkPasswordAsync(password, stored_hash):
+    valid, new_hash = await _runPasswordJob(checkPassword, password, stored_hash)
+    if new_hash:
+        password_stats["rehashed"] += 1
+    return valid, new_hash
+
+def get_password_pool_stats():
+    stats = dict(password_stats)
+    stats.update({
+        "pending": password_jobs,
+        "max_pending": PASSWORD_HASH_MAX_PENDING,
+        "workers": PASSWORD_HASH_WORKERS,
+        "iterations": PASSWORD_HASH_ITERATIONS
+    })
+    return stats
 
 def invalidate_token_cache(token):
-    if token in token_cache:
-        username = token_cache[token].get('username')
-        if username and username in username_to_token:
-            del username_to_token[username]
-        del token_cache[token]
+    invalidate_token_hashes([hash_token(token)])
+
+# sessions game_database.save_token evicted for the per user cap
+def invalidate_token_hashes(token_hashes):
+    for token_hash in token_hashes:
+        token_cache.pop(token_hash, None)
+    if token_hashes:
+        shared_state.publish("sessions", ["drop", [token_hash.hex() for token_hash in token_hashes]])
+
+# what another worker did to its sessions, applied to ours
+def _apply_session_event(event):
+    kind = event[0]
+    if kind == "drop":
+        for token_hash in event[1]:
+            token_cache.pop(bytes.fromhex(token_hash), None)
+    elif kind == "nonce":
+        revoked_nonces.add(event[1])
+    elif kind == "user":
+        revoked_users[event[1]] = max(revoked_users.get(event[1], -1), event[2])
+        _drop_user_sessions(event[1])
+    elif kind == "rename":
+        _rename_cached_sessions(event[1], event[2])
+
+shared_state.subscribe("sessions", _apply_session_event)
 
 def clear_token_cache():
-    global token_cache, username_to_token
     token_cache.clear()
-    username_to_token.clear()
+    negative_token_cache.clear()
 
 def get_cached_token_count():
     return len(token_cache)
+
+def get_token_cache_stats():
+    stats = dict(token_cache_stats)
+    stats.update({
+        "size": len(token_cache),
+        "negative_size": len(negative_token_cache),
+        "max_size": TOKEN_CACHE_SIZE
+    })
+    return stats
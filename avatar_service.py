@@ -4,24 +4,38 @@ import time
 import re
 from typing import Dict, List, Any, Optional
 from config import (
-    SERVER_PUBLIC_IP,
+    get_server_public_ip,
     VOLUME_PATH,
     MODELS_DIR,
-    ICONS_DIR
+    ICONS_DIR,
+    CACHE_TTL
 )
 from game_database import (
+    Accessory,
     get_accessory,
     save_accessory as fb_save_accessory,
     list_accessories,
     delete_accessory as fb_delete_accessory,
-    save_accessory_purchase,
-    get_next_accessory_id
+    get_next_accessory_id,
+    get_accessory_async,
+    buy_accessory_async,
+    SAVE_ACCESSORY_PURCHASE_QUERY
 )
 from player_save_tracker import save_tracker
 import asyncio
+import shared_state
 
 accessory_cache = {}
 
+def invalidate_accessory_cache(accessoryId: int):
+    _drop_accessory_cache(accessoryId)
+    shared_state.publish("accessory_cache", accessoryId)
+
+def _drop_accessory_cache(accessoryId: int):
+    accessory_cache.pop(f"accessory_{accessoryId}", None)
+
+shared_state.subscribe("accessory_cache", _drop_accessory_cache)
+
 def loadAccessoriesData():
     pass
 
@@ -118,15 +132,15 @@ def updateAccessoryFromDashboard(accessory_id: int, name: str = None, accessory_
     os.makedirs(ICONS_DIR, exist_ok=True)
 
     try:
-        updated_name = name if name is not None else existing.get("name")
-        updated_type = accessory_type if accessory_type is not None else existing.get("type")
-        updated_price = price if price is not None else existing.get("price")
-        updated_slot = equip_slot if equip_slot is not None else existing.get("equip_slot")
+        updated_name = name if name is not None else existing.name
+        updated_type = accessory_type if accessory_type is not None else existing.type
+        updated_price = price if price is not None else existing.price
+        updated_slot = equip_slot if equip_slot is not None else existing.equip_slot
 
-        model_path = existing.get("model_file")
-        texture_path = existing.get("texture_file")
-        mtl_path = existing.get("mtl_file")
-        icon_path = existing.get("icon_file")
+        model_path = existing.model_file
+        texture_path = existing.texture_file
+        mtl_path = existing.mtl_file
+        icon_path = existing.icon_file
 
         new_texture_filename = None
 
@@ -208,9 +222,7 @@ def updateAccessoryFromDashboard(accessory_id: int, name: str = None, accessory_
             model_path, texture_path or "", mtl_path or "", updated_slot, icon_path or ""
         )
 
-        cacheKey = f"accessory_{accessory_id}"
-        if cacheKey in accessory_cache:
-            del accessory_cache[cacheKey]
+        invalidate_accessory_cache(accessory_id)
 
         return {"success": True, "data": {"accessoryId": accessory_id, "name": updated_name}}
 
@@ -219,8 +231,7 @@ def updateAccessoryFromDashboard(accessory_id: int, name: str = None, accessory_
         traceback.print_exc()
         return {"success": False, "error": str(e)}
 
-def getAccessory(accessoryId: int) -> Optional[Dict[str, Any]]:
-    currentTime = time.time()
+def _getCachedAccessory(accessoryId: int, currentTime: float) -> Optional[Dict[str, Any]]:
     cacheKey = f"accessory_{accessoryId}"
 
     if cacheKey in accessory_cache:
@@ -229,67 +240,87 @@ def getAccessory(accessoryId: int) -> Optional[Dict[str, Any]]:
             return cached_data
         else:
             del accessory_cache[cacheKey]
+    return None
 
-    result = get_accessory(accessoryId)
-
-    if not result:
-        return None
-
+def _accessoryItem(result: Accessory) -> Dict[str, Any]:
     port = os.environ.get('PORT', 8080)
     accessory = {
-        "id": result.get("accessory_id"),
-        "name": result.get("name"),
-        "type": result.get("type"),
-        "price": result.get("price"),
-        "modelFile": result.get("model_file"),
-        "textureFile": result.get("texture_file"),
-        "mtlFile": result.get("mtl_file"),
-        "equipSlot": result.get("equip_slot"),
-        "iconFile": result.get("icon_file"),
-        "createdAt": result.get("created_at")
+        "id": result.accessory_id,
+        "name": result.name,
+        "type": result.type,
+        "price": result.price,
+        "modelFile": result.model_file,
+        "textureFile": result.texture_file,
+        "mtlFile": result.mtl_file,
+        "equipSlot": result.equip_slot,
+        "iconFile": result.icon_file,
+        "createdAt": result.created_at
     }
 
     if accessory["modelFile"]:
         relative_path = os.path.relpath(accessory["modelFile"], VOLUME_PATH)
-        accessory["downloadUrl"] = f"http://{SERVER_PUBLIC_IP}:{port}/{relative_path}"
+        accessory["downloadUrl"] = f"http://{get_server_public_ip()}:{port}/{relative_path}"
 
     if accessory["textureFile"]:
         relative_path = os.path.relpath(accessory["textureFile"], VOLUME_PATH)
-        accessory["textureUrl"] = f"http://{SERVER_PUBLIC_IP}:{port}/{relative_path}"
+        accessory["textureUrl"] = f"http://{get_server_public_ip()}:{port}/{relative_path}"
 
     if accessory["mtlFile"]:
         relative_path = os.path.relpath(accessory["mtlFile"], VOLUME_PATH)
-        accessory["mtlUrl"] = f"http://{SERVER_PUBLIC_IP}:{port}/{relative_path}"
+        accessory["mtlUrl"] = f"http://{get_server_public_ip()}:{port}/{relative_path}"
 
     if accessory["iconFile"]:
         relative_path = os.path.relpath(accessory["iconFile"], VOLUME_PATH)
-        accessory["iconUrl"] = f"http://{SERVER_PUBLIC_IP}:{port}/{relative_path}"
+        accessory["iconUrl"] = f"http://{get_server_public_ip()}:{port}/{relative_path}"
+
+    return accessory
 
-    accessory_cache[cacheKey] = (accessory, currentTime + CACHE_TTL)
+def _cacheAccessoryRow(accessoryId: int, result: Accessory, currentTime: float) -> Dict[str, Any]:
+    accessory = _accessoryItem(result)
+    accessory_cache[f"accessory_{accessoryId}"] = (accessory, currentTime + CACHE_TTL)
     return accessory
 
+def getAccessory(accessoryId: int) -> Optional[Dict[str, Any]]:
+    currentTime = time.time()
+    cached = _getCachedAccessory(accessoryId, currentTime)
+    if cached is not None:
+        return cached
+
+    result = get_accessory(accessoryId)
+
+    if not result:
+        return None
+
+    return _cacheAccessoryRow(accessoryId, result, currentTime)
+
+async def getAccessoryAsync(accessoryId: int) -> Optional[Dict[str, Any]]:
+    currentTime = time.time()
+    cached = _getCachedAccessory(accessoryId, currentTime)
+    if cached is not None:
+        return cached
+
+    result = await get_accessory_async(accessoryId)
+
+    if not result:
+        return None
+
+    return _cacheAccessoryRow(accessoryId, result, currentTime)
+
 def checkItemOwnership(userId: int, itemId: int) -> bool:
-    from player_data import getPlayerData
+    from player_data import getPlayerRow
 
-    playerData = getPlayerData(userId)
-    if not playerData:
+    row = getPlayerRow(userId)
+    if not row:
         return False
 
-    owned_accessories = playerData.get("ownedAccessories", [])
-    if isinstance(owned_accessories, str):
-        try:
-            owned_accessories = json.loads(owned_accessories)
-        except:
-            owned_accessories = []
-
-    return itemId in owned_accessories
+    return itemId in row.owned_accessories
 
 async def buyItem(userId: int, itemId: int) -> Dict[str, Any]:
-    from currency_system import debitCurrency
-    from player_data import getPlayerData, savePlayerData
+    from currency_system import _invalidate_currency_cache
+    from player_data import getPlayerDataAsync, getPlayerRowAsync, invalidate_player_cache
 
     try:
-        playerData = getPlayerData(userId)
+        playerData = await getPlayerDataAsync(userId)
         if not playerData:
             return {"success": False, "error": {"code": "USER_NOT_FOUND", "message": "User not found"}}
 
@@ -300,32 +331,42 @@ async def buyItem(userId: int, itemId: int) -> Dict[str, Any]:
             except:
                 owned = []
 
-        if "ownedAccessories" not in playerData:
-            playerData["ownedAccessories"] = []
-
         if itemId in owned:
             return {"success": False, "error": {"code": "ALREADY_OWNED", "message": "Item already owned"}}
 
-        accessory = getAccessory(itemId)
+        accessory = await getAccessoryAsync(itemId)
         if not accessory:
             return {"success": False, "error": {"code": "ITEM_NOT_FOUND", "message": "Item not found"}}
 
         price = accessory.get("price", 0)
 
-        debitResult = await debitCurrency(userId, price)
-        if not debitResult["success"]:
-            return debitResult
-
-        owned.append(itemId)
-        playerData["ownedAccessories"] = owned
+        currentCurrency = playerData.get("currency", 0)
+        if currentCurrency < price:
+            return {"success": False, "error": {"code": "INSUFFICIENT_FUNDS", "message": "Not enough currency"}}
 
+        # debit, ownership and the purchase record go out in one transaction,
+        # a crash between them used to leave the item paid for but not owned.
+        # the checks above are against a cached read, buy_accessory repeats
+        # them in sql so two purchases at once can't spend the same balance
         save_id = await save_tracker.start_save(userId, "buy_item")
-        await savePlayerData(userId, playerData)
-        await save_tracker.complete_save(save_id, success=True)
-
-        save_accessory_purchase(userId, itemId, price)
-
-        return {"success": True, "data": {"itemId": itemId, "price": price, "newBalance": debitResult["data"]["newBalance"]}}
+        try:
+            newBalance = await buy_accessory_async(userId, itemId, price, extra_statements=[
+                (SAVE_ACCESSORY_PURCHASE_QUERY, (userId, itemId, price, time.time()))
+            ])
+        except Exception:
+            await save_tracker.complete_save(save_id, success=False)
+            raise
+        await save_tracker.complete_save(save_id, success=newBalance is not None)
+        invalidate_player_cache(userId)
+        _invalidate_currency_cache(userId)
+
+        if newBalance is None:
+            row = await getPlayerRowAsync(userId)
+            if row and itemId in row.owned_accessories:
+                return {"success": False, "error": {"code": "ALREADY_OWNED", "message": "Item already owned"}}
+            return {"success": False, "error": {"code": "INSUFFICIENT_FUNDS", "message": "Not enough currency"}}
+
+        return {"success": True, "data": {"itemId": itemId, "price": price, "newBalance": newBalance}}
     except Exception as e:
         print(f"Error in buyItem: {e}")
         import traceback
@@ -333,19 +374,20 @@ async def buyItem(userId: int, itemId: int) -> Dict[str, Any]:
         return {"success": False, "error": {"code": "PURCHASE_FAILED", "message": str(e)}}
 
 async def equipAccessory(userId: int, accessoryId: int) -> Dict[str, Any]:
-    from player_data import getPlayerData, savePlayerData
+    from player_data import getPlayerDataAsync, savePlayerData
+
+    playerData = await getPlayerDataAsync(userId)
+    if not playerData:
+        return {"success": False, "error": {"code": "NOT_OWNED", "message": "Accessory not owned"}}
 
+    # loaded above, so this is a cache hit
     if not checkItemOwnership(userId, accessoryId):
         return {"success": False, "error": {"code": "NOT_OWNED", "message": "Accessory not owned"}}
 
-    accessory = getAccessory(accessoryId)
+    accessory = await getAccessoryAsync(accessoryId)
     if not accessory:
         return {"success": False, "error": {"code": "ITEM_NOT_FOUND", "message": "Accessory not found"}}
 
-    playerData = getPlayerData(userId)
-    if not playerData:
-        return {"success": False, "error": {"code": "USER_NOT_FOUND", "message": "User not found"}}
-
     avatar = playerData.get("avatar", {})
     if isinstance(avatar, str):
         try:
@@ -382,9 +424,9 @@ async def equipAccessory(userId: int, accessoryId: int) -> Dict[str, Any]:
     return {"success": True, "data": {"equippedAccessory": accessoryId, "slot": equipSlot}}
 
 async def unequipAccessory(userId: int, accessoryId: int) -> Dict[str, Any]:
-    from player_data import getPlayerData, savePlayerData
+    from player_data import getPlayerDataAsync, savePlayerData
 
-    playerData = getPlayerData(userId)
+    playerData = await getPlayerDataAsync(userId)
     if not playerData:
         return {"success": False, "error": {"code": "USER_NOT_FOUND", "message": "User not found"}}
 
@@ -418,52 +460,19 @@ def listMarketItems(filter: Optional[Dict] = None, pagination: Optional[Dict] =
             filters.append(("price", "<=", filter["maxPrice"]))
 
     results = list_accessories(filters if filters else None)
+    # sort and page the records first, only the returned page becomes dicts
+    results.sort(key=lambda x: (x.name, x.accessory_id))
 
-    items = []
-    port = os.environ.get('PORT', 8080)
-
-    for result in results:
-        item = {
-            "id": result.get("accessory_id"),
-            "name": result.get("name"),
-            "type": result.get("type"),
-            "price": result.get("price"),
-            "modelFile": result.get("model_file"),
-            "textureFile": result.get("texture_file"),
-            "mtlFile": result.get("mtl_file"),
-            "equipSlot": result.get("equip_slot"),
-            "iconFile": result.get("icon_file"),
-            "createdAt": result.get("created_at")
-        }
-
-        if item["modelFile"]:
-            relative_path = os.path.relpath(item["modelFile"], VOLUME_PATH)
-            item["downloadUrl"] = f"http://{SERVER_PUBLIC_IP}:{port}/{relative_path}"
-
-        if item["textureFile"]:
-            relative_path = os.path.relpath(item["textureFile"], VOLUME_PATH)
-            item["textureUrl"] = f"http://{SERVER_PUBLIC_IP}:{port}/{relative_path}"
-
-        if item["mtlFile"]:
-            relative_path = os.path.relpath(item["mtlFile"], VOLUME_PATH)
-            item["mtlUrl"] = f"http://{SERVER_PUBLIC_IP}:{port}/{relative_path}"
-
-        if item["iconFile"]:
-            relative_path = os.path.relpath(item["iconFile"], VOLUME_PATH)
-            item["iconUrl"] = f"http://{SERVER_PUBLIC_IP}:{port}/{relative_path}"
-
-        items.append(item)
-
-    items.sort(key=lambda x: (x["name"], x["id"]))
-
-    totalItems = len(items)
+    totalItems = len(results)
 
     if pagination:
         page = pagination.get("page", 1)
         limit = pagination.get("limit", 20)
         start = (page - 1) * limit
         end = start + limit
-        items = items[start:end]
+        results = results[start:end]
+
+    items = [_accessoryItem(result) for result in results]
 
     return {
         "success": True,
@@ -476,20 +485,14 @@ def listMarketItems(filter: Optional[Dict] = None, pagination: Optional[Dict] =
     }
 
 def getUserAccessories(userId: int) -> List[int]:
-    from player_data import getPlayerData
+    from player_data import getPlayerRow
 
-    playerData = getPlayerData(userId)
-    if not playerData:
+    row = getPlayerRow(userId)
+    if not row:
         return []
 
-    owned = playerData.get("ownedAccessories", [])
-    if isinstance(owned, str):
-        try:
-            owned = json.loads(owned)
-        except:
-            owned = []
-
-    return owned
+    # the cached list is shared, callers get their own
+    return list(row.owned_accessories)
 
 def deleteAccessory(accessoryId: int) -> Dict[str, Any]:
     result = get_accessory(accessoryId)
@@ -498,10 +501,10 @@ def deleteAccessory(accessoryId: int) -> Dict[str, Any]:
         return {"success": False, "error": "Accessory not found"}
 
     files_to_delete = [
-        result.get("model_file"),
-        result.get("texture_file"),
-        result.get("mtl_file"),
-        result.get("icon_file")
+        result.model_file,
+        result.texture_file,
+        result.mtl_file,
+        result.icon_file
     ]
 
     for file_path in files_to_delete:
@@ -515,9 +518,7 @@ def deleteAccessory(accessoryId: int) -> Dict[str, Any]:
 
     fb_delete_accessory(accessoryId)
 
-    cacheKey = f"accessory_{accessoryId}"
-    if cacheKey in accessory_cache:
-        del accessory_cache[cacheKey]
+    invalidate_accessory_cache(accessoryId)
 
     return {"success": True, "data": {"deletedId": accessoryId}}
 
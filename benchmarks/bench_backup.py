@@ -0,0 +1,68 @@
+# online backup of a seeded db while a writer thread keeps saving,
+# reports backup throughput and the writer's latency during vs. without it
+#
+#   python benchmarks/bench_backup.py [rows] [pages_per_step]
+import os
+import sys
+import time
+import threading
+
+rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+if len(sys.argv) > 2:
+    os.environ["DB_BACKUP_STEP_PAGES"] = sys.argv[2]
+
+from bench_env import setup_sandbox
+
+setup_sandbox("backup")
+
+import database_manager
+import db_backup
+from game_database import save_datastore
+
+def pct(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000 if samples else 0
+
+def write_for(seconds=None, until=None):
+    samples = []
+    i = 0
+    end = time.perf_counter() + seconds if seconds else None
+    while (end and time.perf_counter() < end) or (until and not until.is_set()):
+        start = time.perf_counter()
+        save_datastore(f"w{i}", "y" * 500)
+        samples.append(time.perf_counter() - start)
+        i += 1
+    return samples
+
+def main():
+    conn = database_manager.get_connection()
+    conn.executemany("INSERT INTO datastores (key, value, timestamp) VALUES (?, ?, 0)",
+                     ((f"k{i}", "x" * 500) for i in range(rows)))
+    conn.commit()
+
+    idle = write_for(seconds=1.0)
+
+    done = threading.Event()
+    busy = []
+    t = threading.Thread(target=lambda: busy.extend(write_for(until=done)))
+    t.start()
+    result = db_backup.backup_database()
+    done.set()
+    t.join()
+
+    data = result["data"]
+    print(f"backup {data['bytes'] / 1048576:.1f}MB, {data['pages']} pages in {data['steps']} steps, "
+          f"{data['duration_s']}s, {data['mb_per_s']}MB/s")
+    print(f"writer p50/p99 idle   {pct(idle, 0.5):.2f}/{pct(idle, 0.99):.2f}ms")
+    print(f"writer p50/p99 backup {pct(busy, 0.5):.2f}/{pct(busy, 0.99):.2f}ms ({len(busy)} writes)")
+
+    verified = db_backup.verify_backup(data["file"])
+    print(f"verify: {verified['data']['integrity']} in {verified['data']['duration_s']}s, "
+          f"datastores={verified['data']['tables']['datastores']}")
+
+    restored = db_backup.restore_backup(data["file"])
+    count = sum(row[0] for row in database_manager.execute_all_shards("SELECT COUNT(*) FROM datastores", fetch_all=True))
+    print(f"restore: {restored['data']['integrity']}, datastores={count}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# client cold start over a slow link: the seven startup calls one after
+# another vs a single /batch. each request pays the simulated round trip
+# (half before sending, half after the reply). main.py can't be imported
+# without the moderation deps, so /auth/validate and /maintenance_status are
+# small stand-ins here, the rest are the real api_extensions handlers
+#
+#   python benchmarks/bench_batch.py [rtt_ms] [rounds]
+import sys
+import json
+import time
+import asyncio
+
+from bench_env import setup_sandbox
+
+setup_sandbox("batch")
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer, TestClient
+
+import api_extensions
+from json_codec import json_response
+from request_pipeline import endpoint, rate_limit_middleware, addBatchRoute
+from game_database import save_account, save_token, save_player_data, save_friend
+from player_data import ensurePlayerDataDefaults
+
+STARTUP = [
+    ("POST", "/auth/validate"),
+    ("POST", "/player/get_profile"),
+    ("POST", "/currency/get"),
+    ("POST", "/friends/get"),
+    ("POST", "/friends/get_requests"),
+    ("POST", "/avatar/get_full"),
+    ("GET", "/maintenance_status"),
+]
+
+@endpoint()
+async def validateStandIn(request, ctx):
+    return json_response({"status": "valid", "username": ctx.username, "user_id": ctx.user_id})
+
+async def maintenanceStandIn(request):
+    return json_response({"maintenance": False, "message": ""})
+
+def seed():
+    user_id = save_account("batch_user", "x", "none")
+    save_player_data(user_id, ensurePlayerDataDefaults({"userId": user_id, "username": "batch_user"}))
+    for i in range(50):
+        save_friend(user_id, save_account(f"friend_{i}", "x", "none"))
+    save_token("batch_token", "batch_user")
+    return "batch_token"
+
+def make_app():
+    app = web.Application(middlewares=[rate_limit_middleware])
+    app.router.add_post("/auth/validate", validateStandIn)
+    app.router.add_get("/maintenance_status", maintenanceStandIn)
+    app.router.add_post("/global_messages", maintenanceStandIn)
+    api_extensions.addNewRoutes(app)
+    addBatchRoute(app)
+    return app
+
+async def call(client, rtt, method, path, data=None):
+    await asyncio.sleep(rtt / 2)
+    async with client.request(method, path, data=data, headers={"Content-Type": "application/json"}) as response:
+        body = await response.read()
+        assert response.status == 200, (path, response.status, body)
+    await asyncio.sleep(rtt / 2)
+    return body
+
+async def sequential(client, rtt, token):
+    for method, path in STARTUP:
+        await call(client, rtt, method, path, json.dumps({"token": token}) if method == "POST" else None)
+
+async def batched(client, rtt, token):
+    operations = [{"path": path} for _, path in STARTUP]
+    body = json.loads(await call(client, rtt, "POST", "/batch", json.dumps({"token": token, "operations": operations})))
+    assert [result["status"] for result in body["results"]] == [200] * len(STARTUP), body
+
+async def main():
+    rtt = (float(sys.argv[1]) if len(sys.argv) > 1 else 150) / 1000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    token = seed()
+    async with TestClient(TestServer(make_app())) as client:
+        print(f"cold start, {len(STARTUP)} calls, {rtt * 1000:.0f} ms rtt")
+        for name, run in (("sequential", sequential), ("batch", batched)):
+            best = float("inf")
+            for _ in range(rounds):
+                start = time.perf_counter()
+                await run(client, rtt, token)
+                best = min(best, time.perf_counter() - start)
+            print(f"{name:<11} {best * 1000:>7.0f} ms")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+# compression_middleware on the real large payloads (a full market page, a
+# full profile) plus a small one under COMPRESS_MIN_SIZE. req/s and bytes on
+# the wire for a gzip client, without and with the middleware
+#
+#   python benchmarks/bench_compression.py [concurrency] [seconds]
+import sys
+import asyncio
+import random
+
+from bench_env import setup_sandbox
+
+setup_sandbox("compression")
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer, TestClient
+
+from json_codec import json_response
+from response_compression import compression_middleware, get_compression_stats
+from game_database import save_account, save_accessory, save_accessory_purchase, save_friend, save_player_data
+from avatar_service import listMarketItems
+from player_data import ensurePlayerDataDefaults, getPlayerFullProfile
+
+ACCESSORIES = 500
+MIX = [("/market", 40), ("/profile", 30), ("/small", 30)]
+
+def seed():
+    rnd = random.Random(1)
+    for i in range(ACCESSORIES):
+        save_accessory(i + 1, f"Accessory {i}", rnd.choice(["hat", "shirt", "face", "back"]), rnd.randrange(10, 5000),
+                       f"models/{i}.glb", f"textures/{i}.png", f"models/{i}.mtl", "head", f"icons/{i}.png")
+    user_id = save_account("gzip_user", "x", "none")
+    for i in range(100):
+        save_friend(user_id, save_account(f"friend_{i}", "x", "none"))
+    for i in range(0, ACCESSORIES, 3):
+        save_accessory_purchase(user_id, i + 1, 100)
+    save_player_data(user_id, ensurePlayerDataDefaults({"userId": user_id, "username": "gzip_user"}))
+    return user_id
+
+def make_app(middlewares, user_id):
+    market = listMarketItems(None, {"page": 1, "limit": ACCESSORIES})
+    profile = getPlayerFullProfile(user_id)
+
+    async def marketView(request):
+        return json_response(market)
+
+    async def profileView(request):
+        return json_response(profile)
+
+    async def smallView(request):
+        return json_response({"success": True, "currency": 1234})
+
+    app = web.Application(middlewares=middlewares)
+    app.router.add_get("/market", marketView)
+    app.router.add_get("/profile", profileView)
+    app.router.add_get("/small", smallView)
+    return app
+
+async def client_loop(client, stop, counts, rnd):
+    paths = [path for path, weight in MIX for _ in range(weight)]
+    while not stop.is_set():
+        async with client.get(rnd.choice(paths), headers={"Accept-Encoding": "gzip, br"}, auto_decompress=False) as response:
+            body = await response.read()
+            counts["requests"] += 1
+            counts["bytes"] += len(body)
+
+async def run(app, concurrency, seconds):
+    async with TestClient(TestServer(app)) as client:
+        stop = asyncio.Event()
+        counts = {"requests": 0, "bytes": 0}
+        tasks = [asyncio.create_task(client_loop(client, stop, counts, random.Random(i))) for i in range(concurrency)]
+        await asyncio.sleep(seconds)
+        stop.set()
+        await asyncio.gather(*tasks)
+    return counts["requests"] / seconds, counts["bytes"] / counts["requests"] / 1024
+
+async def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    user_id = seed()
+    print(f"{concurrency} clients, {seconds}s")
+    for name, middlewares in (("plain", []), ("compressed", [compression_middleware])):
+        rate, kb = await run(make_app(middlewares, user_id), concurrency, seconds)
+        print(f"{name:<11} {rate:>7.0f} req/s {kb:>7.1f} KB/response")
+    for route, stats in get_compression_stats()["routes"].items():
+        print(f"  {route:<9} {stats}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,20 @@
+# shared setup for the benchmark scripts
+# every module here writes relative to the cwd (server_data/) and config.py
+# asks ipify for the public ip on first use, so we move into a scratch dir
+# and pin the ip first
+# DB_BACKEND=memory runs any of them on in-memory sqlite, no disk I/O
+# (bench_backup needs the default sqlite backend)
+import os
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def setup_sandbox(name: str) -> str:
+    work_dir = tempfile.mkdtemp(prefix=f"bloxon_{name}_")
+    os.environ.setdefault("SERVER_PUBLIC_IP", "127.0.0.1")
+    os.environ.setdefault("VOLUME_PATH", os.path.join(work_dir, "volume"))
+    os.chdir(work_dir)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    return work_dir
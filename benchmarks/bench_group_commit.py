@@ -0,0 +1,56 @@
+# datastore write throughput: one commit per statement (execute_query on the
+# executor) vs the group commit writer at a few batch sizes
+#
+#   python benchmarks/bench_group_commit.py [concurrent_writers] [seconds] [--full-sync]
+import sys
+import time
+import asyncio
+
+from bench_env import setup_sandbox
+
+setup_sandbox("group_commit")
+
+import database_manager
+from database_manager import execute_query_async, GroupCommitWriter
+from game_database import SAVE_DATASTORE_QUERY, save_datastore_async
+
+async def per_statement(i):
+    await execute_query_async(SAVE_DATASTORE_QUERY, (f"bench:{i % 5000}", "x" * 64, time.time()))
+
+async def grouped(i):
+    await save_datastore_async(f"bench:{i % 5000}", "x" * 64)
+
+async def run(write_fn, writers: int, seconds: float) -> float:
+    stop = asyncio.Event()
+    done = [0]
+
+    async def writer(idx):
+        i = idx
+        while not stop.is_set():
+            await write_fn(i)
+            i += writers
+            done[0] += 1
+
+    tasks = [asyncio.create_task(writer(i)) for i in range(writers)]
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return done[0] / seconds
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    writers = int(args[0]) if len(args) > 0 else 64
+    seconds = float(args[1]) if len(args) > 1 else 3.0
+
+    if "--full-sync" in sys.argv:
+        database_manager.get_connection().execute("PRAGMA synchronous=FULL")
+
+    print(f"{writers} concurrent writers, {seconds:.0f}s each")
+    baseline = asyncio.run(run(per_statement, writers, seconds))
+    print(f"  commit per statement   : {baseline:9.0f} writes/s")
+
+    for max_ops in (1, 16, 256):
+        database_manager.group_writer = GroupCommitWriter(max_ops, database_manager.GROUP_COMMIT_INTERVAL)
+        rate = asyncio.run(run(grouped, writers, seconds))
+        stats = database_manager.group_writer.get_stats()
+        print(f"  group commit max {max_ops:<5d} : {rate:9.0f} writes/s  ({rate / baseline:.2f}x, avg batch {stats['avg_batch']})")
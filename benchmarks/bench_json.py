@@ -0,0 +1,87 @@
+# stdlib json vs json_codec (orjson when installed) on the payloads we
+# actually send: a full market page, a full player profile, the dashboard
+# and a global message broadcast. encode is what json_response does, decode
+# is what readBody does with a request of the same shape
+#
+#   python benchmarks/bench_json.py [rounds]
+import sys
+import json
+import time
+import random
+
+from bench_env import setup_sandbox
+
+setup_sandbox("json")
+
+import json_codec
+from game_database import save_account, save_accessory, save_accessory_purchase, save_friend, save_player_data
+from avatar_service import listMarketItems
+from player_data import ensurePlayerDataDefaults, getPlayerFullProfile
+
+ACCESSORIES = 500
+FRIENDS = 150
+
+def seed():
+    rnd = random.Random(1)
+    for i in range(ACCESSORIES):
+        save_accessory(i + 1, f"Accessory {i}", rnd.choice(["hat", "shirt", "face", "back"]), rnd.randrange(10, 5000),
+                       f"models/{i}.glb", f"textures/{i}.png", f"models/{i}.mtl", "head", f"icons/{i}.png")
+    user_id = save_account("json_user", "x", "none")
+    for i in range(FRIENDS):
+        save_friend(user_id, save_account(f"friend_{i}", "x", "none"))
+    for i in range(0, ACCESSORIES, 3):
+        save_accessory_purchase(user_id, i + 1, 100)
+    avatar = {"colors": {part: "#a0b0c0" for part in ("head", "torso", "left_arm", "right_arm", "left_leg", "right_leg")},
+              "accessories": list(range(1, 9))}
+    save_player_data(user_id, ensurePlayerDataDefaults({"userId": user_id, "username": "json_user", "avatar": avatar}))
+    return user_id
+
+def dashboard_payload():
+    rnd = random.Random(2)
+    vms = [{"vm_id": f"vm-{i:04x}", "ip": f"10.0.{i}.1", "status": "running", "created": time.time(),
+            "servers": [{"uid": f"{i}-{j}", "port": 9000 + j, "players": rnd.randrange(0, 20),
+                         "max_players": 20, "last_heartbeat": time.time()} for j in range(6)]}
+           for i in range(40)]
+    return {
+        "stats": {"total_vms": 40, "active_vms": 40, "total_servers": 240, "total_players": 2400,
+                  "total_users": 120000, "pending_saves": 3},
+        "vms": vms,
+        "rate_limits": [{"ip": f"203.0.113.{i}", "group": "default", "requests": rnd.randrange(1, 10000),
+                         "blocked": False, "block_expires": 0} for i in range(100)],
+        "system": {"cpu": 31.5, "memory": 62.1, "disk": 40.2, "load": [1.2, 1.1, 0.9]},
+        "maintenance": False,
+        "weather_types": ["sunny", "rain", "snow", "fog"],
+        "backups": {"count": 12, "latest": "backup_20260101.db", "total_mb": 512.4},
+    }
+
+def bench(fn, payload, rounds):
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            fn(payload)
+        best = min(best, time.perf_counter() - start)
+    return best / rounds * 1e6
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    user_id = seed()
+    payloads = {
+        "market (500 items)": listMarketItems(None, {"page": 1, "limit": ACCESSORIES}),
+        "full profile": getPlayerFullProfile(user_id),
+        "dashboard": dashboard_payload(),
+        "ws message": {"id": 1234, "type": "announcement", "timestamp": time.time(),
+                       "properties": {"text": "Server restart in 5 minutes", "color": "#ffcc00", "duration": 10}},
+    }
+    stdlib_dumps = lambda obj: json.dumps(obj).encode()
+    print(f"backend: {json_codec.JSON_BACKEND}")
+    print(f"{'payload':<20} {'KB':>6} {'json enc':>9} {'codec enc':>10} {'json dec':>9} {'codec dec':>10}  (us)")
+    for name, payload in payloads.items():
+        body = stdlib_dumps(payload)
+        assert json_codec.loads(json_codec.dumps_bytes(payload)) == json.loads(body)
+        print(f"{name:<20} {len(body) / 1024:>6.1f} "
+              f"{bench(stdlib_dumps, payload, rounds):>9.1f} {bench(json_codec.dumps_bytes, payload, rounds):>10.1f} "
+              f"{bench(json.loads, body, rounds):>9.1f} {bench(json_codec.loads, body, rounds):>10.1f}")
+
+if __name__ == "__main__":
+    main()
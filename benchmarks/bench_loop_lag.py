@@ -0,0 +1,77 @@
+# event loop lag while handlers hit the db, calling game_database
+# directly on the loop (old handlers) vs the *_async versions
+#
+#   python benchmarks/bench_loop_lag.py [concurrent_requests] [seconds]
+import sys
+import time
+import asyncio
+import random
+
+from bench_env import setup_sandbox
+
+setup_sandbox("loop_lag")
+
+from game_database import (
+    save_account, get_account_by_username, get_player_data, save_player_data,
+    get_account_by_username_async, get_player_data_async, save_player_data_async
+)
+
+USERS = 1000
+PROBE_INTERVAL = 0.001
+
+def seed():
+    for i in range(USERS):
+        user_id = save_account(f"lag_{i}", "x", "none")
+        save_player_data(user_id, {"username": f"lag_{i}", "currency": 100})
+
+async def sync_request(rnd):
+    account = get_account_by_username(f"lag_{rnd.randrange(USERS)}")
+    data = get_player_data(account.user_id)
+    save_player_data(account.user_id, {"username": data.username, "currency": rnd.randrange(1000)})
+    await asyncio.sleep(0)
+
+async def async_request(rnd):
+    account = await get_account_by_username_async(f"lag_{rnd.randrange(USERS)}")
+    data = await get_player_data_async(account.user_id)
+    await save_player_data_async(account.user_id, {"username": data.username, "currency": rnd.randrange(1000)})
+
+async def probe(lags, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - start - PROBE_INTERVAL)
+
+async def run(request_fn, concurrency: int, seconds: float):
+    stop = asyncio.Event()
+    lags = []
+    done = [0]
+
+    async def client(idx):
+        rnd = random.Random(idx)
+        while not stop.is_set():
+            await request_fn(rnd)
+            done[0] += 1
+
+    probe_task = asyncio.create_task(probe(lags, stop))
+    clients = [asyncio.create_task(client(i)) for i in range(concurrency)]
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(probe_task, *clients)
+
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99)] * 1000
+    return done[0] / seconds, p99, lags[-1] * 1000
+
+if __name__ == "__main__":
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+
+    seed()
+    results = {
+        "sync on loop": asyncio.run(run(sync_request, concurrency, seconds)),
+        "async (executor)": asyncio.run(run(async_request, concurrency, seconds)),
+    }
+
+    print(f"{concurrency} concurrent requests (2 reads + 1 write each), {seconds:.0f}s each")
+    for name, (rps, p99, worst) in results.items():
+        print(f"  {name:18s}: {rps:8.0f} req/s   loop lag p99 {p99:7.2f} ms   max {worst:7.2f} ms")
@@ -0,0 +1,74 @@
+# cost of metrics_middleware: the api_extensions read mix from
+# bench_pipeline (plus scanner 404s) with and without it, then the time to
+# render /metrics for all the routes it saw
+#
+#   python benchmarks/bench_metrics.py [concurrency] [seconds]
+import sys
+import time
+import json
+import asyncio
+import random
+
+from bench_env import setup_sandbox
+
+setup_sandbox("metrics")
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer, TestClient
+
+import api_extensions
+import metrics
+from request_pipeline import rate_limit_middleware
+from game_database import save_account, save_token, save_player_data
+from player_data import ensurePlayerDataDefaults
+
+USERS = 200
+PATHS = ["/currency/get", "/friends/get", "/player/get_pfp", "/avatar/get_user_accessories", "/player/get_profile"]
+
+def seed():
+    tokens = []
+    for i in range(USERS):
+        user_id = save_account(f"metrics_{i}", "x", "none")
+        save_player_data(user_id, ensurePlayerDataDefaults({"userId": user_id, "username": f"metrics_{i}"}))
+        save_token(f"token_{i}", f"metrics_{i}")
+        tokens.append(f"token_{i}")
+    return tokens
+
+async def client_loop(client, tokens, stop, counts, rnd):
+    while not stop.is_set():
+        if rnd.random() < 0.1:
+            request = client.get(f"/{rnd.getrandbits(32):x}")
+        else:
+            request = client.post(rnd.choice(PATHS), data=json.dumps({"token": rnd.choice(tokens)}))
+        async with request as response:
+            await response.read()
+            counts[0] += 1
+
+async def run(middlewares, tokens, concurrency, seconds):
+    app = web.Application(middlewares=middlewares)
+    api_extensions.addNewRoutes(app)
+    async with TestClient(TestServer(app)) as client:
+        stop = asyncio.Event()
+        counts = [0]
+        tasks = [asyncio.create_task(client_loop(client, tokens, stop, counts, random.Random(i))) for i in range(concurrency)]
+        await asyncio.sleep(seconds)
+        stop.set()
+        await asyncio.gather(*tasks)
+    return counts[0] / seconds
+
+async def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    tokens = seed()
+    print(f"{concurrency} clients, {seconds}s")
+    for name, middlewares in (("without", [rate_limit_middleware]),
+                              ("with", [metrics.metrics_middleware, rate_limit_middleware]),
+                              ("without", [rate_limit_middleware])):
+        print(f"{name:<8} {await run(middlewares, tokens, concurrency, seconds):>7.0f} req/s")
+    start = time.perf_counter()
+    text = metrics.renderMetrics()
+    print(f"/metrics: {len(metrics.route_metrics)} series, {len(text) / 1024:.1f} KB, "
+          f"{(time.perf_counter() - start) * 1000:.2f} ms to render")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+# logins/s and event loop lag under concurrent logins, pbkdf2 on the loop
+# (old verifyPassword in the handler) vs auth_utils.checkPasswordAsync
+# on the hash pool. the last run goes past PASSWORD_HASH_MAX_PENDING to
+# show the 503s
+#
+#   python benchmarks/bench_password_hash.py [concurrent_logins] [seconds]
+import sys
+import time
+import asyncio
+import random
+
+from bench_env import setup_sandbox
+
+setup_sandbox("password_hash")
+
+import auth_utils
+from game_database import save_account, get_account_by_username_async, save_token_async
+
+USERS = 200
+PROBE_INTERVAL = 0.001
+
+def seed():
+    hashed = auth_utils.hashPassword("hunter22")
+    for i in range(USERS):
+        save_account(f"login_{i}", hashed, "none")
+
+async def sync_login(rnd):
+    account = await get_account_by_username_async(f"login_{rnd.randrange(USERS)}")
+    if not auth_utils.verifyPassword("hunter22", account.password):
+        raise RuntimeError("bad password")
+    await save_token_async(auth_utils.secrets.token_urlsafe(32), account.username)
+    return True
+
+async def async_login(rnd):
+    account = await get_account_by_username_async(f"login_{rnd.randrange(USERS)}")
+    try:
+        valid, _ = await auth_utils.checkPasswordAsync("hunter22", account.password)
+    except auth_utils.PasswordHashBusy:
+        return False
+    if not valid:
+        raise RuntimeError("bad password")
+    await save_token_async(auth_utils.secrets.token_urlsafe(32), account.username)
+    return True
+
+async def probe(lags, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - start - PROBE_INTERVAL)
+
+async def run(login_fn, concurrency: int, seconds: float):
+    stop = asyncio.Event()
+    lags = []
+    done = [0, 0]
+
+    async def client(idx):
+        rnd = random.Random(idx)
+        while not stop.is_set():
+            if await login_fn(rnd):
+                done[0] += 1
+            else:
+                done[1] += 1
+                await asyncio.sleep(0.01)
+
+    probe_task = asyncio.create_task(probe(lags, stop))
+    clients = [asyncio.create_task(client(i)) for i in range(concurrency)]
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(probe_task, *clients)
+
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99)] * 1000 if lags else float("nan")
+    return done[0] / seconds, done[1] / seconds, p99
+
+if __name__ == "__main__":
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+
+    seed()
+    overload = auth_utils.PASSWORD_HASH_MAX_PENDING * 2
+    results = {
+        "pbkdf2 on loop": asyncio.run(run(sync_login, concurrency, seconds)),
+        "hash pool": asyncio.run(run(async_login, concurrency, seconds)),
+        f"hash pool, {overload} clients": asyncio.run(run(async_login, overload, seconds)),
+    }
+
+    print(f"{concurrency} concurrent logins, {auth_utils.PASSWORD_HASH_ITERATIONS} rounds, "
+          f"{auth_utils.PASSWORD_HASH_WORKERS} hash workers, {seconds:.0f}s each")
+    for name, (logins, busy, p99) in results.items():
+        print(f"  {name:24s}: {logins:7.1f} logins/s   {busy:7.1f} 503/s   loop lag p99 {p99:8.2f} ms")
@@ -0,0 +1,75 @@
+# requests/s through aiohttp on a mix of authenticated api_extensions
+# endpoints (reads, plus a share of bad tokens and bad json), measured end
+# to end with concurrent clients on one event loop
+#
+#   python benchmarks/bench_pipeline.py [concurrency] [seconds]
+import sys
+import json
+import asyncio
+import random
+
+from bench_env import setup_sandbox
+
+setup_sandbox("pipeline")
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer, TestClient
+
+import api_extensions
+from request_pipeline import rate_limit_middleware
+from game_database import save_account, save_token, save_player_data
+from player_data import ensurePlayerDataDefaults
+
+USERS = 200
+MIX = [
+    ("/currency/get", 30),
+    ("/friends/get", 20),
+    ("/player/get_pfp", 15),
+    ("/avatar/get_user_accessories", 15),
+    ("/player/get_profile", 10),
+    ("/friends/get_requests", 10),
+]
+
+# rows written directly, createPlayerData goes through the save tracker
+def seed():
+    tokens = []
+    for i in range(USERS):
+        user_id = save_account(f"pipe_{i}", "x", "none")
+        save_player_data(user_id, ensurePlayerDataDefaults({"userId": user_id, "username": f"pipe_{i}"}))
+        save_token(f"token_{i}", f"pipe_{i}")
+        tokens.append(f"token_{i}")
+    return tokens
+
+async def client_loop(client, tokens, stop, counts, rnd):
+    paths = [path for path, weight in MIX for _ in range(weight)]
+    while not stop.is_set():
+        path = rnd.choice(paths)
+        roll = rnd.random()
+        if roll < 0.05:
+            data = "{not json"
+        elif roll < 0.15:
+            data = json.dumps({"token": "bogus"})
+        else:
+            data = json.dumps({"token": rnd.choice(tokens)})
+        async with client.post(path, data=data, headers={"Content-Type": "application/json"}) as response:
+            await response.read()
+            counts[response.status] = counts.get(response.status, 0) + 1
+
+async def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    tokens = seed()
+    app = web.Application(middlewares=[rate_limit_middleware])
+    api_extensions.addNewRoutes(app)
+    async with TestClient(TestServer(app)) as client:
+        stop = asyncio.Event()
+        counts = {}
+        tasks = [asyncio.create_task(client_loop(client, tokens, stop, counts, random.Random(i))) for i in range(concurrency)]
+        await asyncio.sleep(seconds)
+        stop.set()
+        await asyncio.gather(*tasks)
+    total = sum(counts.values())
+    print(f"{concurrency} clients, {seconds}s: {total / seconds:.0f} req/s {dict(sorted(counts.items()))}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
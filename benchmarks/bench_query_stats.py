@@ -0,0 +1,45 @@
+# per query cost of the query_stats instrumentation in execute_query
+#
+#   python benchmarks/bench_query_stats.py [iterations]
+import sys
+import time
+
+from bench_env import setup_sandbox
+
+setup_sandbox("query_stats")
+
+import database_manager
+import query_stats
+from database_manager import execute_query
+from game_database import save_account
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+QUERY = "SELECT user_id, username FROM accounts WHERE user_id = ?"
+
+def run(pool: bool, enabled: bool) -> float:
+    database_manager.set_read_pool_enabled(pool)
+    query_stats.set_enabled(enabled)
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        for i in range(N):
+            execute_query(QUERY, (i % 1000 + 1,), fetch_one=True)
+        per = (time.perf_counter() - start) / N * 1e6
+        best = per if best is None else min(best, per)
+    return best
+
+def main():
+    for i in range(1000):
+        save_account(f"bench_{i}", "x", "none")
+
+    for pool in (True, False):
+        off = run(pool, False)
+        on = run(pool, True)
+        label = "read pool" if pool else "db_lock  "
+        print(f"{label}  off {off:.2f}us  on {on:.2f}us  overhead {on - off:.2f}us/query")
+
+    stats = query_stats.get_query_stats()["statements"][0]
+    print(f"p50 {stats['p50_ms']}ms p95 {stats['p95_ms']}ms p99 {stats['p99_ms']}ms count {stats['count']}")
+
+if __name__ == "__main__":
+    main()
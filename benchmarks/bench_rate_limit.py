@@ -0,0 +1,88 @@
+# cost per check and memory for many distinct clients, old per-ip deque of
+# timestamps (copied from before the token buckets) vs auth_utils.RateBucket.
+# also times one hot ip hitting its limit and the cleanup walk the old
+# limiter did every CLEANUP_INTERVAL
+#
+#   python benchmarks/bench_rate_limit.py [distinct_ips]
+import sys
+import time
+import tracemalloc
+from collections import deque
+
+from bench_env import setup_sandbox
+
+setup_sandbox("rate_limit")
+
+import auth_utils
+from config import RATELIMIT_MAX, RATE_LIMIT_WINDOW
+
+class DequeLimiter:
+    def __init__(self):
+        self.entries = {}
+
+    def check(self, ip, now):
+        timestamps = self.entries.get(ip)
+        if timestamps is None:
+            timestamps = self.entries[ip] = deque(maxlen=RATELIMIT_MAX)
+        cutoff = now - RATE_LIMIT_WINDOW
+        while timestamps and timestamps[0] < cutoff:
+            timestamps.popleft()
+        if len(timestamps) >= RATELIMIT_MAX:
+            return False
+        timestamps.append(now)
+        return True
+
+    def cleanup(self, now):
+        cutoff = now - (RATE_LIMIT_WINDOW * 2)
+        for ip in [ip for ip, t in self.entries.items() if t and t[-1] < cutoff]:
+            del self.entries[ip]
+
+class BucketLimiter:
+    def __init__(self):
+        self.bucket = auth_utils.RateBucket(RATELIMIT_MAX, RATELIMIT_MAX / RATE_LIMIT_WINDOW)
+
+    def check(self, ip, now):
+        return self.bucket.take(ip, now) == 0
+
+def ips(n):
+    return [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(n)]
+
+def distinct(limiter_cls, addrs):
+    tracemalloc.start()
+    limiter = limiter_cls()
+    now = time.monotonic()
+    start = time.perf_counter()
+    for ip in addrs:
+        limiter.check(ip, now)
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return limiter, elapsed, current
+
+def hot(limiter_cls, checks):
+    limiter = limiter_cls()
+    now = time.monotonic()
+    allowed = 0
+    start = time.perf_counter()
+    for i in range(checks):
+        allowed += limiter.check("1.2.3.4", now + i * 1e-6)
+    return time.perf_counter() - start, allowed
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    addrs = ips(n)
+    print(f"{n} distinct ips, limit {RATELIMIT_MAX}/{RATE_LIMIT_WINDOW}s")
+    print(f"{'limiter':<8} {'ns/check':>9} {'MB':>8} {'B/ip':>6} {'hot ns':>8} {'allowed':>8}")
+    for name, cls in (("deque", DequeLimiter), ("bucket", BucketLimiter)):
+        limiter, elapsed, mem = distinct(cls, addrs)
+        hot_elapsed, allowed = hot(cls, 2 * RATELIMIT_MAX)
+        print(f"{name:<8} {elapsed / n * 1e9:>9.0f} {mem / 1e6:>8.1f} {mem / n:>6.0f} "
+              f"{hot_elapsed / (2 * RATELIMIT_MAX) * 1e9:>8.0f} {allowed:>8}")
+        if name == "deque":
+            start = time.perf_counter()
+            limiter.cleanup(time.monotonic() + RATE_LIMIT_WINDOW * 3)
+            print(f"         old cleanup walk: {(time.perf_counter() - start) * 1000:.0f}ms")
+        del limiter
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# concurrent get_account_by_username / get_player_data throughput,
+# with the per-thread read pool and with everything behind db_lock
+#
+#   python benchmarks/bench_read_pool.py [threads] [seconds]
+import sys
+import time
+import random
+import threading
+
+from bench_env import setup_sandbox
+
+setup_sandbox("read_pool")
+
+import database_manager
+from game_database import save_account, get_account_by_username, get_player_data, save_player_data
+
+USERS = 2000
+
+def seed():
+    for i in range(USERS):
+        user_id = save_account(f"bench_{i}", "x", "none")
+        save_player_data(user_id, {"username": f"bench_{i}", "currency": 100})
+
+def run(threads: int, seconds: float, pool: bool) -> float:
+    database_manager.set_read_pool_enabled(pool)
+    database_manager.close_read_connections()
+
+    stop = threading.Event()
+    counts = [0] * threads
+    latencies = [[] for _ in range(threads)]
+
+    def reader(idx):
+        rnd = random.Random(idx)
+        samples = latencies[idx]
+        n = 0
+        while not stop.is_set():
+            i = rnd.randrange(USERS)
+            start = time.perf_counter()
+            account = get_account_by_username(f"bench_{i}")
+            get_player_data(account.user_id)
+            samples.append(time.perf_counter() - start)
+            n += 2
+        counts[idx] = n
+
+    def writer():
+        rnd = random.Random(-1)
+        while not stop.is_set():
+            i = rnd.randrange(USERS)
+            save_player_data(i + 1, {"username": f"bench_{i}", "currency": rnd.randrange(1000)})
+
+    workers = [threading.Thread(target=reader, args=(i,)) for i in range(threads)]
+    workers.append(threading.Thread(target=writer))
+    for t in workers:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in workers:
+        t.join()
+
+    merged = sorted(x for samples in latencies for x in samples)
+    p99 = merged[int(len(merged) * 0.99)] * 1000 if merged else 0.0
+    return sum(counts) / seconds, p99
+
+if __name__ == "__main__":
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+
+    seed()
+    without_pool, without_p99 = run(threads, seconds, pool=False)
+    with_pool, with_p99 = run(threads, seconds, pool=True)
+
+    print(f"{threads} reader threads + 1 writer, {seconds:.0f}s each")
+    print(f"  db_lock only : {without_pool:10.0f} reads/s  p99 {without_p99:.3f} ms")
+    print(f"  read pool    : {with_pool:10.0f} reads/s  p99 {with_p99:.3f} ms  ({with_pool / without_pool:.2f}x)")
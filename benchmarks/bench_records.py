@@ -0,0 +1,87 @@
+# time and peak allocation per request for the /player/get_profile and
+# /avatar/list_market work (service call + json_response), with the
+# player cache warm and cold
+#
+#   python benchmarks/bench_records.py [iterations]
+import os
+import sys
+import time
+import asyncio
+import tracemalloc
+
+from bench_env import setup_sandbox
+
+setup_sandbox("records")
+
+from aiohttp import web
+from config import VOLUME_PATH
+from game_database import save_account, save_player_data, save_accessory
+from player_data import getPlayerFullProfileAsync, clear_player_cache
+from currency_system import clear_currency_cache
+from avatar_service import listMarketItems
+
+USERS = 200
+ACCESSORIES = 500
+
+def seed():
+    for i in range(USERS):
+        user_id = save_account(f"rec_{i}", "x", "none")
+        save_player_data(user_id, {
+            "username": f"rec_{i}",
+            "currency": 100,
+            "ownedAccessories": list(range(1, 40)),
+            "avatar": {"accessories": [{"id": 1}, {"id": 2}]},
+            "pfp": "http://127.0.0.1:8080/pfps/default.png"
+        })
+    models = os.path.join(VOLUME_PATH, "models")
+    for i in range(1, ACCESSORIES + 1):
+        save_accessory(i, f"item {i:04d}", "hat" if i % 2 else "shirt", i * 5,
+                       os.path.join(models, f"{i}_model.glb"), os.path.join(models, f"{i}_texture.png"),
+                       os.path.join(models, f"{i}_material.mtl"), "head", os.path.join(models, f"{i}_icon.png"))
+
+async def get_profile(i: int, cold: bool):
+    if cold:
+        clear_player_cache()
+        clear_currency_cache()
+    return web.json_response(await getPlayerFullProfileAsync(i % USERS + 1))
+
+async def list_market(i: int, cold: bool):
+    return web.json_response(listMarketItems({"type": "hat"}, {"page": i % 10 + 1, "limit": 20}))
+
+async def measure(request_fn, iterations: int, cold: bool):
+    for i in range(50):
+        await request_fn(i, cold)
+
+    # best of 5 rounds, get_profile goes through the db executor and is noisy
+    rounds = []
+    for _ in range(5):
+        start = time.perf_counter()
+        for i in range(iterations // 5):
+            await request_fn(i, cold)
+        rounds.append((time.perf_counter() - start) / (iterations // 5))
+
+    # peak traced size while building one response, all the rows, records
+    # and dicts it goes through
+    peak = 0
+    tracemalloc.start()
+    for i in range(200):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        response = await request_fn(i, cold)
+        peak += tracemalloc.get_traced_memory()[1] - base
+        del response
+    tracemalloc.stop()
+    return min(rounds) * 1e6, peak / 200 / 1024
+
+async def main(iterations: int):
+    print(f"{iterations} requests each")
+    for name, request_fn, cold in (("get_profile (cached)", get_profile, False),
+                                   ("get_profile (cold)", get_profile, True),
+                                   ("list_market", list_market, False)):
+        us, peak_kb = await measure(request_fn, iterations, cold)
+        print(f"  {name:21s}: {us:8.1f} us/req   peak {peak_kb:6.1f} KB/req")
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    seed()
+    asyncio.run(main(iterations))
@@ -0,0 +1,137 @@
+# a graceful reload under load: the api_extensions read mix keeps running
+# while SIGHUP hands the listening socket to a new process (handoff.py).
+# counts failed requests, worst latency around the switch, and whether a
+# long request started before the reload (a stand-in for requestServer
+# waiting on a VM) still completes on the old process
+#
+#   python benchmarks/bench_reload.py [concurrency] [slow_request_seconds]
+import os
+import sys
+import json
+import time
+import random
+import signal
+import asyncio
+import subprocess
+
+MODE = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] == "--server" else None
+SCRIPT = os.path.abspath(__file__)
+PORT = 18280
+USERS = 200
+PATHS = ["/currency/get", "/friends/get", "/player/get_pfp", "/avatar/get_user_accessories", "/player/get_profile"]
+
+if MODE is None:
+    from bench_env import setup_sandbox
+    work_dir = setup_sandbox("reload")
+else:
+    # the new process runs in the same sandbox as the one it replaces
+    from bench_env import REPO_DIR
+    os.chdir(os.environ["BENCH_DIR"])
+    sys.path.insert(0, REPO_DIR)
+
+async def serve():
+    from aiohttp import web
+    import api_extensions
+    import handoff
+    import vm_lifecycle_manager
+    from request_pipeline import rate_limit_middleware
+    from config import RELOAD_DRAIN_TIMEOUT
+
+    async def slow(request):
+        await asyncio.sleep(float(request.query.get("seconds", 5)))
+        return web.json_response({"pid": os.getpid()})
+
+    async def whoami(request):
+        return web.json_response({"pid": os.getpid(), "vms": len(vm_lifecycle_manager.vm_registry)})
+
+    app = web.Application(middlewares=[handoff.drain_middleware, rate_limit_middleware])
+    api_extensions.addNewRoutes(app)
+    app.add_routes([web.get("/slow", slow), web.get("/whoami", whoami)])
+    runner = web.AppRunner(app, shutdown_timeout=RELOAD_DRAIN_TIMEOUT)
+    await runner.setup()
+    listen_sock = handoff.listeningSocket("127.0.0.1", PORT)
+    await web.SockSite(runner, listen_sock).start()
+    if not vm_lifecycle_manager.vm_registry and "HANDOFF_CONTROL_FD" not in os.environ:
+        vm_lifecycle_manager.vm_registry["bench-vm"] = {"vm_id": "bench-vm", "ip": "10.0.0.2", "server_id": 1,
+                                                        "servers": {}, "status": "active"}
+    await handoff.serve(runner, SCRIPT, listen_sock, [])
+    sys.stdout.flush()
+    os._exit(0)
+
+def seed():
+    from game_database import save_account, save_token, save_player_data
+    from player_data import ensurePlayerDataDefaults
+    for i in range(USERS):
+        user_id = save_account(f"reload_{i}", "x", "none")
+        save_player_data(user_id, ensurePlayerDataDefaults({"userId": user_id, "username": f"reload_{i}"}))
+        save_token(f"token_{i}", f"reload_{i}")
+
+async def wait_for_port():
+    for _ in range(200):
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", PORT)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"server never listened on {PORT}")
+
+async def main():
+    import aiohttp
+    import handoff
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    slow_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    seed()
+    server = subprocess.Popen([sys.executable, SCRIPT, "--server"], stdout=subprocess.DEVNULL,
+                              env=dict(os.environ, BENCH_DIR=work_dir))
+    await wait_for_port()
+    await asyncio.sleep(0.5)
+    stats = {"ok": 0, "failed": 0, "worst": 0.0, "pids": set()}
+    stop = asyncio.Event()
+    async with aiohttp.ClientSession() as session:
+        async def load(rnd):
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    async with session.post(f"http://127.0.0.1:{PORT}{rnd.choice(PATHS)}",
+                                            data=json.dumps({"token": f"token_{rnd.randrange(USERS)}"})) as response:
+                        await response.read()
+                        stats["ok" if response.status == 200 else "failed"] += 1
+                except aiohttp.ClientError:
+                    stats["failed"] += 1
+                stats["worst"] = max(stats["worst"], time.perf_counter() - start)
+
+        async def watch():
+            while not stop.is_set():
+                async with session.get(f"http://127.0.0.1:{PORT}/whoami") as response:
+                    stats["pids"].add((await response.json())["pid"])
+                await asyncio.sleep(0.05)
+
+        tasks = [asyncio.create_task(load(random.Random(i))) for i in range(concurrency)] + [asyncio.create_task(watch())]
+        slow = asyncio.create_task(session.get(f"http://127.0.0.1:{PORT}/slow?seconds={slow_seconds}"))
+        await asyncio.sleep(1.0)
+        reload_start = time.perf_counter()
+        server.send_signal(signal.SIGHUP)
+        slow_response = await slow
+        slow_pid = (await slow_response.json())["pid"]
+        server.wait()
+        old_exit = time.perf_counter() - reload_start
+        await asyncio.sleep(1.0)
+        stop.set()
+        await asyncio.gather(*tasks)
+        async with session.get(f"http://127.0.0.1:{PORT}/whoami") as response:
+            after = await response.json()
+
+    print(f"{concurrency} clients, {stats['ok']} ok, {stats['failed']} failed, worst latency {stats['worst'] * 1000:.0f} ms")
+    print(f"slow request started before the reload: {slow_response.status} from pid {slow_pid} "
+          f"({'old' if slow_pid == server.pid else 'new'} process)")
+    print(f"old process exited {old_exit:.2f}s after SIGHUP, served by pids {sorted(stats['pids'])}")
+    print(f"vm_registry in the new process: {after['vms']} entries")
+    with open(handoff.PID_FILE) as f:
+        os.kill(int(f.read()), signal.SIGTERM)
+
+if __name__ == "__main__":
+    if MODE == "--server":
+        asyncio.run(serve())
+    else:
+        asyncio.run(main())
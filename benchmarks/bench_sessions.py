@@ -0,0 +1,79 @@
+# resolving a token to a user id the way handlers do: the old path
+# (validateToken + getUsernameFromToken + account lookup by username) vs
+# auth_utils.getSessionAsync, for known tokens and for garbage tokens that
+# used to hit sqlite every time, plus signed tokens (no db at all) with
+# forged macs as the invalid ones. also fills the cache past TOKEN_CACHE_SIZE
+# to show it stays bounded
+#
+#   python benchmarks/bench_sessions.py [lookups]
+import sys
+import time
+import asyncio
+import random
+
+from bench_env import setup_sandbox
+
+setup_sandbox("sessions")
+
+import auth_utils
+from config import TOKEN_CACHE_SIZE
+from database_manager import execute_query_async
+from game_database import save_account, save_token, get_account_by_username_async, hash_token
+
+USERS = 2000
+
+def seed():
+    tokens = []
+    signed = []
+    for i in range(USERS):
+        user_id = save_account(f"session_{i}", "x", "none")
+        token = f"token_{i}"
+        save_token(token, f"session_{i}")
+        tokens.append(token)
+        signed.append(auth_utils.signSessionToken(user_id, f"session_{i}"))
+    return tokens, signed
+
+# what api_extensions did before: token row from an unbounded dict (or
+# sqlite on a miss, every time for unknown tokens) then an account query
+old_cache = {}
+
+async def old_user_id(token):
+    username = old_cache.get(token)
+    if not username:
+        result = await execute_query_async("SELECT username, created FROM tokens WHERE token = ?", (hash_token(token),), fetch_one=True)
+        if not result:
+            return None
+        username = old_cache[token] = result[0]
+    account = await get_account_by_username_async(username)
+    return account.user_id if account else None
+
+async def new_user_id(token):
+    session = await auth_utils.getSessionAsync(token)
+    return session.user_id if session else None
+
+async def run(resolve, tokens, lookups):
+    rnd = random.Random(1)
+    start = time.perf_counter()
+    for _ in range(lookups):
+        await resolve(rnd.choice(tokens))
+    return lookups / (time.perf_counter() - start)
+
+async def main():
+    lookups = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    tokens, signed = seed()
+    garbage = [f"garbage_{i}" for i in range(100)]
+    forged = [token[:-4] + "AAAA" for token in signed[:100]]
+    print(f"{lookups} lookups, {USERS} users")
+    print(f"{'path':<8} {'valid/s':>10} {'invalid/s':>10}")
+    for name, resolve, valid_tokens, invalid_tokens in (("old", old_user_id, tokens, garbage),
+                                                          ("session", new_user_id, tokens, garbage),
+                                                          ("signed", new_user_id, signed, forged)):
+        valid = await run(resolve, valid_tokens, lookups)
+        invalid = await run(resolve, invalid_tokens, lookups)
+        print(f"{name:<8} {valid:>10.0f} {invalid:>10.0f}")
+    for i in range(TOKEN_CACHE_SIZE + 1000):
+        auth_utils.cacheSession(f"fill_{i}", i, f"fill_{i}")
+    print(auth_utils.get_token_cache_stats())
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+# write throughput with DB_SHARDS = 1, 2, 4, 8
+# mixed load: datastore sets + player_data saves from concurrent writers,
+# every shard count runs in its own process and sandbox
+#
+#   python benchmarks/bench_shards.py [concurrent_writers] [seconds] [--full-sync]
+import os
+import sys
+import asyncio
+import subprocess
+
+def child(shards: int, writers: int, seconds: float, full_sync: bool):
+    os.environ["DB_SHARDS"] = str(shards)
+    from bench_env import setup_sandbox
+    setup_sandbox(f"shards_{shards}")
+
+    import database_manager
+    from game_database import save_datastore_async, save_player_data_async
+
+    if full_sync:
+        database_manager.get_connection().execute("PRAGMA synchronous=FULL")
+        for shard in database_manager.get_shards():
+            shard.get_connection().execute("PRAGMA synchronous=FULL")
+
+    async def run() -> float:
+        stop = asyncio.Event()
+        done = [0]
+
+        async def writer(idx):
+            i = idx
+            while not stop.is_set():
+                if i % 2:
+                    await save_datastore_async(f"bench:{i % 5000}", "x" * 64)
+                else:
+                    await save_player_data_async(i % 5000 + 1, {"username": f"u{i}", "currency": i})
+                i += writers
+                done[0] += 1
+
+        tasks = [asyncio.create_task(writer(i)) for i in range(writers)]
+        await asyncio.sleep(seconds)
+        stop.set()
+        await asyncio.gather(*tasks)
+        return done[0] / seconds
+
+    rate = asyncio.run(run())
+    writers_stats = [database_manager.group_writer.get_stats()] + [s["writer"] for s in database_manager.get_shard_stats()]
+    batches = sum(w["batches"] for w in writers_stats)
+    ops = sum(w["ops"] for w in writers_stats)
+    print(f"{rate:.0f} {ops / batches if batches else 0:.1f}")
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if args and args[0] == "child":
+        child(int(args[1]), int(args[2]), float(args[3]), "--full-sync" in sys.argv)
+        sys.exit(0)
+
+    writers = int(args[0]) if len(args) > 0 else 64
+    seconds = float(args[1]) if len(args) > 1 else 3.0
+    flags = ["--full-sync"] if "--full-sync" in sys.argv else []
+
+    print(f"{writers} concurrent writers, {seconds:.0f}s each{', synchronous=FULL' if flags else ''}")
+    baseline = None
+    for shards in (1, 2, 4, 8):
+        out = subprocess.run([sys.executable, __file__, "child", str(shards), str(writers), str(seconds)] + flags,
+                             capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if out.returncode != 0:
+            print(out.stderr)
+            sys.exit(1)
+        rate, avg_batch = out.stdout.strip().splitlines()[-1].split()
+        rate = float(rate)
+        baseline = baseline or rate
+        print(f"  {shards} shard{'s' if shards > 1 else ' '} : {rate:9.0f} writes/s  ({rate / baseline:.2f}x, avg batch {avg_batch})")
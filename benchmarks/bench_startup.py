@@ -0,0 +1,92 @@
+# startup cost, each part in a fresh interpreter:
+#   - import time of the server modules, with the network blocked so any
+#     lookup left at import shows up as an error instead of a slow import
+#   - startup.runStartup() (ip, database, keys side by side), against
+#     STARTUP_BUDGET, next to the same steps run one after another
+# modules whose dependencies aren't installed are reported and skipped.
+# the ip is pinned to 127.0.0.1 like the other benchmarks, an empty
+# SERVER_PUBLIC_IP= in the environment times the real ipify lookup
+#
+#   python benchmarks/bench_startup.py [budget_seconds]
+import os
+import sys
+import json
+import time
+import subprocess
+
+MODE = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] in ("--import", "--startup") else None
+SCRIPT = os.path.abspath(__file__)
+MODULES = ["config", "database_manager", "auth_utils", "player_data", "moderation_service",
+           "moderation.ModServer", "api_extensions", "startup", "main"]
+
+from bench_env import setup_sandbox
+
+def block_network():
+    import socket
+    def refuse(*args, **kwargs):
+        raise RuntimeError("network call at import")
+    socket.create_connection = refuse
+    socket.getaddrinfo = refuse
+    socket.socket.connect = refuse
+
+def measure_import(module):
+    block_network()
+    start = time.perf_counter()
+    try:
+        __import__(module)
+        error = None
+    except ModuleNotFoundError as e:
+        error = f"skipped, {e.name} not installed"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return {"seconds": time.perf_counter() - start, "error": error, "files": sorted(os.listdir("."))}
+
+def measure_startup(sequential):
+    import asyncio
+    import startup
+    steps = {name: step for name, step in startup.STARTUP_STEPS.items() if step[1]}
+    if sequential:
+        start = time.perf_counter()
+        for func, _ in steps.values():
+            func()
+        return {"seconds": time.perf_counter() - start}
+    asyncio.run(startup.runStartup(steps))
+    return {"seconds": startup.startup_stats["seconds"], "steps": startup.startup_stats["steps"]}
+
+def child(args):
+    env = dict(os.environ, BENCH_CHILD="1")
+    out = subprocess.run([sys.executable, SCRIPT, *args], capture_output=True, text=True, env=env)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1])
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else float(os.environ.get("STARTUP_BUDGET", 10))
+    print("imports (network blocked):")
+    for module in MODULES:
+        result = child(["--import", module])
+        created = f", created {result['files']}" if result["files"] else ""
+        print(f"  {module:<22} {result['seconds'] * 1000:>8.1f} ms  {result['error'] or 'ok'}{created}")
+    try:
+        concurrent = child(["--startup", "concurrent"])
+        sequential = child(["--startup", "sequential"])
+    except RuntimeError as e:
+        print(f"startup: skipped, {e}")
+        return
+    print("startup steps:")
+    for name, step in concurrent["steps"].items():
+        print(f"  {name:<22} {step['seconds'] * 1000:>8.1f} ms  {step['error'] or 'ok'}")
+    verdict = "within" if concurrent["seconds"] <= budget else "OVER"
+    print(f"startup: {concurrent['seconds'] * 1000:.1f} ms concurrent, {sequential['seconds'] * 1000:.1f} ms one by one, "
+          f"{verdict} the {budget}s budget")
+
+if __name__ == "__main__":
+    # every child gets its own scratch dir, so the db and key files are
+    # created from nothing each time
+    setup_sandbox("startup")
+    if MODE == "--import":
+        print(json.dumps(measure_import(sys.argv[2])))
+    elif MODE == "--startup":
+        print(json.dumps(measure_startup(sys.argv[2] == "sequential")))
+    else:
+        main()
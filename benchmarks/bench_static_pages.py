@@ -0,0 +1,90 @@
+# a scanner probing random paths (every one a 404) and dashboard loads,
+# old handlers (open + read the html every request) vs static_pages. also
+# counts the bytes a gzip client gets and how many dashboard reloads end
+# in a 304
+#
+#   python benchmarks/bench_static_pages.py [concurrency] [seconds]
+import os
+import sys
+import asyncio
+import random
+
+from bench_env import REPO_DIR, setup_sandbox
+
+setup_sandbox("static_pages")
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer, TestClient
+
+from static_pages import pageResponse, get_static_page_stats
+
+async def oldDashboard(request):
+    with open(os.path.join(REPO_DIR, "dashboard.html"), "r", encoding="utf-8") as f:
+        html = f.read()
+    return web.Response(text=html, content_type="text/html")
+
+async def old404(app, handler):
+    async def middleware_handler(request):
+        try:
+            return await handler(request)
+        except web.HTTPException as ex:
+            if ex.status in [404]:
+                with open(os.path.join(REPO_DIR, "404.html"), "r") as f:
+                    return web.Response(text=f.read(), content_type="text/html", status=ex.status)
+            raise
+    return middleware_handler
+
+async def newDashboard(request):
+    return pageResponse(request, "dashboard.html")
+
+async def new404(app, handler):
+    async def middleware_handler(request):
+        try:
+            return await handler(request)
+        except web.HTTPException as ex:
+            if ex.status in [404]:
+                return pageResponse(request, "404.html", status=ex.status)
+            raise
+    return middleware_handler
+
+async def client_loop(client, stop, counts, rnd):
+    etag = None
+    while not stop.is_set():
+        headers = {"Accept-Encoding": "gzip, deflate"}
+        if rnd.random() < 0.8:
+            path = f"/{rnd.getrandbits(48):x}.php"
+        else:
+            path = "/dashboard"
+            # a browser revalidating with what it got last time
+            if etag and rnd.random() < 0.7:
+                headers["If-None-Match"] = etag
+        async with client.get(path, headers=headers, auto_decompress=False) as response:
+            body = await response.read()
+            etag = response.headers.get("ETag", etag)
+            counts[response.status] = counts.get(response.status, 0) + 1
+            counts["bytes"] = counts.get("bytes", 0) + len(body)
+
+async def run(dashboard, middleware, concurrency, seconds):
+    app = web.Application(middlewares=[middleware])
+    app.router.add_get("/dashboard", dashboard)
+    async with TestClient(TestServer(app)) as client:
+        stop = asyncio.Event()
+        counts = {}
+        tasks = [asyncio.create_task(client_loop(client, stop, counts, random.Random(i))) for i in range(concurrency)]
+        await asyncio.sleep(seconds)
+        stop.set()
+        await asyncio.gather(*tasks)
+    total = sum(v for k, v in counts.items() if k != "bytes")
+    return total / seconds, counts.pop("bytes", 0) / total / 1024, dict(sorted(counts.items()))
+
+async def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print(f"{concurrency} clients, {seconds}s, 80% random 404s / 20% dashboard")
+    for name, dashboard, middleware in (("read file", oldDashboard, old404), ("static_pages", newDashboard, new404)):
+        rate, kb, counts = await run(dashboard, middleware, concurrency, seconds)
+        print(f"{name:<13} {rate:>7.0f} req/s {kb:>6.1f} KB/response {counts}")
+    print(get_static_page_stats())
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+# expired token cleanup while logins keep coming: the old single
+# "DELETE FROM tokens WHERE created < ?" vs delete_old_tokens_async in
+# TOKEN_DELETE_BATCH batches. reports the worst login (save_token) latency
+# seen during the cleanup, plus table size with the per user session cap
+#
+#   python benchmarks/bench_token_cleanup.py [expired_tokens]
+import sys
+import time
+import asyncio
+import secrets
+
+from bench_env import setup_sandbox
+
+setup_sandbox("token_cleanup")
+
+from config import MAX_SESSIONS_PER_USER
+from database_manager import execute_query, run_in_db, transaction
+from game_database import hash_token, save_token_async, delete_old_tokens_async
+
+def seed(expired):
+    with transaction() as conn:
+        conn.executemany("INSERT INTO tokens (token, username, created) VALUES (?, ?, ?)",
+                         [(hash_token(f"old_{i}"), f"user_{i % 5000}", 1000.0 + i) for i in range(expired)])
+
+def single_delete(cutoff):
+    execute_query("DELETE FROM tokens WHERE created < ?", (cutoff,))
+
+async def logins(stop, latencies):
+    i = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await save_token_async(secrets.token_urlsafe(32), f"login_{i % 100}")
+        latencies.append(time.perf_counter() - start)
+        i += 1
+
+async def run(cleanup, expired):
+    seed(expired)
+    stop = asyncio.Event()
+    latencies = []
+    task = asyncio.create_task(logins(stop, latencies))
+    await asyncio.sleep(0.2)
+    start = time.perf_counter()
+    await cleanup()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await task
+    return elapsed, max(latencies) * 1000, len(latencies)
+
+async def main():
+    expired = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    cutoff = time.time() - 86400
+    print(f"{expired} expired tokens")
+    print(f"{'cleanup':<10} {'total ms':>9} {'worst login ms':>15} {'logins':>7}")
+    for name, cleanup in (("single", lambda: run_in_db(single_delete, cutoff)),
+                          ("batched", lambda: delete_old_tokens_async(cutoff))):
+        elapsed, worst, count = await run(cleanup, expired)
+        print(f"{name:<10} {elapsed * 1000:>9.0f} {worst:>15.1f} {count:>7}")
+    rows = execute_query("SELECT COUNT(*) FROM tokens", fetch_one=True)[0]
+    print(f"live tokens for 100 users after all logins: {rows} (cap {MAX_SESSIONS_PER_USER} each)")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,131 @@
+# req/s of the api_extensions read mix with 1, 2 and 4 worker processes
+# sharing port through SO_REUSEPORT and the shared_state coordinator (rate
+# limits go through it on every request). the workers are this script
+# re-run in worker mode, load comes from separate client processes so the
+# client doesn't share a core with one of the workers. scaling needs the
+# cores to go with it, on a single core box more workers only add the ipc
+#
+#   python benchmarks/bench_workers.py [seconds] [client_processes] [concurrency]
+import os
+import sys
+import json
+import time
+import random
+import signal
+import asyncio
+import subprocess
+
+MODE = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] in ("--worker", "--load") else None
+SCRIPT = os.path.abspath(__file__)
+USERS = 200
+PATHS = ["/currency/get", "/friends/get", "/player/get_pfp", "/avatar/get_user_accessories", "/player/get_profile"]
+
+if MODE is None:
+    from bench_env import setup_sandbox
+    work_dir = setup_sandbox("workers")
+else:
+    # all workers run on the supervisor's sandbox and database
+    from bench_env import REPO_DIR
+    os.chdir(os.environ["BENCH_DIR"])
+    sys.path.insert(0, REPO_DIR)
+
+async def serve_worker(port):
+    from aiohttp import web
+    import api_extensions
+    import shared_state
+    from request_pipeline import rate_limit_middleware
+    from workers import primary_forward_middleware, COORDINATOR_SOCKET
+    await shared_state.connect(COORDINATOR_SOCKET)
+    # loopback is trusted and skips rate limiting, bench it like a client
+    import auth_utils
+    auth_utils.isServerIp = lambda ip: False
+    app = web.Application(middlewares=[primary_forward_middleware, rate_limit_middleware])
+    api_extensions.addNewRoutes(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port, reuse_port=True).start()
+    await asyncio.Event().wait()
+
+async def generate_load(port, seconds, concurrency, seed):
+    import aiohttp
+    tokens = [f"token_{i}" for i in range(USERS)]
+    count = 0
+    deadline = time.monotonic() + seconds
+    # several connections each, so SO_REUSEPORT has something to spread
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency, force_close=False)) as session:
+        async def loop(rnd):
+            nonlocal count
+            while time.monotonic() < deadline:
+                data = json.dumps({"token": rnd.choice(tokens)})
+                async with session.post(f"http://127.0.0.1:{port}{rnd.choice(PATHS)}", data=data) as response:
+                    await response.read()
+                    if response.status == 200:
+                        count += 1
+        await asyncio.gather(*(loop(random.Random(seed * 1000 + i)) for i in range(concurrency)))
+    print(count)
+
+def seed():
+    from game_database import save_account, save_token, save_player_data
+    from player_data import ensurePlayerDataDefaults
+    for i in range(USERS):
+        user_id = save_account(f"worker_{i}", "x", "none")
+        save_player_data(user_id, ensurePlayerDataDefaults({"userId": user_id, "username": f"worker_{i}"}))
+        save_token(f"token_{i}", f"worker_{i}")
+
+async def wait_for_port(port):
+    for _ in range(200):
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"workers never listened on {port}")
+
+async def run(workers, port, seconds, clients, concurrency):
+    env = dict(os.environ, BENCH_DIR=work_dir)
+    processes = [await asyncio.create_subprocess_exec(sys.executable, SCRIPT, "--worker", str(port),
+                                                      stdout=subprocess.DEVNULL, env=dict(env, MASTER_WORKER_ID=str(i)))
+                 for i in range(workers)]
+    try:
+        await wait_for_port(port)
+        await asyncio.sleep(1.0)
+        loads = [await asyncio.create_subprocess_exec(sys.executable, SCRIPT, "--load", str(port), str(seconds),
+                                                      str(concurrency), str(i), stdout=subprocess.PIPE, env=env)
+                 for i in range(clients)]
+        outputs = [await load.communicate() for load in loads]
+        return sum(int(out.strip().splitlines()[-1]) for out, _ in outputs) / seconds
+    finally:
+        for process in processes:
+            process.send_signal(signal.SIGTERM)
+        for process in processes:
+            await process.wait()
+        # let the coordinator see the connections close
+        await asyncio.sleep(0.2)
+
+async def main():
+    import shared_state
+    from workers import COORDINATOR_SOCKET
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+    seed()
+    coordinator = shared_state.Coordinator()
+    await coordinator.serve(COORDINATOR_SOCKET)
+    # one ip sends everything here, a bucket that never runs dry keeps the
+    # coordinator round trip without the 429s
+    import auth_utils
+    auth_utils.rate_buckets["default"] = auth_utils.RateBucket(10 ** 9, 10 ** 9)
+    print(f"{os.cpu_count()} cpus, {clients} client processes x {concurrency}, {seconds}s each")
+    for i, workers in enumerate((1, 2, 4)):
+        rate = await run(workers, 18080 + i, seconds, clients, concurrency)
+        print(f"{workers} worker{'s' if workers > 1 else ' '}  {rate:>7.0f} req/s")
+    print(f"coordinator: {coordinator.stats}")
+
+if __name__ == "__main__":
+    if MODE == "--worker":
+        asyncio.run(serve_worker(int(sys.argv[2])))
+    elif MODE == "--load":
+        asyncio.run(generate_load(int(sys.argv[2]), float(sys.argv[3]), int(sys.argv[4]), int(sys.argv[5])))
+    else:
+        asyncio.run(main())
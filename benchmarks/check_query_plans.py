@@ -0,0 +1,60 @@
+# EXPLAIN QUERY PLAN regression check for db_migrations, plus timings of the
+# indexed statements with and without the migration indexes
+# exits 1 if any migration's query stopped using its index
+#
+#   python benchmarks/check_query_plans.py [rows]
+import sys
+import time
+
+from bench_env import setup_sandbox
+
+setup_sandbox("query_plans")
+
+import database_manager
+import db_migrations
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+def seed(conn):
+    now = time.time()
+    conn.executemany("INSERT INTO accounts (username, password, gender, created, username_changes) VALUES (?, 'x', 'none', ?, 0)",
+                     ((f"user_{i:07d}", now) for i in range(ROWS)))
+    conn.executemany("""INSERT INTO player_data (user_id, username, currency, avatar_data, owned_accessories, pfp, server_id, schema_version, last_updated)
+                        VALUES (?, ?, 10, '{}', '[]', '', ?, 1, ?)""",
+                     ((i + 1, f"user_{i:07d}", f"srv_{i % 500}", now) for i in range(ROWS)))
+    conn.executemany("INSERT INTO accessories (name, type, price, created_at) VALUES (?, ?, ?, ?)",
+                     ((f"acc_{i}", ("hat", "shirt", "pants", "face")[i % 4], i % 1000, now) for i in range(ROWS // 10)))
+    conn.commit()
+
+def timed(conn, query, params, n=200):
+    start = time.perf_counter()
+    for _ in range(n):
+        conn.execute(query, params).fetchall()
+    conn.rollback()
+    return (time.perf_counter() - start) / n * 1e6
+
+def main():
+    conn = database_manager.get_connection()
+    seed(conn)
+
+    checks = [(v, q, p, idx) for v, _, _, cs in db_migrations.MIGRATIONS for q, p, idx in cs]
+
+    indexed = [timed(conn, q, p) for _, q, p, _ in checks]
+    failures = db_migrations.check_query_plans(conn)
+
+    for _, _, _, idx in checks:
+        conn.execute(f"DROP INDEX IF EXISTS {idx}")
+    conn.commit()
+    scanned = [timed(conn, q, p, n=20) for _, q, p, _ in checks]
+
+    print(f"schema_version {db_migrations.get_schema_version(conn)}, {ROWS} rows")
+    print(f"{'ver':>3} {'scan us':>10} {'index us':>10}  query")
+    for (v, q, _, _), a, b in zip(checks, scanned, indexed):
+        print(f"{v:>3} {a:>10.1f} {b:>10.1f}  {q[:70]}")
+
+    for v, q, plan in failures:
+        print(f"\nFAIL migration {v}: {q}\n{plan}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
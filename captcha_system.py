@@ -5,6 +5,7 @@ import base64
 from io import BytesIO
 from PIL import Image, ImageDraw, ImageFont
 from typing import Tuple, Dict
+import shared_state
 
 captcha_store = {}
 ip_first_account = set()
@@ -84,6 +85,32 @@ def is_first_account_from_ip(ip: str) -> bool:
 def mark_ip_used(ip: str):
     ip_first_account.add(ip)
 
+# with several workers the answer waits in the coordinator, the captcha
+# can be answered on a different worker than the one that drew it
+async def generate_puzzle_captcha_async() -> Tuple[str, str]:
+    captcha_id, img_data = generate_puzzle_captcha()
+    if shared_state.enabled:
+        await shared_state.kv_set("captcha", captcha_id, captcha_store.pop(captcha_id), CAPTCHA_EXPIRY)
+    return captcha_id, img_data
+
+async def verify_captcha_async(captcha_id: str, answer: int) -> Tuple[bool, str]:
+    if shared_state.enabled and isinstance(captcha_id, str):
+        captcha_data = await shared_state.kv_pop("captcha", captcha_id)
+        if captcha_data is not None:
+            captcha_store[captcha_id] = captcha_data
+    return verify_captcha(captcha_id, answer)
+
+async def is_first_account_from_ip_async(ip: str) -> bool:
+    if shared_state.enabled:
+        return not await shared_state.kv_get("first_account_ips", ip)
+    return is_first_account_from_ip(ip)
+
+async def mark_ip_used_async(ip: str):
+    if shared_state.enabled:
+        await shared_state.kv_set("first_account_ips", ip, True)
+    else:
+        mark_ip_used(ip)
+
 def cleanup_expired_captchas():
     current_time = time.time()
     expired = [k for k, v in captcha_store.items() if current_time - v["created"] > CAPTCHA_EXPIRY]
@@ -1,5 +1,6 @@
 import os
 import socket
+import threading
 import requests
 import secrets
 from dotenv import load_dotenv
@@ -40,6 +41,26 @@ def get_server_ip():
     print("[WARNING] USING LOCAL IP")
     return get_local_ip()
 
+# the ip lookup and the password file happen on first use (startup.py does
+# both up front), importing config never touches the network or the disk
+lazy_values = {}
+lazy_lock = threading.Lock()
+
+def lazyValue(name, factory):
+    value = lazy_values.get(name)
+    if value is None:
+        with lazy_lock:
+            value = lazy_values.get(name)
+            if value is None:
+                value = lazy_values[name] = factory()
+    return value
+
+def get_server_public_ip():
+    return lazyValue("server_ip", get_server_ip)
+
+def get_dashboard_password():
+    return lazyValue("dashboard_password", generate_dashboard_password)
+
 def generate_dashboard_password():
     password_file = os.path.join("server_data", "dashboard.pwd")
     if os.path.exists(password_file):
@@ -70,13 +91,97 @@ BASE_PORT = int(os.environ.get("PORT", 8080))
 VOLUME_PATH = os.environ.get("VOLUME_PATH", "/mnt/volume")
 BINARIES_DIR = os.environ.get("VOLUME_PATH", "/mnt/volume/binaries/")
 
-SERVER_PUBLIC_IP = get_server_ip()
-
 CACHE_TTL = ((60*60)*24)*30 # 1 month, srry for it being ugly
 DASHBOARD_CACHE_TTL = 10
+STATIC_PAGE_CHECK_INTERVAL = 2 # seconds between mtime checks on cached html pages
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024)) # smaller responses go out uncompressed
+COMPRESS_THREAD_SIZE = 256 * 1024 # bodies this big are compressed off the event loop
+COMPRESS_GZIP_LEVEL = 5
+COMPRESS_BROTLI_QUALITY = 4
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "") # bearer token for /metrics from outside our own ips
+LOOP_LAG_INTERVAL = 0.5 # seconds between event loop lag samples
+TOKEN_MAX_AGE = ((60*60)*24)*30 # sessions expire after a month
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 100000)) # sessions kept in memory (lru)
+TOKEN_NEGATIVE_TTL = 30 # how long an unknown token is answered from memory
+# "opaque" (random token stored in the tokens table) or "signed" (hmac token
+# checked without the db). both formats are accepted either way
+SESSION_TOKEN_FORMAT = os.environ.get("SESSION_TOKEN_FORMAT", "opaque")
+SESSION_SIGNING_KEYS = os.environ.get("SESSION_SIGNING_KEYS", "") # "kid:secret,kid:secret", first one signs
+MAX_SESSIONS_PER_USER = int(os.environ.get("MAX_SESSIONS_PER_USER", 5)) # opaque tokens, oldest goes on login
+TOKEN_DELETE_BATCH = 500 # expired tokens deleted per transaction
 
 RATE_LIMIT_WINDOW = 15 # time for reset max requests
 RATELIMIT_MAX = 10000
+# login/register/change_password per ip, same as everything else unless set.
+# lower it (e.g. 20 per 40s) to slow down password guessing, but players
+# behind one NAT (schools, mobile carriers) share that budget
+AUTH_RATELIMIT_MAX = int(os.environ.get("AUTH_RATELIMIT_MAX", RATELIMIT_MAX))
+AUTH_RATE_LIMIT_WINDOW = float(os.environ.get("AUTH_RATE_LIMIT_WINDOW", RATE_LIMIT_WINDOW))
+# heartbeats per logged in player (30 per 30s = one a second). requests whose
+# session can't be checked without the db (cold cache after a restart) count
+# against the ip's "default" bucket instead, players behind one NAT share it
+HEARTBEAT_RATELIMIT_MAX = int(os.environ.get("HEARTBEAT_RATELIMIT_MAX", 30))
+HEARTBEAT_RATE_LIMIT_WINDOW = float(os.environ.get("HEARTBEAT_RATE_LIMIT_WINDOW", 30))
+# token bucket per client and route group: (burst, refill per second, key)
+# key is "ip" or "user" (session token from the body, falls back to the ip
+# in the "default" group)
+RATE_LIMITS = {
+    "default": (RATELIMIT_MAX, RATELIMIT_MAX / RATE_LIMIT_WINDOW, "ip"),
+    "auth": (AUTH_RATELIMIT_MAX, AUTH_RATELIMIT_MAX / AUTH_RATE_LIMIT_WINDOW, "ip"),
+    "heartbeat": (HEARTBEAT_RATELIMIT_MAX, HEARTBEAT_RATELIMIT_MAX / HEARTBEAT_RATE_LIMIT_WINDOW, "user"),
+    "datastore": (2000, 200.0, "ip"),
+}
+# route -> group, anything else is "default"
+RATE_LIMIT_ROUTES = {
+    "/auth/register": "auth",
+    "/auth/login": "auth",
+    "/auth/register_with_captcha": "auth",
+    "/account/change_password": "auth",
+    "/heartbeat_client": "heartbeat",
+    "/vm/heartbeat": "heartbeat",
+    "/datastore/set": "datastore",
+    "/datastore/get": "datastore",
+    "/datastore/remove": "datastore",
+    "/datastore/list_keys": "datastore",
+}
+
+# read endpoints /batch can run (the client's startup calls), at most
+# BATCH_MAX_OPERATIONS per batch
+BATCH_ROUTES = (
+    "/auth/validate",
+    "/player/get_profile",
+    "/currency/get",
+    "/friends/get",
+    "/friends/get_requests",
+    "/avatar/get_full",
+    "/maintenance_status",
+    "/player/get_pfp",
+    "/avatar/get_user_accessories",
+    "/global_messages",
+)
+BATCH_MAX_OPERATIONS = 20
+
+# worker processes for the master (see workers.py), 1 = single process
+MASTER_WORKERS = int(os.environ.get("MASTER_WORKERS", 1))
+# with several workers these are handled by worker 0, they touch
+# vm_registry, game server processes or dashboard state
+PRIMARY_ROUTES = frozenset((
+    "/heartbeat_client",
+    "/vm/heartbeat",
+    "/vm/startup_log",
+    "/request_server",
+    "/friends/join_server",
+    "/private_server/subscribe",
+    "/private_server/cancel",
+    "/payments/ad_reward", # cooldowns are kept in memory
+))
+PRIMARY_ROUTE_PREFIXES = ("/dashboard", "/api/dashboard")
+
+# graceful restarts (see handoff.py): how long the old process waits for
+# in-flight requests and saves (requestServer can wait 90s for a new VM)
+# and how long a new process gets to start listening before it's given up on
+RELOAD_DRAIN_TIMEOUT = float(os.environ.get("RELOAD_DRAIN_TIMEOUT", 100))
+RELOAD_READY_TIMEOUT = float(os.environ.get("RELOAD_READY_TIMEOUT", 60))
 
 MAX_SERVERS_PER_VM = int(os.environ.get("MAX_SERVERS_PER_VM", 6))
 # limit servers on master vm to save some costs
@@ -86,7 +191,6 @@ MAX_SERVERS_IN_MASTER = int(os.environ.get("MAX_SERVERS_IN_MASTER", 0))
 GODOT_SERVER_BIN = os.environ.get("GODOT_SERVER_BIN", "/mnt/volume/binaries/server.x86_64")
 
 DATASTORE_PASSWORD = os.environ.get("DATASTORE_PASSWORD", "@MEOW")
-DASHBOARD_PASSWORD = generate_dashboard_password()
 
 GOOGLE_PLAY_PACKAGE_NAME = os.environ.get("GOOGLE_PLAY_PACKAGE_NAME", "com.example")
 GOOGLE_SERVICE_ACCOUNT_JSON = os.environ.get("GOOGLE_SERVICE_ACCOUNT_JSON", "service_account.json")
@@ -100,8 +204,6 @@ if os.path.exists(VERSION_FILE):
             CURRENT_SERVER_VERSION = f.read().strip()
     except IOError as e:
         print(e)
-else:
-    print("[WARNING] version file does not exist, this can be ignored")
 
 
 MODELS_DIR = os.path.join(VOLUME_PATH, "models")
@@ -110,6 +212,5 @@ ICONS_DIR = os.path.join(VOLUME_PATH, "icons")
 DB_DIR = os.path.join(VOLUME_PATH, "database")
 BACKUP_DIR = os.path.join(VOLUME_PATH, "backups")
 
-print(f"Server configured with IP: {SERVER_PUBLIC_IP}")
-print(f"Server configured with PORT: {BASE_PORT}")
-print(f"Godot binary path: {GODOT_SERVER_BIN}")
+# seconds runStartup() should take, it warns past this
+STARTUP_BUDGET = float(os.environ.get("STARTUP_BUDGET", 10))
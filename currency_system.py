@@ -1,67 +1,77 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional, List
 import time
 import asyncio
 from player_save_tracker import save_tracker
+from game_database import adjust_currency_async
 from config import CACHE_TTL
+import shared_state
 
 CURRENCY_NAME = "Blips"
 currency_cache = {}
 
-async def creditCurrency(userId: int, amount: int) -> Dict[str, Any]:
-    from player_data import getPlayerData, savePlayerData, invalidate_player_cache
+async def creditCurrency(userId: int, amount: int, extra_statements: Optional[List[tuple]] = None) -> Dict[str, Any]:
+    from player_data import invalidate_player_cache
     if amount <= 0:
         return {"success": False, "error": {"code": "INVALID_AMOUNT", "message": "Amount must be positive"}}
 
     save_id = await save_tracker.start_save(userId, "credit_currency")
 
     try:
-        playerData = getPlayerData(userId)
-        if not playerData:
+        newCurrency = await adjust_currency_async(userId, amount, extra_statements)
+        if newCurrency is None:
             await save_tracker.complete_save(save_id, success=False)
             return {"success": False, "error": {"code": "USER_NOT_FOUND", "message": "User not found"}}
-        currentCurrency = playerData.get("currency", 0)
-        newCurrency = currentCurrency + amount
-        playerData["currency"] = newCurrency
-        await savePlayerData(userId, playerData)
         invalidate_player_cache(userId)
         _invalidate_currency_cache(userId)
 
         await save_tracker.complete_save(save_id, success=True)
-        return {"success": True, "data": {"previousBalance": currentCurrency, "newBalance": newCurrency, "amount": amount}}
+        return {"success": True, "data": {"previousBalance": newCurrency - amount, "newBalance": newCurrency, "amount": amount}}
     except Exception as e:
         await save_tracker.complete_save(save_id, success=False)
         raise
 
-async def debitCurrency(userId: int, amount: int) -> Dict[str, Any]:
-    from player_data import getPlayerData, savePlayerData, invalidate_player_cache
+async def debitCurrency(userId: int, amount: int, extra_statements: Optional[List[tuple]] = None) -> Dict[str, Any]:
+    from player_data import getPlayerRowAsync, invalidate_player_cache
     if amount <= 0:
         return {"success": False, "error": {"code": "INVALID_AMOUNT", "message": "Amount must be positive"}}
 
     save_id = await save_tracker.start_save(userId, "debit_currency")
 
     try:
-        playerData = getPlayerData(userId)
-        if not playerData:
-            await save_tracker.complete_save(save_id, success=False)
-            return {"success": False, "error": {"code": "USER_NOT_FOUND", "message": "User not found"}}
-        currentCurrency = playerData.get("currency", 0)
-        if currentCurrency < amount:
+        newCurrency = await adjust_currency_async(userId, -amount, extra_statements)
+        if newCurrency is None:
             await save_tracker.complete_save(save_id, success=False)
+            if not await getPlayerRowAsync(userId):
+                return {"success": False, "error": {"code": "USER_NOT_FOUND", "message": "User not found"}}
             return {"success": False, "error": {"code": "INSUFFICIENT_FUNDS", "message": "Not enough currency"}}
-        newCurrency = currentCurrency - amount
-        playerData["currency"] = newCurrency
-        await savePlayerData(userId, playerData)
         invalidate_player_cache(userId)
         _invalidate_currency_cache(userId)
 
         await save_tracker.complete_save(save_id, success=True)
-        return {"success": True, "data": {"previousBalance": currentCurrency, "newBalance": newCurrency, "amount": amount}}
+        return {"success": True, "data": {"previousBalance": newCurrency + amount, "newBalance": newCurrency, "amount": amount}}
     except Exception as e:
         await save_tracker.complete_save(save_id, success=False)
         raise
 
 def getCurrency(userId: int) -> Dict[str, Any]:
-    from player_data import getPlayerData
+    from player_data import getPlayerRow
+    currentTime = time.time()
+    cacheKey = f"currency_{userId}"
+    if cacheKey in currency_cache:
+        cached_data, expiry = currency_cache[cacheKey]
+        if currentTime < expiry:
+            return {"success": True, "data": {"balance": cached_data, "currencyName": CURRENCY_NAME}}
+        else:
+            del currency_cache[cacheKey]
+    row = getPlayerRow(userId)
+    if not row:
+        return {"success": False, "error": {"code": "USER_NOT_FOUND", "message": "User not found"}}
+    balance = row.currency or 0
+    currency_cache[cacheKey] = (balance, currentTime + CACHE_TTL)
+    return {"success": True, "data": {"balance": balance, "currencyName": CURRENCY_NAME}}
+
+async def getCurrencyAsync(userId: int) -> Dict[str, Any]:
+    from player_data import getPlayerRowAsync
     currentTime = time.time()
     cacheKey = f"currency_{userId}"
     if cacheKey in currency_cache:
@@ -70,10 +80,10 @@ def getCurrency(userId: int) -> Dict[str, Any]:
             return {"success": True, "data": {"balance": cached_data, "currencyName": CURRENCY_NAME}}
         else:
             del currency_cache[cacheKey]
-    playerData = getPlayerData(userId)
-    if not playerData:
+    row = await getPlayerRowAsync(userId)
+    if not row:
         return {"success": False, "error": {"code": "USER_NOT_FOUND", "message": "User not found"}}
-    balance = playerData.get("currency", 0)
+    balance = row.currency or 0
     currency_cache[cacheKey] = (balance, currentTime + CACHE_TTL)
     return {"success": True, "data": {"balance": balance, "currencyName": CURRENCY_NAME}}
 
@@ -90,10 +100,16 @@ async def transferCurrency(fromUserId: int, toUserId: int, amount: int) -> Dict[
     return {"success": True, "data": {"from": fromUserId, "to": toUserId, "amount": amount}}
 
 def _invalidate_currency_cache(userId: int):
+    _drop_currency_cache(userId)
+    shared_state.publish("currency_cache", userId)
+
+def _drop_currency_cache(userId: int):
     cacheKey = f"currency_{userId}"
     if cacheKey in currency_cache:
         del currency_cache[cacheKey]
 
+shared_state.subscribe("currency_cache", _drop_currency_cache)
+
 def clear_currency_cache():
     global currency_cache
     currency_cache.clear()
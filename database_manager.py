@@ -4,9 +4,15 @@ import json
 import threading
 import asyncio
 import time
+import queue
+import zlib
 from typing import Dict, Any, Optional, List
 from cryptography.fernet import Fernet
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import contextmanager
+from time import perf_counter
+from db_migrations import run_migrations
+import query_stats
 
 DATA_DIR = "server_data"
 DB_FILE = os.path.join(DATA_DIR, "gameserver.db")
@@ -14,15 +20,26 @@ KEY_FILE = os.path.join(DATA_DIR, "db_encryption.key")
 
 db_lock = threading.RLock()
 db_conn = None
+# one read only connection per thread, WAL lets them all read while the
+# writer (db_conn) is busy so SELECTs dont have to wait for db_lock
+read_pool_enabled = os.environ.get("DB_READ_POOL", "true").lower() == "true"
+read_local = threading.local()
+read_connections = []
+read_connections_lock = threading.Lock()
+read_pool_generation = 0
+tx_local = threading.local()
 query_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="db_")
-write_buffer = []
-write_buffer_lock = threading.Lock()
 # dont change these plss
 WRITE_BUFFER_SIZE = 50
 WRITE_BUFFER_FLUSH_INTERVAL = 5.0
-last_flush = time.time()
+# group commit: the writer thread commits once per batch instead of once per statement
+# a batch closes when it has GROUP_COMMIT_MAX_OPS writes or GROUP_COMMIT_INTERVAL passed
+GROUP_COMMIT_MAX_OPS = int(os.environ.get("DB_GROUP_COMMIT_MAX_OPS", 256))
+GROUP_COMMIT_INTERVAL = float(os.environ.get("DB_GROUP_COMMIT_INTERVAL_MS", 2)) / 1000
 
 def generate_encryption_key():
+    if not storage.persistent:
+        return Fernet.generate_key()
     os.makedirs(DATA_DIR, exist_ok=True)
 
     if not os.path.exists(KEY_FILE):
@@ -35,31 +52,71 @@ def generate_encryption_key():
     with open(KEY_FILE, "rb") as f:
         return f.read()
 
-encryption_key = generate_encryption_key()
-cipher = Fernet(encryption_key)
+cipher = None
+
+# key file is read (or created) on first use, not at import
+def get_cipher() -> Fernet:
+    global cipher
+    if cipher is None:
+        cipher = Fernet(generate_encryption_key())
+    return cipher
 
 def encrypt_data(data: str) -> str:
-    return cipher.encrypt(data.encode()).decode()
+    return get_cipher().encrypt(data.encode()).decode()
 
 def decrypt_data(encrypted: str) -> str:
     try:
-        return cipher.decrypt(encrypted.encode()).decode()
+        return get_cipher().decrypt(encrypted.encode()).decode()
     except:
         return ""
 
-def init_database():
-    global db_conn
-    os.makedirs(DATA_DIR, exist_ok=True)
-    db_conn = sqlite3.connect(DB_FILE, check_same_thread=False, timeout=10)
+def apply_pragmas(conn):
     # copied these pragmas from somewhere, idk what they do nor i want to know
     # its 2 am and i just want to finish this
-    db_conn.execute("PRAGMA journal_mode=WAL")
-    db_conn.execute("PRAGMA synchronous=NORMAL")
-    db_conn.execute("PRAGMA cache_size=20000")
-    db_conn.execute("PRAGMA temp_store=MEMORY")
-    db_conn.execute("PRAGMA query_only=False")
-    db_conn.execute("PRAGMA mmap_size=30000000")
-    db_conn.execute("PRAGMA page_size=4096")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=20000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA query_only=False")
+    conn.execute("PRAGMA mmap_size=30000000")
+    conn.execute("PRAGMA page_size=4096")
+
+# where the sqlite databases live, picked with DB_BACKEND
+# sqlite (default): files under server_data/, WAL, read pool, backups
+# memory: every database (gameserver.db and each shard) is a private
+# in-memory sqlite db. same schema, migrations and sql so same semantics,
+# but nothing touches the disk and it is gone when the process exits.
+# for tests and for benchmarking the request path without disk I/O
+class SQLiteStorage:
+    name = "sqlite"
+    persistent = True
+    read_pool = True
+
+    def connect(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        apply_pragmas(conn)
+        return conn
+
+class MemoryStorage:
+    name = "memory"
+    persistent = False
+    # a :memory: db is private to its connection, every read goes through
+    # the writer connection under its lock
+    read_pool = False
+
+    def connect(self, path: str):
+        return sqlite3.connect(":memory:", check_same_thread=False)
+
+STORAGE_BACKENDS = {"sqlite": SQLiteStorage, "memory": MemoryStorage}
+DB_BACKEND = os.environ.get("DB_BACKEND", "sqlite").lower()
+if DB_BACKEND not in STORAGE_BACKENDS:
+    raise ValueError(f"DB_BACKEND must be one of {', '.join(STORAGE_BACKENDS)}, got {DB_BACKEND!r}")
+storage = STORAGE_BACKENDS[DB_BACKEND]()
+read_pool_enabled = read_pool_enabled and storage.read_pool
+
+def init_database():
+    db_conn = storage.connect(DB_FILE)
 
     db_conn.executescript("""
         CREATE TABLE IF NOT EXISTS accounts (
@@ -190,40 +247,186 @@ def init_database():
     """)
 
     db_conn.commit()
+    run_migrations(db_conn)
+    if SHARD_COUNT <= 1 and storage.persistent:
+        # back from sharded mode, pull the rows home
+        _move_shard_rows(db_conn, [])
     return db_conn
 
+# opened on first use, importing this module doesnt create or touch any file
 def get_connection():
     global db_conn
     if db_conn is None:
-        db_conn = init_database()
+        with db_lock:
+            if db_conn is None:
+                db_conn = init_database()
     return db_conn
 
-def execute_query(query: str, params: tuple = (), fetch_one: bool = False, fetch_all: bool = False):
+def open_read_connection(path: str):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False, timeout=10)
+    conn.execute("PRAGMA query_only=ON")
+    conn.execute("PRAGMA cache_size=20000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=30000000")
+
+    with read_connections_lock:
+        read_connections.append(conn)
+    return conn
+
+def get_read_connection():
+    conn = getattr(read_local, "conn", None)
+    if conn is not None and read_local.generation == read_pool_generation:
+        return conn
+
+    get_connection()
+    conn = open_read_connection(DB_FILE)
+    read_local.conn = conn
+    read_local.generation = read_pool_generation
+    return conn
+
+def close_read_connections():
+    global read_pool_generation
+    with read_connections_lock:
+        read_pool_generation += 1
+        for conn in read_connections:
+            try:
+                conn.close()
+            except:
+                pass
+        read_connections.clear()
+
+def set_read_pool_enabled(enabled: bool):
+    global read_pool_enabled
+    read_pool_enabled = enabled and storage.read_pool
+
+def get_read_pool_stats() -> Dict[str, Any]:
+    with read_connections_lock:
+        return {"enabled": read_pool_enabled, "connections": len(read_connections), "backend": storage.name}
+
+def is_read_query(query: str) -> bool:
+    head = query.lstrip()[:6].upper()
+    return head == "SELECT"
+
+def _execute_read(query: str, params: tuple, fetch_one: bool, conn=None, row_factory=None):
+    if conn is None:
+        conn = get_read_connection()
+    cursor = conn.cursor()
+    if row_factory is not None:
+        cursor.row_factory = row_factory
+    start = perf_counter()
+    try:
+        cursor.execute(query, params)
+        result = cursor.fetchone() if fetch_one else cursor.fetchall()
+    except Exception:
+        if query_stats.enabled:
+            query_stats.record(query, 0.0, perf_counter() - start, 0, True)
+        raise
+    finally:
+        cursor.close()
+    if query_stats.enabled:
+        query_stats.record(query, 0.0, perf_counter() - start,
+                           (1 if result else 0) if fetch_one else len(result), conn=conn, params=params)
+    return result
+
+def in_transaction() -> bool:
+    return getattr(tx_local, "depth", 0) > 0
+
+# several statements, one db_lock hold and one commit
+# nests, only the outermost block commits (or rolls back on error)
+@contextmanager
+def transaction():
     with db_lock:
         conn = get_connection()
+        depth = getattr(tx_local, "depth", 0)
+        if depth == 0 and not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        tx_local.depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            tx_local.depth = depth
+            if depth == 0:
+                conn.rollback()
+            raise
+        tx_local.depth = depth
+        if depth == 0:
+            conn.commit()
+
+class AsyncTransaction:
+    # statements are queued while the block runs and applied together on the
+    # db executor when it exits, so the event loop never holds db_lock
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, query: str, params: tuple = ()):
+        self.statements.append((query, params))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None or not self.statements:
+            return False
+        await run_in_db(_execute_statements, self.statements)
+        return False
+
+def transaction_async() -> AsyncTransaction:
+    return AsyncTransaction()
+
+def _execute_statements(statements: List[tuple]):
+    with transaction() as conn:
+        for query, params in statements:
+            conn.execute(query, params)
+
+# row_factory builds each fetched row (cursor, row) -> record, game_database
+# passes its record types so rows never go through a dict
+def execute_query(query: str, params: tuple = (), fetch_one: bool = False, fetch_all: bool = False, row_factory=None):
+    tx_active = in_transaction()
+    # inside a transaction reads have to see its uncommitted writes, so they stay on db_conn
+    if read_pool_enabled and not tx_active and (fetch_one or fetch_all) and is_read_query(query):
+        return _execute_read(query, params, fetch_one, row_factory=row_factory)
+
+    return _execute_locked(db_lock, get_connection, query, params, fetch_one, fetch_all, tx_active, row_factory)
+
+def _execute_locked(lock, connect, query: str, params: tuple, fetch_one: bool, fetch_all: bool, tx_active: bool, row_factory=None):
+    wait_start = perf_counter()
+    with lock:
+        start = perf_counter()
+        conn = connect()
         cursor = conn.cursor()
+        if row_factory is not None:
+            cursor.row_factory = row_factory
 
         try:
             cursor.execute(query, params)
 
             if fetch_one:
                 result = cursor.fetchone()
-                conn.commit()
-                return result
+                rows = 1 if result else 0
             elif fetch_all:
                 result = cursor.fetchall()
-                conn.commit()
-                return result
+                rows = len(result)
             else:
+                result = cursor.lastrowid
+                rows = cursor.rowcount
+
+            # plain SELECTs never open a transaction, nothing to commit
+            if not tx_active and conn.in_transaction:
                 conn.commit()
-                return cursor.lastrowid
+            if query_stats.enabled:
+                query_stats.record(query, start - wait_start, perf_counter() - start, rows, conn=conn, params=params)
+            return result
         except sqlite3.OperationalError as e:
-            if "database is locked" in str(e):
+            if query_stats.enabled:
+                query_stats.record(query, start - wait_start, perf_counter() - start, 0, True)
+            if not tx_active:
                 conn.rollback()
-                raise
             raise
         except Exception as e:
-            conn.rollback()
+            if query_stats.enabled:
+                query_stats.record(query, start - wait_start, perf_counter() - start, 0, True)
+            if not tx_active:
+                conn.rollback()
             raise
 
 def execute_query_async(query: str, params: tuple = (), fetch_one: bool = False, fetch_all: bool = False):
@@ -233,64 +436,362 @@ def execute_query_async(query: str, params: tuple = (), fetch_one: bool = False,
         lambda: execute_query(query, params, fetch_one, fetch_all)
     )
 
-def buffer_write(query: str, params: tuple):
-    global last_flush
-
-    with write_buffer_lock:
-        write_buffer.append((query, params))
-
-        should_flush = (
-            len(write_buffer) >= WRITE_BUFFER_SIZE or
-            (time.time() - last_flush) >= WRITE_BUFFER_FLUSH_INTERVAL
-        )
-
-    if should_flush:
-        flush_write_buffer()
-
-def flush_write_buffer():
-    global last_flush
-
-    with write_buffer_lock:
-        if not write_buffer:
-            return
-
-        queries = write_buffer.copy()
-        write_buffer.clear()
-
-    with db_lock:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        try:
-            for query, params in queries:
-                cursor.execute(query, params)
-            conn.commit()
-            last_flush = time.time()
-        except Exception as e:
-            conn.rollback()
-            raise
-
-def save_payment_record(user_id: int, purchase_token: str, product_id: str,
-                       amount: int, currency_awarded: int, verified: bool) -> int:
-    query = """INSERT INTO payments
-               (user_id, purchase_token, product_id, amount, currency_awarded, verified, created)
-               VALUES (?, ?, ?, ?, ?, ?, ?)"""
-    return execute_query(query, (user_id, purchase_token, product_id, amount,
-                                 currency_awarded, verified, time.time()))
-
-def save_ad_reward_record(user_id: int, ad_network: str, ad_unit_id: str,
-                         reward_amount: int, verified: bool) -> int:
-    query = """INSERT INTO ad_rewards
-               (user_id, ad_network, ad_unit_id, reward_amount, verified, created)
-               VALUES (?, ?, ?, ?, ?, ?)"""
-    return execute_query(query, (user_id, ad_network, ad_unit_id, reward_amount,
-                                 verified, time.time()))
-
-def save_accessory_purchase(user_id: int, accessory_id: int, price_paid: int) -> int:
-    query = """INSERT INTO accessory_purchases
-               (user_id, accessory_id, price_paid, created)
-               VALUES (?, ?, ?, ?)"""
-    return execute_query(query, (user_id, accessory_id, price_paid, time.time()))
+# runs any blocking db function on query_executor so the event loop
+# never waits on sqlite (or the fsync on commit)
+async def run_in_db(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(query_executor, lambda: func(*args, **kwargs))
+
+class GroupCommitWriter:
+    def __init__(self, max_ops: int, interval: float, lock=None, connect=None, name: str = "db_writer"):
+        self.max_ops = max_ops
+        self.interval = interval
+        # shards pass their own lock/connection, default is gameserver.db
+        self.lock = lock or db_lock
+        self.connect = connect or get_connection
+        self.name = name
+        self.pending = queue.Queue()
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.stats = {"batches": 0, "ops": 0, "failed_ops": 0, "largest_batch": 0, "commit_time": 0.0}
+
+    def start(self):
+        with self.start_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self.thread.start()
+
+    def submit(self, query: Optional[str], params: tuple = ()) -> Future:
+        if self.thread is None:
+            self.start()
+        future = Future()
+        self.pending.put((query, params, future))
+        return future
+
+    def flush(self, timeout: Optional[float] = None):
+        # queue is fifo, so once this marker resolves everything before it is committed
+        self.submit(None).result(timeout=timeout)
+
+    def _run(self):
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.interval
+
+            while len(batch) < self.max_ops:
+                try:
+                    batch.append(self.pending.get_nowait())
+                    continue
+                except queue.Empty:
+                    pass
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._commit(batch)
+
+    def _commit(self, batch):
+        results = []
+        start = time.perf_counter()
+
+        with self.lock:
+            lock_wait = perf_counter() - start
+            conn = self.connect()
+            try:
+                if not conn.in_transaction:
+                    conn.execute("BEGIN")
+                for query, params, future in batch:
+                    if query is None:
+                        results.append((future, None, None))
+                        continue
+                    # savepoint per op so one bad statement doesnt sink the whole batch
+                    conn.execute("SAVEPOINT group_op")
+                    op_start = perf_counter()
+                    try:
+                        cursor = conn.execute(query, params)
+                        conn.execute("RELEASE group_op")
+                        results.append((future, cursor.lastrowid, None))
+                        if query_stats.enabled:
+                            query_stats.record(query, lock_wait, perf_counter() - op_start, cursor.rowcount, conn=conn, params=params)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO group_op")
+                        conn.execute("RELEASE group_op")
+                        results.append((future, None, e))
+                        if query_stats.enabled:
+                            query_stats.record(query, lock_wait, perf_counter() - op_start, 0, True)
+                conn.commit()
+            except Exception as e:
+                try:
+                    conn.rollback()
+                except:
+                    pass
+                print(f"Group commit failed, {len(batch)} writes lost: {e}")
+                self.stats["failed_ops"] += len(batch)
+                for _, _, future in batch:
+                    _resolve_future(future, None, e)
+                return
+
+        self.stats["batches"] += 1
+        self.stats["ops"] += len(batch)
+        self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+        self.stats["commit_time"] += time.perf_counter() - start
+
+        for future, value, error in results:
+            if error is not None:
+                self.stats["failed_ops"] += 1
+            _resolve_future(future, value, error)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["queued"] = self.pending.qsize()
+        stats["avg_batch"] = round(stats["ops"] / stats["batches"], 2) if stats["batches"] else 0
+        return stats
+
+def _resolve_future(future: Future, value, error):
+    if future.done():
+        return
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(value)
+    except Exception:
+        # cancelled by an awaiting task that went away
+        pass
+
+group_writer = GroupCommitWriter(GROUP_COMMIT_MAX_OPS, GROUP_COMMIT_INTERVAL)
+
+# writes that go through the group commit writer
+# both return the row's lastrowid once the batch holding it has committed
+def execute_write(query: str, params: tuple = ()):
+    # the writer thread would wait on the db_lock we hold, just join our transaction
+    if in_transaction():
+        return execute_query(query, params)
+    return group_writer.submit(query, params).result()
+
+async def execute_write_async(query: str, params: tuple = ()):
+    return await asyncio.wrap_future(group_writer.submit(query, params))
+
+# fire and forget, the returned future can still be waited on
+def buffer_write(query: str, params: tuple) -> Future:
+    return group_writer.submit(query, params)
+
+def flush_write_buffer(timeout: Optional[float] = 30.0):
+    for writer in [group_writer] + [shard.writer for shard in shards]:
+        if writer.thread is not None:
+            writer.flush(timeout=timeout)
+
+# optional sharding, DB_SHARDS=N (N > 1) spreads player_data and datastores
+# over N extra files, each with its own lock and group commit
+# writer, so datastore sets and player saves stop queueing on gameserver.db
+# rows go by user_id % N or crc32(key) % N, accounts/tokens/etc stay global
+# friends stay global too, both directions of a friendship are written in one
+# transaction() and would land on different shards
+# a transaction never spans files, save_player_data_async orders the
+# cross file writes so a failure cant leave the guard rows half written
+SHARD_COUNT = int(os.environ.get("DB_SHARDS", "0"))
+SHARD_TABLES = {"player_data": "user_id", "datastores": "key"}
+# sharded by an older version, moved back into gameserver.db
+UNSHARDED_TABLES = ("friends",)
+SHARD_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS player_data (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT NOT NULL,
+        currency INTEGER DEFAULT 100,
+        avatar_data TEXT,
+        owned_accessories TEXT DEFAULT '[]',
+        pfp TEXT,
+        server_id TEXT,
+        schema_version INTEGER DEFAULT 1,
+        last_updated REAL
+    );
+
+    CREATE TABLE IF NOT EXISTS datastores (
+        key TEXT PRIMARY KEY,
+        value TEXT,
+        timestamp REAL NOT NULL
+    );
+
+    -- idx_player_data_server is migration 1 in gameserver.db
+    CREATE INDEX IF NOT EXISTS idx_player_data_server ON player_data(server_id);
+    CREATE INDEX IF NOT EXISTS idx_player_data_updated ON player_data(last_updated);
+    CREATE INDEX IF NOT EXISTS idx_datastores_timestamp ON datastores(timestamp);
+"""
+shards = []
+shards_lock = threading.Lock()
+
+class DatabaseShard:
+    def __init__(self, index: int, path: str):
+        self.index = index
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = None
+        self.read_local = threading.local()
+        self.writer = GroupCommitWriter(GROUP_COMMIT_MAX_OPS, GROUP_COMMIT_INTERVAL,
+                                        lock=self.lock, connect=self.get_connection, name=f"db_writer_{index}")
+
+    def get_connection(self):
+        if self.conn is None:
+            with self.lock:
+                if self.conn is None:
+                    conn = storage.connect(self.path)
+                    conn.executescript(SHARD_SCHEMA)
+                    conn.commit()
+                    self.conn = conn
+        return self.conn
+
+    def get_read_connection(self):
+        conn = getattr(self.read_local, "conn", None)
+        if conn is not None and self.read_local.generation == read_pool_generation:
+            return conn
+
+        self.get_connection()
+        conn = open_read_connection(self.path)
+        self.read_local.conn = conn
+        self.read_local.generation = read_pool_generation
+        return conn
+
+    def query(self, query: str, params: tuple = (), fetch_one: bool = False, fetch_all: bool = False, row_factory=None):
+        if read_pool_enabled and (fetch_one or fetch_all) and is_read_query(query):
+            return _execute_read(query, params, fetch_one, self.get_read_connection(), row_factory)
+        return _execute_locked(self.lock, self.get_connection, query, params, fetch_one, fetch_all, False, row_factory)
+
+def shard_index(value, count: int) -> int:
+    if isinstance(value, int):
+        return value % count
+    return zlib.crc32(str(value).encode()) % count
+
+def get_shards() -> List[DatabaseShard]:
+    if SHARD_COUNT <= 1:
+        return shards
+    if not shards:
+        with shards_lock:
+            if not shards:
+                directory = os.path.join(DATA_DIR, f"shards_{SHARD_COUNT}")
+                new_shards = [DatabaseShard(i, os.path.join(directory, f"shard_{i}.db")) for i in range(SHARD_COUNT)]
+                for shard in new_shards:
+                    shard.get_connection()
+                if storage.persistent:
+                    with db_lock:
+                        _move_shard_rows(get_connection(), new_shards)
+                shards.extend(new_shards)
+    return shards
+
+# shard for a user_id (player_data) or datastore key, None when unsharded
+def shard_for(value) -> Optional[DatabaseShard]:
+    current = get_shards()
+    if not current:
+        return None
+    return current[shard_index(value, len(current))]
+
+def shard_query(shard: Optional[DatabaseShard], query: str, params: tuple = (), fetch_one: bool = False,
+                fetch_all: bool = False, row_factory=None):
+    if shard is None:
+        return execute_query(query, params, fetch_one, fetch_all, row_factory)
+    return shard.query(query, params, fetch_one, fetch_all, row_factory)
+
+def shard_write(shard: Optional[DatabaseShard], query: str, params: tuple = ()):
+    if shard is None:
+        return execute_write(query, params)
+    return shard.writer.submit(query, params).result()
+
+async def shard_write_async(shard: Optional[DatabaseShard], query: str, params: tuple = ()):
+    if shard is None:
+        return await execute_write_async(query, params)
+    return await asyncio.wrap_future(shard.writer.submit(query, params))
+
+# same statement on every shard (or just gameserver.db), rows are concatenated
+def execute_all_shards(query: str, params: tuple = (), fetch_all: bool = False):
+    current = get_shards()
+    if not current:
+        return execute_query(query, params, fetch_all=fetch_all)
+    if fetch_all:
+        rows = []
+        for shard in current:
+            rows.extend(shard.query(query, params, fetch_all=True))
+        return rows
+    for shard in current:
+        shard.query(query, params)
+    return None
+
+def _move_shard_rows(main_conn, targets: List[DatabaseShard]):
+    # moves rows left in gameserver.db or in a shards_M dir from an older
+    # DB_SHARDS setting into the current layout. old dirs are renamed, not deleted
+    sources = []
+    if targets:
+        sources.append((main_conn, None))
+    current_dir = f"shards_{SHARD_COUNT}" if targets else None
+    if os.path.isdir(DATA_DIR):
+        for name in sorted(os.listdir(DATA_DIR)):
+            path = os.path.join(DATA_DIR, name)
+            if not name.startswith("shards_") or name == current_dir or "." in name or not os.path.isdir(path):
+                continue
+            for file_name in sorted(os.listdir(path)):
+                if file_name.endswith(".db"):
+                    sources.append((sqlite3.connect(os.path.join(path, file_name)), path))
+
+    if not sources:
+        return
+
+    moved = 0
+    for source, _ in sources:
+        for table, key in SHARD_TABLES.items():
+            try:
+                cursor = source.execute(f"SELECT * FROM {table}")
+            except sqlite3.OperationalError:
+                continue
+            columns = [d[0] for d in cursor.description]
+            key_pos = columns.index(key)
+            insert = f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+            while True:
+                batch = cursor.fetchmany(5000)
+                if not batch:
+                    break
+                if not targets:
+                    main_conn.executemany(insert, batch)
+                else:
+                    grouped = {}
+                    for row in batch:
+                        grouped.setdefault(shard_index(row[key_pos], len(targets)), []).append(row)
+                    for index, rows in grouped.items():
+                        targets[index].get_connection().executemany(insert, rows)
+                moved += len(batch)
+
+    for source in [source for source, path in sources if path] + [shard.get_connection() for shard in targets]:
+        for table in UNSHARDED_TABLES:
+            try:
+                cursor = source.execute(f"SELECT * FROM {table}")
+            except sqlite3.OperationalError:
+                continue
+            columns = [d[0] for d in cursor.description]
+            rows = cursor.fetchall()
+            main_conn.executemany(f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+                                  f"VALUES ({', '.join('?' * len(columns))})", rows)
+            source.execute(f"DROP TABLE {table}")
+            moved += len(rows)
+
+    for shard in targets:
+        shard.get_connection().commit()
+    main_conn.commit()
+
+    for source, path in sources:
+        if path is None:
+            for table in SHARD_TABLES:
+                source.execute(f"DELETE FROM {table}")
+            source.commit()
+        else:
+            source.close()
+    for path in {path for _, path in sources if path}:
+        os.rename(path, f"{path}.migrated-{int(time.time())}")
+
+    if moved:
+        print(f"Moved {moved} rows into {'%d shards' % len(targets) if targets else 'gameserver.db'}")
+
+def get_shard_stats() -> List[Dict[str, Any]]:
+    return [{"index": shard.index, "path": shard.path, "writer": shard.writer.get_stats()} for shard in shards]
 
 def get_weather_types() -> List[str]:
     query = "SELECT weather_name FROM weather_types ORDER BY weather_name"
@@ -313,8 +814,8 @@ def remove_weather_type(weather_name: str) -> bool:
         return False
 
 def cleanup_old_data(days: int = 30):
+    from game_database import delete_old_tokens
     cutoff = time.time() - (days * 86400)
-    execute_query("DELETE FROM datastores WHERE timestamp < ?", (cutoff,))
-    execute_query("DELETE FROM tokens WHERE created < ?", (cutoff,))
-
-init_database()
+    execute_all_shards("DELETE FROM datastores WHERE timestamp < ?", (cutoff,))
+    # batched like cleanupTask, one big DELETE would hold db_lock for all of it
+    delete_old_tokens(cutoff)
@@ -0,0 +1,277 @@
+import os
+import sys
+import time
+import sqlite3
+import asyncio
+from typing import Dict, Any, List
+from config import BACKUP_DIR
+from database_manager import DB_FILE, db_lock, storage, get_connection, get_shards, flush_write_buffer, close_read_connections
+
+BACKUP_INTERVAL = float(os.environ.get("DB_BACKUP_INTERVAL_MIN", "60")) * 60
+BACKUP_KEEP = int(os.environ.get("DB_BACKUP_KEEP", "24"))
+# pages per backup step and the pause between steps, so a big db is copied
+# in small bites instead of one long burst of io
+BACKUP_STEP_PAGES = int(os.environ.get("DB_BACKUP_STEP_PAGES", "256"))
+BACKUP_STEP_SLEEP = float(os.environ.get("DB_BACKUP_STEP_SLEEP_MS", "5")) / 1000
+BACKUP_PREFIX = "gameserver-"
+
+backup_running = False
+backup_stats = {
+    "backups": 0,
+    "failures": 0,
+    "last_error": None,
+    "last_backup": None,
+    "running": False
+}
+
+def _shard_files(name: str) -> List[str]:
+    # gameserver-<ts>.db comes with gameserver-<ts>.shard<i>.db when sharded
+    base = name[:-3]
+    return sorted(f for f in os.listdir(BACKUP_DIR) if f.startswith(base + ".shard") and f.endswith(".db"))
+
+def list_backups() -> List[Dict[str, Any]]:
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    backups = []
+    for name in os.listdir(BACKUP_DIR):
+        if not name.startswith(BACKUP_PREFIX) or not name.endswith(".db") or ".shard" in name:
+            continue
+        files = [name] + _shard_files(name)
+        backups.append({
+            "file": name,
+            "shards": len(files) - 1,
+            "bytes": sum(os.path.getsize(os.path.join(BACKUP_DIR, f)) for f in files),
+            "created": os.path.getmtime(os.path.join(BACKUP_DIR, name))
+        })
+    backups.sort(key=lambda b: b["file"], reverse=True)
+    return backups
+
+def rotate_backups(keep: int = BACKUP_KEEP) -> int:
+    removed = 0
+    for backup in list_backups()[keep:]:
+        try:
+            for name in _shard_files(backup["file"]) + [backup["file"]]:
+                os.remove(os.path.join(BACKUP_DIR, name))
+            removed += 1
+        except OSError as e:
+            print(f"Failed to remove old backup {backup['file']}: {e}")
+    return removed
+
+def _copy_database(source_path: str, dest_path: str, progress) -> int:
+    tmp_path = dest_path + ".tmp"
+    # own connection, not db_conn, so db_lock is never touched
+    # the read transaction pins one WAL snapshot for the whole copy: writers
+    # carry on and the backup doesnt restart every time they commit
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True, check_same_thread=False, timeout=10)
+    target = None
+    try:
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+        target = sqlite3.connect(tmp_path)
+        source.backup(target, pages=BACKUP_STEP_PAGES, progress=progress)
+        source.rollback()
+
+        check = target.execute("PRAGMA quick_check").fetchone()[0]
+        pages = target.execute("PRAGMA page_count").fetchone()[0]
+        target.close()
+        target = None
+        if check != "ok":
+            raise sqlite3.DatabaseError(f"quick_check failed on {os.path.basename(source_path)}: {check}")
+        return pages
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    finally:
+        if target is not None:
+            target.close()
+        source.close()
+
+def backup_database(dest_dir: str = BACKUP_DIR) -> Dict[str, Any]:
+    global backup_running
+    if not storage.persistent:
+        return {"success": False, "error": "memory_backend"}
+    if backup_running:
+        return {"success": False, "error": "backup_in_progress"}
+    backup_running = True
+    backup_stats["running"] = True
+
+    os.makedirs(dest_dir, exist_ok=True)
+    name = BACKUP_PREFIX + time.strftime("%Y%m%d-%H%M%S", time.gmtime()) + ".db"
+    # main db + one file per shard, each copy is its own snapshot
+    copies = [(DB_FILE, os.path.join(dest_dir, name))]
+    for shard in get_shards():
+        copies.append((shard.path, os.path.join(dest_dir, f"{name[:-3]}.shard{shard.index}.db")))
+    steps = [0]
+
+    def progress(status, remaining, total):
+        steps[0] += 1
+        if remaining and BACKUP_STEP_SLEEP > 0:
+            time.sleep(BACKUP_STEP_SLEEP)
+
+    start = time.perf_counter()
+    try:
+        get_connection()
+        pages = 0
+        for source_path, dest_path in copies:
+            pages += _copy_database(source_path, dest_path, progress)
+        # main file last, list_backups only sees a backup once every part is there
+        for _, dest_path in copies[::-1]:
+            os.replace(dest_path + ".tmp", dest_path)
+
+        duration = time.perf_counter() - start
+        size = sum(os.path.getsize(dest_path) for _, dest_path in copies)
+        removed = rotate_backups()
+
+        result = {
+            "file": name,
+            "shards": len(copies) - 1,
+            "bytes": size,
+            "pages": pages,
+            "steps": steps[0],
+            "duration_s": round(duration, 3),
+            "mb_per_s": round(size / 1048576 / duration, 2) if duration > 0 else 0,
+            "rotated": removed,
+            "time": time.time()
+        }
+        backup_stats["backups"] += 1
+        backup_stats["last_backup"] = result
+        print(f"Backup {name}: {size / 1048576:.1f}MB in {duration:.2f}s ({steps[0]} steps)")
+        return {"success": True, "data": result}
+    except Exception as e:
+        backup_stats["failures"] += 1
+        backup_stats["last_error"] = f"{time.strftime('%Y-%m-%d %H:%M:%S')}: {e}"
+        print(f"Backup failed: {e}")
+        for _, dest_path in copies:
+            try:
+                os.remove(dest_path + ".tmp")
+            except OSError:
+                pass
+        return {"success": False, "error": str(e)}
+    finally:
+        backup_running = False
+        backup_stats["running"] = False
+
+def _verify_file(path: str):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        problems = [row[0] for row in conn.execute("PRAGMA integrity_check").fetchall()]
+        tables = {}
+        for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"):
+            tables[table] = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        problems = [str(e)]
+        tables = {}
+    finally:
+        conn.close()
+    return problems, tables
+
+def verify_backup(path: str) -> Dict[str, Any]:
+    path = os.path.join(BACKUP_DIR, os.path.basename(path))
+    if not os.path.exists(path):
+        return {"success": False, "error": "backup_not_found"}
+
+    start = time.perf_counter()
+    problems, tables = _verify_file(path)
+    shard_files = _shard_files(os.path.basename(path))
+    for name in shard_files:
+        shard_problems, shard_tables = _verify_file(os.path.join(BACKUP_DIR, name))
+        if shard_problems != ["ok"]:
+            problems = (problems if problems != ["ok"] else []) + [f"{name}: {p}" for p in shard_problems]
+        # sharded tables are empty in the main file, count them where they live
+        for table, count in shard_tables.items():
+            tables[table] = tables.get(table, 0) + count
+
+    ok = problems == ["ok"]
+    return {
+        "success": ok,
+        "data": {
+            "file": os.path.basename(path),
+            "shards": len(shard_files),
+            "integrity": "ok" if ok else problems[:20],
+            "tables": tables,
+            "duration_s": round(time.perf_counter() - start, 3)
+        }
+    }
+
+def restore_backup(path: str) -> Dict[str, Any]:
+    # copies a verified backup over the live db. meant for a stopped server
+    # (python db_backup.py restore <file>), caches of a running one would be stale
+    verified = verify_backup(path)
+    if not verified["success"]:
+        return verified
+    name = os.path.basename(path)
+    current_shards = get_shards()
+    if verified["data"]["shards"] != len(current_shards):
+        return {"success": False, "error": f"backup has {verified['data']['shards']} shards, DB_SHARDS is {len(current_shards)}"}
+
+    flush_write_buffer()
+    targets = [(os.path.join(BACKUP_DIR, name), db_lock, get_connection)]
+    shard_names = {int(f.rsplit(".shard", 1)[1][:-3]): f for f in _shard_files(name)}
+    for shard in current_shards:
+        if shard.index not in shard_names:
+            return {"success": False, "error": f"backup is missing shard {shard.index}"}
+        targets.append((os.path.join(BACKUP_DIR, shard_names[shard.index]), shard.lock, shard.get_connection))
+
+    problems = []
+    for source_path, lock, connect in targets:
+        source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+        try:
+            with lock:
+                conn = connect()
+                if conn.in_transaction:
+                    conn.commit()
+                source.backup(conn)
+                check = conn.execute("PRAGMA integrity_check").fetchone()[0]
+                if check != "ok":
+                    problems.append(f"{os.path.basename(source_path)}: {check}")
+        finally:
+            source.close()
+    close_read_connections()
+
+    return {"success": not problems, "data": {"restored": name, "integrity": problems or "ok", "tables": verified["data"]["tables"]}}
+
+def get_backup_stats() -> Dict[str, Any]:
+    stats = dict(backup_stats)
+    backups = list_backups()
+    stats["count"] = len(backups)
+    stats["total_bytes"] = sum(b["bytes"] for b in backups)
+    stats["keep"] = BACKUP_KEEP
+    stats["interval_s"] = BACKUP_INTERVAL
+    stats["files"] = backups[:10]
+    return stats
+
+async def backup_loop():
+    if BACKUP_INTERVAL <= 0 or not storage.persistent:
+        return
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL)
+        try:
+            await loop.run_in_executor(None, backup_database)
+        except Exception as e:
+            print(f"Error in backup loop: {e}")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("backup", "verify", "restore", "list"):
+        print("usage: python db_backup.py backup | list | verify <file> | restore <file>")
+        sys.exit(1)
+
+    command = sys.argv[1]
+    if command == "backup":
+        result = backup_database()
+    elif command == "list":
+        result = {"success": True, "data": list_backups()}
+    elif len(sys.argv) < 3:
+        print(f"usage: python db_backup.py {command} <file>")
+        sys.exit(1)
+    elif command == "verify":
+        result = verify_backup(sys.argv[2])
+    else:
+        result = restore_backup(sys.argv[2])
+
+    print(result)
+    sys.exit(0 if result["success"] else 1)
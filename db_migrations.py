@@ -0,0 +1,104 @@
+import time
+import hashlib
+
+# schema changes on top of the CREATE IF NOT EXISTS block in init_database
+# append only!! never edit or reorder a migration that already shipped,
+# live dbs remember the version they are at
+#
+# each migration is (version, name, sql or fn(conn), plan_checks), use a fn
+# for anything that needs more than one statement (ALTER TABLE ADD COLUMN + backfill...)
+# plan_checks are (query, params, index) the query has to use once the
+# migration ran, benchmarks/check_query_plans.py runs them
+
+# denylist for signed session tokens (auth_utils), token_id is the token
+# nonce or "user:<id>" for all of a user's sessions
+def _create_revoked_sessions(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS revoked_sessions (
+            token_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            revoked REAL NOT NULL,
+            expires REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_revoked_sessions_expires ON revoked_sessions(expires)")
+
+# tokens are stored as sha256(token) (game_database.hash_token) from here
+# on, existing rows are hashed in place. (username, created) serves the per
+# user session cap
+def _hash_tokens(conn):
+    rows = conn.execute("SELECT rowid, token FROM tokens WHERE typeof(token) = 'text'").fetchall()
+    conn.executemany("UPDATE tokens SET token = ? WHERE rowid = ?",
+                     [(hashlib.sha256(token.encode()).digest(), rowid) for rowid, token in rows])
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tokens_username_created ON tokens(username, created)")
+
+MIGRATIONS = [
+    (1, "player_data_server_id_index",
+     "CREATE INDEX IF NOT EXISTS idx_player_data_server ON player_data(server_id)",
+     [("UPDATE player_data SET server_id = NULL WHERE server_id = ?", ("srv",), "idx_player_data_server")]),
+    # LIKE is case insensitive by default, so it can only use a NOCASE index
+    (2, "accounts_username_nocase_index",
+     "CREATE INDEX IF NOT EXISTS idx_accounts_username_nocase ON accounts(username COLLATE NOCASE)",
+     [("SELECT user_id, username FROM accounts WHERE username LIKE ? ESCAPE '\\' LIMIT ?", ("bob%", 20), "idx_accounts_username_nocase")]),
+    (3, "accessories_type_price_index",
+     "CREATE INDEX IF NOT EXISTS idx_accessories_type_price ON accessories(type, price)",
+     [("SELECT accessory_id FROM accessories WHERE type = ? AND price <= ?", ("hat", 100), "idx_accessories_type_price"),
+      ("SELECT accessory_id FROM accessories WHERE type = ?", ("hat",), "idx_accessories_type_price")]),
+    (4, "revoked_sessions", _create_revoked_sessions,
+     [("SELECT token_id, user_id, revoked FROM revoked_sessions WHERE expires >= ?", (0,), "idx_revoked_sessions_expires")]),
+    (5, "hashed_tokens", _hash_tokens,
+     [("SELECT token FROM tokens WHERE username = ? ORDER BY created DESC LIMIT -1 OFFSET ?", ("bob", 4), "idx_tokens_username_created")]),
+]
+
+def get_schema_version(conn) -> int:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at REAL NOT NULL
+        )
+    """)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+def run_migrations(conn) -> int:
+    current = get_schema_version(conn)
+    conn.commit()
+
+    for version, name, migration, _ in MIGRATIONS:
+        if version <= current:
+            continue
+
+        start = time.time()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if callable(migration):
+                migration(conn)
+            else:
+                conn.execute(migration)
+            conn.execute("INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                         (version, name, time.time()))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Migration {version} ({name}) failed: {e}")
+            raise
+
+        current = version
+        print(f"Applied migration {version} ({name}) in {(time.time() - start) * 1000:.1f}ms")
+
+    return current
+
+def explain(conn, query, params=()) -> str:
+    rows = conn.execute("EXPLAIN QUERY PLAN " + query, params).fetchall()
+    return "\n".join(row[-1] for row in rows)
+
+def check_query_plans(conn):
+    # returns [(version, query, plan)] for every check whose index isnt used
+    failures = []
+    for version, name, _, checks in MIGRATIONS:
+        for query, params, index in checks:
+            plan = explain(conn, query, params)
+            if index not in plan:
+                failures.append((version, query, plan))
+    return failures
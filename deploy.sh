@@ -9,6 +9,16 @@ git reset --hard origin/main
 
 echo "Downloading dependencies..."
 pip install -r requirements.txt
+
+# already running: SIGHUP starts the new code next to the old one and the
+# old one drains and exits (handoff.py), nothing else to start
+PID_FILE=server_data/master.pid
+if [ -f "$PID_FILE" ] && kill -0 "$(cat "$PID_FILE")" 2>/dev/null; then
+    echo "Reloading running server (pid $(cat "$PID_FILE"))..."
+    kill -HUP "$(cat "$PID_FILE")"
+    exit 0
+fi
+
 sudo apt-get install -y xvfb
 
 echo "Starting Xvfb display server..."
@@ -21,4 +31,7 @@ source .env
 echo "Starting Python server..."
 python3 main.py
 
-kill $XVFB_PID 2>/dev/null
+# after a reload main.py exits but its replacement still needs the display
+if ! { [ -f "$PID_FILE" ] && kill -0 "$(cat "$PID_FILE")" 2>/dev/null; }; then
+    kill $XVFB_PID 2>/dev/null
+fi
@@ -1,5 +1,6 @@
 import time
 from typing import List, Dict, Any
+from database_manager import transaction
 from game_database import (
     save_friend,
     get_friends as fb_get_friends,
@@ -41,14 +42,16 @@ def getFriendRequests(userId: int) -> Dict[str, Any]:
     return {"success": True, "data": {"incoming": incoming, "outgoing": outgoing}}
 
 def acceptFriendRequest(userId: int, requesterId: int) -> Dict[str, Any]:
-    incoming = get_friend_requests_incoming(userId)
-    if requesterId not in incoming:
-        return {"success": False, "error": {"code": "REQUEST_NOT_FOUND", "message": "Friend request not found"}}
+    # check + delete + both friend rows land together or not at all
+    with transaction():
+        incoming = get_friend_requests_incoming(userId)
+        if requesterId not in incoming:
+            return {"success": False, "error": {"code": "REQUEST_NOT_FOUND", "message": "Friend request not found"}}
 
-    delete_friend_request(requesterId, userId)
+        delete_friend_request(requesterId, userId)
 
-    save_friend(userId, requesterId)
-    save_friend(requesterId, userId)
+        save_friend(userId, requesterId)
+        save_friend(requesterId, userId)
 
     return {"success": True, "data": {"userId": userId, "friendId": requesterId, "timestamp": time.time()}}
 
@@ -74,14 +77,16 @@ def addFriendDirect(userId: int, friendId: int) -> Dict[str, Any]:
     if userId == friendId:
         return {"success": False, "error": {"code": "SELF_FRIEND", "message": "Cannot add yourself as friend"}}
 
-    save_friend(userId, friendId)
-    save_friend(friendId, userId)
+    with transaction():
+        save_friend(userId, friendId)
+        save_friend(friendId, userId)
 
     return {"success": True, "data": {"userId": userId, "friendId": friendId}}
 
 def removeFriend(userId: int, friendId: int) -> Dict[str, Any]:
-    delete_friend(userId, friendId)
-    delete_friend(friendId, userId)
+    with transaction():
+        delete_friend(userId, friendId)
+        delete_friend(friendId, userId)
 
     return {"success": True, "data": {"userId": userId, "friendId": friendId}}
 
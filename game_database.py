@@ -1,12 +1,20 @@
 import os
 import time
+import copy
 import json
-from typing import Dict, Any, Optional, List
-from database_manager import execute_query, buffer_write, flush_write_buffer
+import hashlib
+import asyncio
+from typing import Dict, Any, Optional, List, NamedTuple
+from database_manager import (
+    execute_query, execute_write, execute_write_async, buffer_write, flush_write_buffer, run_in_db, transaction, transaction_async,
+    shard_for, shard_query, shard_write, shard_write_async, execute_all_shards
+)
 from config import (
     VOLUME_PATH,
     DB_DIR,
-    BACKUP_DIR
+    BACKUP_DIR,
+    MAX_SESSIONS_PER_USER,
+    TOKEN_DELETE_BATCH
 )
 
 def ensure_volume_directories():
@@ -14,96 +22,151 @@ def ensure_volume_directories():
     os.makedirs(BACKUP_DIR, exist_ok=True)
     os.makedirs(os.path.join(VOLUME_PATH, "pfps"), exist_ok=True)
 
-ensure_volume_directories()
+# rows come back as these instead of dicts: tuples with named fields, no
+# per-row dict and nothing to copy. only turn them into dicts (to_dict) when
+# building a response
+class Account(NamedTuple):
+    user_id: int
+    username: str
+    password: str
+    gender: str
+    created: float
+    username_changes: int
+
+class TokenRow(NamedTuple):
+    token: str
+    username: str
+    created: float
+
+class PlayerRow(NamedTuple):
+    user_id: int
+    username: str
+    currency: int
+    avatar_data: Any
+    owned_accessories: Any
+    pfp: Optional[str]
+    server_id: Optional[str]
+    schema_version: int
+    last_updated: float
+
+    # the parsed avatar / accessories are shared with the player cache, the
+    # dict gets its own copies so callers can edit and save it
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "userId": self.user_id,
+            "username": self.username,
+            "currency": self.currency,
+            "avatar": copy.deepcopy(self.avatar_data),
+            "ownedAccessories": copy.copy(self.owned_accessories),
+            "pfp": self.pfp,
+            "serverId": self.server_id,
+            "schemaVersion": self.schema_version,
+            "last_updated": self.last_updated
+        }
+
+class Accessory(NamedTuple):
+    accessory_id: int
+    name: str
+    type: str
+    price: int
+    model_file: str
+    texture_file: str
+    equip_slot: str
+    icon_file: str
+    mtl_file: str
+    created_at: float
+
+# sqlite row factories, the cursor hands each row tuple straight to the record
+def _row_factory(record_type):
+    make = record_type._make
+    return lambda cursor, row: make(row)
+
+account_row = _row_factory(Account)
+token_row = _row_factory(TokenRow)
+player_row = _row_factory(PlayerRow)
+accessory_row = _row_factory(Accessory)
 
 def save_account(username: str, password: str, gender: str) -> int:
     query = "INSERT INTO accounts (username, password, gender, created, username_changes) VALUES (?, ?, ?, ?, ?)"
     user_id = execute_query(query, (username, password, gender, time.time(), 0))
     return user_id
 
-def get_account_by_username(username: str) -> Optional[Dict[str, Any]]:
+def get_account_by_username(username: str) -> Optional[Account]:
     query = "SELECT user_id, username, password, gender, created, username_changes FROM accounts WHERE username = ?"
-    result = execute_query(query, (username,), fetch_one=True)
+    return execute_query(query, (username,), fetch_one=True, row_factory=account_row)
 
-    if result:
-        return {
-            "user_id": result[0],
-            "username": result[1],
-            "password": result[2],
-            "gender": result[3],
-            "created": result[4],
-            "username_changes": result[5]
-        }
-    return None
-
-def get_account_by_id(user_id: int) -> Optional[Dict[str, Any]]:
+def get_account_by_id(user_id: int) -> Optional[Account]:
     query = "SELECT user_id, username, password, gender, created, username_changes FROM accounts WHERE user_id = ?"
-    result = execute_query(query, (user_id,), fetch_one=True)
+    return execute_query(query, (user_id,), fetch_one=True, row_factory=account_row)
 
-    if result:
-        return {
-            "user_id": result[0],
-            "username": result[1],
-            "password": result[2],
-            "gender": result[3],
-            "created": result[4],
-            "username_changes": result[5]
-        }
-    return None
+UPDATE_USERNAME_QUERY = "UPDATE accounts SET username = ?, username_changes = username_changes + 1 WHERE user_id = ?"
+RENAME_TOKENS_QUERY = "UPDATE tokens SET username = ? WHERE username = ?"
 
 def update_username(user_id: int, new_username: str):
-    query = "UPDATE accounts SET username = ?, username_changes = username_changes + 1 WHERE user_id = ?"
-    execute_query(query, (new_username, user_id))
+    execute_query(UPDATE_USERNAME_QUERY, (new_username, user_id))
 
 def update_password(user_id: int, new_password: str):
     query = "UPDATE accounts SET password = ? WHERE user_id = ?"
     execute_query(query, (new_password, user_id))
 
-def save_token(token: str, username: str):
-    query = "INSERT OR REPLACE INTO tokens (token, username, created) VALUES (?, ?, ?)"
-    execute_query(query, (token, username, time.time()))
-
-def get_token(token: str) -> Optional[Dict[str, Any]]:
+# the tokens table only ever sees sha256(token), 32 bytes whatever the token
+# looks like, and a leaked db has no usable sessions in it
+def hash_token(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+SAVE_TOKEN_QUERY = "INSERT OR REPLACE INTO tokens (token, username, created) VALUES (?, ?, ?)"
+# everything past the newest MAX_SESSIONS_PER_USER - 1, room for the new one
+OLDEST_TOKENS_QUERY = "SELECT token FROM tokens WHERE username = ? ORDER BY created DESC LIMIT -1 OFFSET ?"
+
+# returns the hashes of the sessions it evicted to stay under
+# MAX_SESSIONS_PER_USER so callers can drop them from their caches
+def save_token(token: str, username: str) -> List[bytes]:
+    with transaction() as conn:
+        evicted = [row[0] for row in conn.execute(OLDEST_TOKENS_QUERY, (username, MAX_SESSIONS_PER_USER - 1))]
+        if evicted:
+            conn.executemany("DELETE FROM tokens WHERE token = ?", [(token_hash,) for token_hash in evicted])
+        conn.execute(SAVE_TOKEN_QUERY, (hash_token(token), username, time.time()))
+    return evicted
+
+def get_token(token: str) -> Optional[TokenRow]:
     query = "SELECT token, username, created FROM tokens WHERE token = ?"
-    result = execute_query(query, (token,), fetch_one=True)
-
-    if result:
-        return {
-            "token": result[0],
-            "username": result[1],
-            "created": result[2]
-        }
-    return None
-
-def delete_old_tokens(cutoff_timestamp: float):
-    query = "DELETE FROM tokens WHERE created < ?"
-    execute_query(query, (cutoff_timestamp,))
-
-def get_player_data(user_id: int) -> Optional[Dict[str, Any]]:
+    return execute_query(query, (hash_token(token),), fetch_one=True, row_factory=token_row)
+
+# expired tokens go TOKEN_DELETE_BATCH rows at a time, each batch its own
+# short transaction so logins never queue behind one huge DELETE
+DELETE_OLD_TOKENS_QUERY = "DELETE FROM tokens WHERE rowid IN (SELECT rowid FROM tokens WHERE created < ? LIMIT ?)"
+
+def _delete_old_token_batch(cutoff_timestamp: float, batch_size: int) -> int:
+    with transaction() as conn:
+        return conn.execute(DELETE_OLD_TOKENS_QUERY, (cutoff_timestamp, batch_size)).rowcount
+
+def delete_old_tokens(cutoff_timestamp: float, batch_size: int = TOKEN_DELETE_BATCH) -> int:
+    deleted = 0
+    while True:
+        count = _delete_old_token_batch(cutoff_timestamp, batch_size)
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+# avatar_data / owned_accessories are the raw json strings (or None)
+def get_player_data(user_id: int) -> Optional[PlayerRow]:
     query = """SELECT user_id, username, currency, avatar_data, owned_accessories,
                pfp, server_id, schema_version, last_updated
                FROM player_data WHERE user_id = ?"""
-    result = execute_query(query, (user_id,), fetch_one=True)
+    return shard_query(shard_for(user_id), query, (user_id,), fetch_one=True, row_factory=player_row)
 
-    if result:
-        return {
-            "userId": result[0],
-            "username": result[1],
-            "currency": result[2],
-            "avatar": result[3] if result[3] else "{}",
-            "ownedAccessories": result[4] if result[4] else "[]",
-            "pfp": result[5],
-            "serverId": result[6],
-            "schemaVersion": result[7],
-            "last_updated": result[8]
-        }
-    return None
-
-def save_player_data(user_id: int, data: Dict[str, Any]):
-    query = """INSERT OR REPLACE INTO player_data
+# currency and owned_accessories are only written when the row is created,
+# after that they change through adjust_currency / buy_accessory. a save of
+# a dict read a while ago would otherwise undo credits and purchases
+# committed since
+SAVE_PLAYER_DATA_QUERY = """INSERT INTO player_data
                (user_id, username, currency, avatar_data, owned_accessories, pfp, server_id, schema_version, last_updated)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(user_id) DO UPDATE SET username = excluded.username, avatar_data = excluded.avatar_data,
+               pfp = excluded.pfp, server_id = excluded.server_id, schema_version = excluded.schema_version,
+               last_updated = excluded.last_updated"""
 
+def _player_data_params(user_id: int, data: Dict[str, Any]) -> tuple:
     avatar_str = data.get("avatar", "{}")
     if isinstance(avatar_str, dict):
         avatar_str = json.dumps(avatar_str)
@@ -112,7 +175,7 @@ def save_player_data(user_id: int, data: Dict[str, Any]):
     if isinstance(accessories_str, list):
         accessories_str = json.dumps(accessories_str)
 
-    execute_query(query, (
+    return (
         user_id,
         data.get("username", ""),
         data.get("currency", 100),
@@ -122,7 +185,82 @@ def save_player_data(user_id: int, data: Dict[str, Any]):
         data.get("serverId"),
         data.get("schemaVersion", 1),
         time.time()
-    ))
+    )
+
+def save_player_data(user_id: int, data: Dict[str, Any]):
+    shard_write(shard_for(user_id), SAVE_PLAYER_DATA_QUERY, _player_data_params(user_id, data))
+
+# balance changes are done in sql, so concurrent credits, debits and
+# purchases can't overwrite each other with a stale read. the WHERE is the
+# funds (and ownership) check, no row back means it failed or no such user
+ADJUST_CURRENCY_QUERY = """UPDATE player_data SET currency = currency + ?, last_updated = ?
+               WHERE user_id = ? AND currency + ? >= 0 RETURNING currency"""
+UNDO_ADJUST_CURRENCY_QUERY = "UPDATE player_data SET currency = currency - ? WHERE user_id = ?"
+BUY_ACCESSORY_QUERY = """UPDATE player_data SET currency = currency - ?, last_updated = ?,
+               owned_accessories = json_insert(COALESCE(owned_accessories, '[]'), '$[#]', ?)
+               WHERE user_id = ? AND currency >= ?
+               AND NOT EXISTS (SELECT 1 FROM json_each(COALESCE(owned_accessories, '[]')) WHERE value = ?)
+               RETURNING currency"""
+UNDO_BUY_ACCESSORY_QUERY = """UPDATE player_data SET currency = currency + ?,
+               owned_accessories = (SELECT json_group_array(value) FROM json_each(owned_accessories) WHERE value != ?)
+               WHERE user_id = ?"""
+
+def _update_player_row(user_id: int, query: str, params: tuple, undo: tuple,
+                       extra_statements: Optional[List[tuple]] = None) -> Optional[int]:
+    shard = shard_for(user_id)
+    if shard is None:
+        with transaction():
+            rows = execute_query(query, params, fetch_all=True)
+            if rows:
+                for extra_query, extra_params in extra_statements or ():
+                    execute_query(extra_query, extra_params)
+        return rows[0][0] if rows else None
+
+    # player row lives in another file. the update is the guard here so it
+    # goes first, and is undone if the extras (purchase token...) fail
+    rows = shard.query(query, params, fetch_all=True)
+    if rows and extra_statements:
+        try:
+            with transaction():
+                for extra_query, extra_params in extra_statements:
+                    execute_query(extra_query, extra_params)
+        except Exception:
+            shard_write(shard, *undo)
+            raise
+    return rows[0][0] if rows else None
+
+# new balance, or None if the user doesn't exist or would go below zero
+def adjust_currency(user_id: int, amount: int, extra_statements: Optional[List[tuple]] = None) -> Optional[int]:
+    return _update_player_row(user_id, ADJUST_CURRENCY_QUERY, (amount, time.time(), user_id, amount),
+                              (UNDO_ADJUST_CURRENCY_QUERY, (amount, user_id)), extra_statements)
+
+# new balance, or None if already owned, not enough currency or no such user
+def buy_accessory(user_id: int, accessory_id: int, price: int,
+                  extra_statements: Optional[List[tuple]] = None) -> Optional[int]:
+    return _update_player_row(user_id, BUY_ACCESSORY_QUERY,
+                              (price, time.time(), accessory_id, user_id, price, accessory_id),
+                              (UNDO_BUY_ACCESSORY_QUERY, (price, accessory_id, user_id)), extra_statements)
+
+RENAME_PLAYER_QUERY = """UPDATE player_data SET currency = currency - ?, username = ?, last_updated = ?
+               WHERE user_id = ? AND currency >= ? RETURNING currency"""
+UNDO_RENAME_PLAYER_QUERY = "UPDATE player_data SET currency = currency + ?, username = ? WHERE user_id = ?"
+
+# fee, player row, account and tokens together. new balance, or None if the
+# fee can't be paid or no such user. IntegrityError if the name got taken
+def rename_player(user_id: int, old_username: str, new_username: str, cost: int) -> Optional[int]:
+    return _update_player_row(user_id, RENAME_PLAYER_QUERY, (cost, new_username, time.time(), user_id, cost),
+                              (UNDO_RENAME_PLAYER_QUERY, (cost, old_username, user_id)), [
+                                  (UPDATE_USERNAME_QUERY, (new_username, user_id)),
+                                  (RENAME_TOKENS_QUERY, (new_username, old_username))
+                              ])
+
+SET_PLAYER_SERVER_QUERY = "UPDATE player_data SET server_id = ?, last_updated = ? WHERE user_id = ?"
+
+def set_player_server(user_id: int, server_id: Optional[str]):
+    shard_write(shard_for(user_id), SET_PLAYER_SERVER_QUERY, (server_id, time.time(), user_id))
+
+def clear_server_players(server_id: str):
+    execute_all_shards("UPDATE player_data SET server_id = NULL WHERE server_id = ?", (server_id,))
 
 def save_friend(user_id: int, friend_id: int):
     query = "INSERT OR IGNORE INTO friends (user_id, friend_id, created) VALUES (?, ?, ?)"
@@ -155,26 +293,11 @@ def delete_friend_request(from_user_id: int, to_user_id: int):
     query = "DELETE FROM friend_requests WHERE from_user_id = ? AND to_user_id = ?"
     execute_query(query, (from_user_id, to_user_id))
 
-def get_accessory(accessory_id: int) -> Optional[Dict[str, Any]]:
+def get_accessory(accessory_id: int) -> Optional[Accessory]:
     query = """SELECT accessory_id, name, type, price, model_file, texture_file,
                equip_slot, icon_file, mtl_file, created_at
                FROM accessories WHERE accessory_id = ?"""
-    result = execute_query(query, (accessory_id,), fetch_one=True)
-
-    if result:
-        return {
-            "accessory_id": result[0],
-            "name": result[1],
-            "type": result[2],
-            "price": result[3],
-            "model_file": result[4],
-            "texture_file": result[5],
-            "equip_slot": result[6],
-            "icon_file": result[7],
-            "mtl_file": result[8],
-            "created_at": result[9]
-        }
-    return None
+    return execute_query(query, (accessory_id,), fetch_one=True, row_factory=accessory_row)
 
 def save_accessory(accessory_id: int, name: str, accessory_type: str, price: int,
                   model_file: str, texture_file: str, mtl_file: str, equip_slot: str, icon_file: str):
@@ -184,7 +307,7 @@ def save_accessory(accessory_id: int, name: str, accessory_type: str, price: int
     execute_query(query, (accessory_id, name, accessory_type, price, model_file,
                          texture_file, equip_slot, icon_file, mtl_file, time.time()))
 
-def list_accessories(filters: Optional[List] = None) -> List[Dict[str, Any]]:
+def list_accessories(filters: Optional[List] = None) -> List[Accessory]:
     query = """SELECT accessory_id, name, type, price, model_file, texture_file,
                equip_slot, icon_file, mtl_file, created_at
                FROM accessories"""
@@ -205,24 +328,7 @@ def list_accessories(filters: Optional[List] = None) -> List[Dict[str, Any]]:
     if where_clauses:
         query += " WHERE " + " AND ".join(where_clauses)
 
-    results = execute_query(query, tuple(params), fetch_all=True)
-
-    accessories = []
-    for row in results:
-        accessories.append({
-            "accessory_id": row[0],
-            "name": row[1],
-            "type": row[2],
-            "price": row[3],
-            "model_file": row[4],
-            "texture_file": row[5],
-            "equip_slot": row[6],
-            "icon_file": row[7],
-            "mtl_file": row[8],
-            "created_at": row[9]
-        })
-
-    return accessories
+    return execute_query(query, tuple(params), fetch_all=True, row_factory=accessory_row)
 
 def delete_accessory(accessory_id: int):
     query = "DELETE FROM accessories WHERE accessory_id = ?"
@@ -234,18 +340,20 @@ def get_next_accessory_id() -> int:
     max_id = result[0] if result and result[0] else 0
     return max_id + 1
 
-def save_accessory_purchase(user_id: int, accessory_id: int, price_paid: int):
-    query = """INSERT INTO accessory_purchases (user_id, accessory_id, price_paid, created)
+SAVE_ACCESSORY_PURCHASE_QUERY = """INSERT INTO accessory_purchases (user_id, accessory_id, price_paid, created)
                VALUES (?, ?, ?, ?)"""
-    execute_query(query, (user_id, accessory_id, price_paid, time.time()))
+
+def save_accessory_purchase(user_id: int, accessory_id: int, price_paid: int):
+    execute_write(SAVE_ACCESSORY_PURCHASE_QUERY, (user_id, accessory_id, price_paid, time.time()))
+
+SAVE_DATASTORE_QUERY = "INSERT OR REPLACE INTO datastores (key, value, timestamp) VALUES (?, ?, ?)"
 
 def save_datastore(key: str, value: str):
-    query = "INSERT OR REPLACE INTO datastores (key, value, timestamp) VALUES (?, ?, ?)"
-    execute_query(query, (key, value, time.time()))
+    shard_write(shard_for(key), SAVE_DATASTORE_QUERY, (key, value, time.time()))
 
 def get_datastore(key: str) -> Optional[Dict[str, Any]]:
     query = "SELECT key, value, timestamp FROM datastores WHERE key = ?"
-    result = execute_query(query, (key,), fetch_one=True)
+    result = shard_query(shard_for(key), query, (key,), fetch_one=True)
 
     if result:
         return {
@@ -257,32 +365,34 @@ def get_datastore(key: str) -> Optional[Dict[str, Any]]:
 
 def delete_datastore(key: str):
     query = "DELETE FROM datastores WHERE key = ?"
-    execute_query(query, (key,))
+    shard_query(shard_for(key), query, (key,))
 
 def list_datastore_keys(prefix: str = "") -> List[Dict[str, Any]]:
     query = "SELECT key, timestamp FROM datastores WHERE key LIKE ?"
-    results = execute_query(query, (f"{prefix}%",), fetch_all=True)
+    results = execute_all_shards(query, (f"{prefix}%",), fetch_all=True)
 
     return [{"key": row[0], "timestamp": row[1]} for row in results] if results else []
 
 def delete_old_datastores(cutoff_timestamp: float):
     query = "DELETE FROM datastores WHERE timestamp < ?"
-    execute_query(query, (cutoff_timestamp,))
+    execute_all_shards(query, (cutoff_timestamp,))
 
-def save_payment_record(user_id: int, purchase_token: str, product_id: str,
-                       amount: int, currency_awarded: int, verified: bool):
-    query = """INSERT INTO payments
+SAVE_PAYMENT_QUERY = """INSERT INTO payments
                (user_id, purchase_token, product_id, amount, currency_awarded, verified, created)
                VALUES (?, ?, ?, ?, ?, ?, ?)"""
-    execute_query(query, (user_id, purchase_token, product_id, amount,
+
+def save_payment_record(user_id: int, purchase_token: str, product_id: str,
+                       amount: int, currency_awarded: int, verified: bool):
+    execute_write(SAVE_PAYMENT_QUERY, (user_id, purchase_token, product_id, amount,
                          currency_awarded, verified, time.time()))
 
-def save_ad_reward_record(user_id: int, ad_network: str, ad_unit_id: str,
-                         reward_amount: int, verified: bool):
-    query = """INSERT INTO ad_rewards
+SAVE_AD_REWARD_QUERY = """INSERT INTO ad_rewards
                (user_id, ad_network, ad_unit_id, reward_amount, verified, created)
                VALUES (?, ?, ?, ?, ?, ?)"""
-    execute_query(query, (user_id, ad_network, ad_unit_id, reward_amount,
+
+def save_ad_reward_record(user_id: int, ad_network: str, ad_unit_id: str,
+                         reward_amount: int, verified: bool):
+    execute_write(SAVE_AD_REWARD_QUERY, (user_id, ad_network, ad_unit_id, reward_amount,
                          verified, time.time()))
 
 def get_weather_types() -> List[str]:
@@ -310,3 +420,102 @@ def count_accounts() -> int:
     query = "SELECT COUNT(*) FROM accounts"
     result = execute_query(query, fetch_one=True)
     return result[0] if result else 0
+
+# awaitable versions of everything above, for the aiohttp handlers
+# same args and return values, reads run on the db executor and writes
+# go straight to the group commit writer and resolve once committed
+def _async_version(func):
+    async def wrapper(*args, **kwargs):
+        return await run_in_db(func, *args, **kwargs)
+    wrapper.__name__ = f"{func.__name__}_async"
+    wrapper.__qualname__ = wrapper.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+save_account_async = _async_version(save_account)
+get_account_by_username_async = _async_version(get_account_by_username)
+get_account_by_id_async = _async_version(get_account_by_id)
+update_username_async = _async_version(update_username)
+update_password_async = _async_version(update_password)
+count_accounts_async = _async_version(count_accounts)
+
+save_token_async = _async_version(save_token)
+get_token_async = _async_version(get_token)
+
+# yields to the loop between batches so other db work gets the executor too
+async def delete_old_tokens_async(cutoff_timestamp: float, batch_size: int = TOKEN_DELETE_BATCH) -> int:
+    deleted = 0
+    while True:
+        count = await run_in_db(_delete_old_token_batch, cutoff_timestamp, batch_size)
+        deleted += count
+        if count < batch_size:
+            return deleted
+        await asyncio.sleep(0)
+
+get_player_data_async = _async_version(get_player_data)
+clear_server_players_async = _async_version(clear_server_players)
+
+async def save_player_data_async(user_id: int, data: Dict[str, Any], extra_statements: Optional[List[tuple]] = None):
+    shard = shard_for(user_id)
+    if not extra_statements:
+        await shard_write_async(shard, SAVE_PLAYER_DATA_QUERY, _player_data_params(user_id, data))
+        return
+
+    if shard is not None:
+        # player row lives in another file, so no shared commit. the extras go first:
+        # they are the guards (UNIQUE purchase token, username), if they fail
+        # the player row is never touched
+        async with transaction_async() as tx:
+            for query, params in extra_statements:
+                tx.execute(query, params)
+        await shard_write_async(shard, SAVE_PLAYER_DATA_QUERY, _player_data_params(user_id, data))
+        return
+
+    # player row + whatever goes with it (purchase record, account rename...) in one commit
+    async with transaction_async() as tx:
+        tx.execute(SAVE_PLAYER_DATA_QUERY, _player_data_params(user_id, data))
+        for query, params in extra_statements:
+            tx.execute(query, params)
+
+adjust_currency_async = _async_version(adjust_currency)
+buy_accessory_async = _async_version(buy_accessory)
+rename_player_async = _async_version(rename_player)
+
+save_friend_async = _async_version(save_friend)
+get_friends_async = _async_version(get_friends)
+delete_friend_async = _async_version(delete_friend)
+save_friend_request_async = _async_version(save_friend_request)
+get_friend_requests_incoming_async = _async_version(get_friend_requests_incoming)
+get_friend_requests_outgoing_async = _async_version(get_friend_requests_outgoing)
+delete_friend_request_async = _async_version(delete_friend_request)
+
+get_accessory_async = _async_version(get_accessory)
+list_accessories_async = _async_version(list_accessories)
+
+async def save_accessory_purchase_async(user_id: int, accessory_id: int, price_paid: int):
+    await execute_write_async(SAVE_ACCESSORY_PURCHASE_QUERY, (user_id, accessory_id, price_paid, time.time()))
+
+async def set_player_server_async(user_id: int, server_id: Optional[str]):
+    await shard_write_async(shard_for(user_id), SET_PLAYER_SERVER_QUERY, (server_id, time.time(), user_id))
+
+async def save_datastore_async(key: str, value: str):
+    await shard_write_async(shard_for(key), SAVE_DATASTORE_QUERY, (key, value, time.time()))
+
+get_datastore_async = _async_version(get_datastore)
+delete_datastore_async = _async_version(delete_datastore)
+list_datastore_keys_async = _async_version(list_datastore_keys)
+delete_old_datastores_async = _async_version(delete_old_datastores)
+
+async def save_payment_record_async(user_id: int, purchase_token: str, product_id: str,
+                                    amount: int, currency_awarded: int, verified: bool):
+    await execute_write_async(SAVE_PAYMENT_QUERY, (user_id, purchase_token, product_id, amount,
+                                                   currency_awarded, verified, time.time()))
+
+async def save_ad_reward_record_async(user_id: int, ad_network: str, ad_unit_id: str,
+                                      reward_amount: int, verified: bool):
+    await execute_write_async(SAVE_AD_REWARD_QUERY, (user_id, ad_network, ad_unit_id, reward_amount,
+                                                     verified, time.time()))
+
+get_weather_types_async = _async_version(get_weather_types)
+add_weather_type_async = _async_version(add_weather_type)
+remove_weather_type_async = _async_version(remove_weather_type)
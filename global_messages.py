@@ -3,8 +3,9 @@ import time
 import asyncio
 from typing import Dict, Any, List
 from collections import defaultdict
-from config import SERVER_PUBLIC_IP, BASE_PORT
+from config import BASE_PORT
 import requests
+import shared_state
 
 global_messages_queue = []
 maintenance_mode = False
@@ -49,7 +50,7 @@ async def broadcast_message(message: Dict[str, Any]):
         unsubscribe_from_messages(subscriber_id)
 
 def add_global_message(message_type: str, properties: Dict[str, Any]) -> Dict[str, Any]:
-    global last_message_id, global_messages_queue
+    global last_message_id
 
     last_message_id += 1
     message = {
@@ -59,15 +60,23 @@ def add_global_message(message_type: str, properties: Dict[str, Any]) -> Dict[st
         "timestamp": time.time()
     }
 
+    _store_message(message)
+    shared_state.publish("global_messages", message, retain=100)
+
+    return {"success": True, "data": {"message_id": last_message_id, "message": message}}
+
+# every worker keeps the queue and pushes to its own websockets
+def _store_message(message: Dict[str, Any]):
+    global last_message_id
+
+    last_message_id = max(last_message_id, message["id"])
     global_messages_queue.append(message)
 
     if len(global_messages_queue) > 100:
-        global_messages_queue = global_messages_queue[-100:]
+        del global_messages_queue[:-100]
 
     asyncio.create_task(broadcast_message(message))
 
-    return {"success": True, "data": {"message_id": last_message_id, "message": message}}
-
 def get_global_messages(since_id: int = 0) -> List[Dict[str, Any]]:
     return [msg for msg in global_messages_queue if msg["id"] > since_id]
 
@@ -75,9 +84,8 @@ def get_latest_message_id() -> int:
     return last_message_id
 
 def clear_old_messages(max_age_seconds: int = 300):
-    global global_messages_queue
     current_time = time.time()
-    global_messages_queue = [
+    global_messages_queue[:] = [
         msg for msg in global_messages_queue
         if current_time - msg["timestamp"] < max_age_seconds
     ]
@@ -85,6 +93,7 @@ def clear_old_messages(max_age_seconds: int = 300):
 def set_maintenance_mode(enabled: bool, message: str = "") -> Dict[str, Any]:
     global maintenance_mode
     maintenance_mode = enabled
+    shared_state.publish("maintenance", enabled, retain=1)
 
     if enabled:
         add_global_message("Maintenance", {
@@ -105,9 +114,9 @@ async def force_shutdown_all_servers():
 
     from vm_lifecycle_manager import vm_registry, vm_registry_lock, shutdown_vm_gracefully
     from vm_game_server_manager import stop_game_server, game_server_processes
-    from config import SERVER_PUBLIC_IP
+    from config import get_server_public_ip
 
-    master_vm_id = f"main-{SERVER_PUBLIC_IP}"
+    master_vm_id = f"main-{get_server_public_ip()}"
     for server_uid in list(game_server_processes.keys()):
         try:
             print(f"Force stopping server: {server_uid}")
@@ -131,6 +140,13 @@ async def force_shutdown_all_servers():
             except Exception as e:
                 print(f"Error shutting down VM {vm_id[:8]}: {e}")
 
+def _receive_maintenance(enabled: bool):
+    global maintenance_mode
+    maintenance_mode = enabled
+
+shared_state.subscribe("global_messages", _store_message)
+shared_state.subscribe("maintenance", _receive_maintenance)
+
 def is_maintenance_mode() -> bool:
     return maintenance_mode
 
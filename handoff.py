@@ -0,0 +1,213 @@
+import os
+import sys
+import time
+import signal
+import socket
+import asyncio
+import subprocess
+from typing import List, Optional
+
+import shared_state
+from json_codec import dumps_bytes, loads
+from database_manager import DATA_DIR, flush_write_buffer
+from player_save_tracker import save_tracker
+from vm_lifecycle_manager import export_vm_registry, merge_vm_registry
+from vm_game_server_manager import export_game_servers, adopt_game_servers
+from config import RELOAD_DRAIN_TIMEOUT, RELOAD_READY_TIMEOUT
+
+# graceful restarts. SIGHUP to the running master (deploy.sh does this when
+# a server is already up) starts a new main.py that inherits the listening
+# socket, so connections keep being accepted the whole time:
+#   1. the new process starts up and sends "ready" over a socketpair
+#   2. the old one stops accepting, closes idle keep-alives and websockets
+#      (1012, clients reconnect to the new one), waits up to
+#      RELOAD_DRAIN_TIMEOUT for in-flight requests and save_tracker saves,
+#      flushes the group commit writers
+#   3. it writes vm_registry and its game server pids to STATE_FILE and
+#      exits, which closes its end of the socketpair
+#   4. on that EOF the new process merges the registry and adopts the game
+#      servers
+# if the new process dies or doesn't get ready in RELOAD_READY_TIMEOUT the
+# old one kills it and keeps serving.
+#
+# SIGTERM / SIGINT drain the same way without a successor. with
+# MASTER_WORKERS > 1 the supervisor does the reload instead, worker by
+# worker (workers.py), each one drains like this on its SIGTERM
+LISTEN_FD_ENV = "HANDOFF_LISTEN_FD"
+CONTROL_FD_ENV = "HANDOFF_CONTROL_FD"
+PID_FILE = os.path.join(DATA_DIR, "master.pid")
+STATE_FILE = os.path.join(DATA_DIR, "master_state.json")
+READY = b"ready"
+# after the listener closes, keep-alive connections get this long to send
+# one more request and be told Connection: close, so clients don't reuse a
+# connection the moment it is closed under them
+KEEPALIVE_GRACE = 1.0
+
+reload_state = {"running": False, "control": None, "draining": False}
+
+# responses finished while draining go out with Connection: close
+async def drain_middleware(app, handler):
+    async def middleware_handler(request):
+        response = await handler(request)
+        if reload_state["draining"] and not response.prepared:
+            response.force_close()
+        return response
+    return middleware_handler
+
+def inheritedSocket(env_name: str) -> Optional[socket.socket]:
+    fd = os.environ.pop(env_name, None)
+    if fd is None:
+        return None
+    sock = socket.socket(fileno=int(fd))
+    sock.setblocking(False)
+    return sock
+
+# the socket the previous process listened on, or a new one
+def listeningSocket(host: str, port: int, reuse_port: bool = False) -> socket.socket:
+    sock = inheritedSocket(LISTEN_FD_ENV)
+    if sock is not None:
+        return sock
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.setblocking(False)
+    return sock
+
+# (ours, the successor's) ends, pass the second one in CONTROL_FD_ENV
+def controlPair():
+    ours, theirs = socket.socketpair()
+    ours.setblocking(False)
+    return ours, theirs
+
+async def waitReady(control: socket.socket) -> bool:
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(loop.sock_recv(control, len(READY)), RELOAD_READY_TIMEOUT) == READY
+    except (asyncio.TimeoutError, OSError):
+        return False
+
+def writePidFile():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with open(PID_FILE, "w") as f:
+        f.write(str(os.getpid()))
+
+def removePidFile():
+    try:
+        with open(PID_FILE) as f:
+            if f.read().strip() == str(os.getpid()):
+                os.unlink(PID_FILE)
+    except OSError:
+        pass
+
+def saveState():
+    state = {"saved": time.time(), "vm_registry": export_vm_registry(), "game_servers": export_game_servers()}
+    temp_file = STATE_FILE + ".tmp"
+    with open(temp_file, "wb") as f:
+        f.write(dumps_bytes(state))
+    os.replace(temp_file, STATE_FILE)
+    print(f"Saved {len(state['vm_registry'])} VMs and {len(state['game_servers'])} game servers for the next process")
+
+# game servers are only adopted straight after a handoff, on a cold start
+# their pids could belong to anything by now
+async def loadState(adopt: bool):
+    if not shared_state.is_primary() or not os.path.exists(STATE_FILE):
+        return
+    try:
+        with open(STATE_FILE, "rb") as f:
+            state = loads(f.read())
+        os.unlink(STATE_FILE)
+    except (OSError, ValueError) as e:
+        print(f"Could not read {STATE_FILE}: {e}")
+        return
+    await merge_vm_registry(state.get("vm_registry", {}))
+    if adopt:
+        adopt_game_servers(state.get("game_servers", {}))
+    print(f"Restored {len(state.get('vm_registry', {}))} VMs from the previous process")
+
+# the predecessor closes its end once STATE_FILE is written (or it died)
+async def restoreAfterHandoff(control: socket.socket):
+    loop = asyncio.get_running_loop()
+    try:
+        while await loop.sock_recv(control, 64):
+            pass
+    except OSError:
+        pass
+    control.close()
+    await loadState(adopt=True)
+
+async def startSuccessor(main_path: str, listen_sock: socket.socket, stopping: asyncio.Event):
+    if reload_state["running"] or stopping.is_set():
+        return
+    reload_state["running"] = True
+    try:
+        ours, theirs = controlPair()
+        env = dict(os.environ, **{CONTROL_FD_ENV: str(theirs.fileno()), LISTEN_FD_ENV: str(listen_sock.fileno())})
+        # not an asyncio subprocess, its transport would kill the new
+        # process when this one exits
+        process = subprocess.Popen([sys.executable, main_path, *sys.argv[1:]], env=env,
+                                   pass_fds=(theirs.fileno(), listen_sock.fileno()))
+        theirs.close()
+        print(f"Reload: started pid {process.pid}, waiting for it to listen")
+        if not await waitReady(ours):
+            print(f"Reload: pid {process.pid} didn't get ready, keeping this process")
+            process.kill()
+            ours.close()
+            return
+        reload_state["control"] = ours
+        stopping.set()
+    finally:
+        reload_state["running"] = False
+
+async def drain(runner, background_tasks: List[asyncio.Task]):
+    loop = asyncio.get_running_loop()
+    start = time.monotonic()
+    deadline = start + RELOAD_DRAIN_TIMEOUT
+    for task in background_tasks:
+        task.cancel()
+    # a monitor mid db write finishes it before the writers are flushed
+    try:
+        await asyncio.wait_for(asyncio.gather(*background_tasks, return_exceptions=True), deadline - time.monotonic())
+    except asyncio.TimeoutError:
+        print("Draining: background tasks didn't stop, continuing")
+    print("Draining: not accepting, waiting for in-flight requests")
+    reload_state["draining"] = True
+    for site in list(runner.sites):
+        await site.stop()
+    await asyncio.sleep(KEEPALIVE_GRACE)
+    # closes idle connections, runs on_shutdown and gives handlers the
+    # runner's shutdown_timeout to finish
+    await runner.cleanup()
+    await save_tracker.wait_for_all_saves(timeout=max(deadline - time.monotonic(), 1.0))
+    await loop.run_in_executor(None, flush_write_buffer, max(deadline - time.monotonic(), 1.0))
+    if shared_state.is_primary():
+        saveState()
+    print(f"Drained in {time.monotonic() - start:.1f}s")
+
+# runs until SIGTERM/SIGINT or a finished reload, then drains. the caller
+# exits the process after this returns
+async def serve(runner, main_path: str, listen_sock: socket.socket, background_tasks: List[asyncio.Task]):
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    control = inheritedSocket(CONTROL_FD_ENV)
+    if not shared_state.enabled:
+        writePidFile()
+    if control is not None:
+        await loop.sock_sendall(control, READY)
+        loop.create_task(restoreAfterHandoff(control))
+    else:
+        await loadState(adopt=False)
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+    # workers are reloaded by the supervisor
+    if not shared_state.enabled:
+        loop.add_signal_handler(signal.SIGHUP, lambda: loop.create_task(startSuccessor(main_path, listen_sock, stopping)))
+
+    await stopping.wait()
+    await drain(runner, background_tasks)
+    if reload_state["control"] is not None:
+        reload_state["control"].close()
+    else:
+        removePidFile()
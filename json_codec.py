@@ -0,0 +1,51 @@
+import os
+import json
+from aiohttp import web
+
+# one place for json in and out of the http/ws layer. orjson when it's
+# installed (several times faster on the big market/dashboard/profile
+# payloads), stdlib json otherwise or with JSON_BACKEND=json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKEND = os.environ.get("JSON_BACKEND", "orjson" if orjson else "json")
+if JSON_BACKEND == "orjson" and orjson is None:
+    raise ValueError("JSON_BACKEND=orjson but orjson is not installed")
+
+def _stdlib_dumps_bytes(obj) -> bytes:
+    return json.dumps(obj).encode()
+
+if JSON_BACKEND == "orjson":
+    # stdlib turns tuples (our NamedTuple records too) into lists, orjson
+    # only does plain tuples
+    def _default(obj):
+        if isinstance(obj, tuple):
+            return list(obj)
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj) -> bytes:
+        try:
+            return orjson.dumps(obj, default=_default, option=_OPTIONS)
+        except orjson.JSONEncodeError:
+            # ints past 64 bits and the like, stdlib still copes
+            return _stdlib_dumps_bytes(obj)
+
+    def loads(data):
+        return orjson.loads(data)
+else:
+    dumps_bytes = _stdlib_dumps_bytes
+
+    def loads(data):
+        return json.loads(data)
+
+def dumps(obj) -> str:
+    return dumps_bytes(obj).decode()
+
+# drop-in for web.json_response
+def json_response(data, *, status=200, reason=None, headers=None):
+    return web.Response(body=dumps_bytes(data), status=status, reason=reason,
+                        headers=headers, content_type="application/json")
@@ -1,10 +1,9 @@
-import signal
+import sys
 import asyncio
 import time
 import uuid
 import os
 import json
-import hashlib
 import secrets
 import threading
 from collections import defaultdict, deque
@@ -12,38 +11,55 @@ from datetime import datetime, timedelta
 from aiohttp import web
 import aiohttp
 from typing import Dict, Any, Optional, List
-from database_manager import execute_query
+from database_manager import execute_query_async, run_in_db, get_read_pool_stats, group_writer, get_shard_stats
+import query_stats
+from db_backup import backup_database, verify_backup, get_backup_stats, backup_loop
 import auth_utils
+from request_pipeline import endpoint, readBody, requestSession, rate_limit_middleware, addBatchRoute
+from json_codec import json_response, dumps, loads
+from static_pages import pageResponse, get_static_page_stats
+from response_compression import compression_middleware, get_compression_stats
+from metrics import metrics_middleware, metricsView, loop_lag_monitor, get_request_metrics_summary
+import shared_state
+from workers import runSupervisor, primary_forward_middleware, startPrimarySocket, COORDINATOR_SOCKET
 from api_extensions import addNewRoutes
+from startup import runStartup, get_startup_stats
+import handoff
 from moderation.ModServer import moderationRun
-from player_data import createPlayerData, getPlayerFullProfile
+from player_data import createPlayerData, getPlayerFullProfile, getPlayerDataAsync
 from config import (
-    SERVER_PUBLIC_IP,
+    get_server_public_ip,
     BASE_PORT,
     GODOT_SERVER_BIN,
     DATASTORE_PASSWORD,
-    DASHBOARD_PASSWORD,
+    get_dashboard_password,
     GOOGLE_PLAY_PACKAGE_NAME,
     GOOGLE_SERVICE_ACCOUNT_JSON,
     VOLUME_PATH,
     CURRENT_SERVER_VERSION,
     BINARIES_DIR,
     VERSION_FILE,
-    get_public_ip,
     get_local_ip,
     get_server_ip,
     generate_dashboard_password,
     get_current_binary_version,
     set_binary_version,
     DASHBOARD_CACHE_TTL,
+    TOKEN_MAX_AGE,
+    SESSION_TOKEN_FORMAT,
     MAX_SERVERS_PER_VM,
-    MAX_SERVERS_IN_MASTER
+    MAX_SERVERS_IN_MASTER,
+    MASTER_WORKERS,
+    RELOAD_DRAIN_TIMEOUT
 )
 from game_database import (
-    save_account, get_account_by_username, get_account_by_id,
-    save_token, get_token, delete_old_tokens,
-    save_datastore, get_datastore, delete_datastore, list_datastore_keys, delete_old_datastores,
-    count_accounts, flush_write_buffer
+    flush_write_buffer,
+    save_account_async, get_account_by_username_async, get_account_by_id_async, update_password_async,
+    delete_old_tokens_async,
+    save_datastore_async, get_datastore_async, delete_datastore_async,
+    list_datastore_keys_async, delete_old_datastores_async, count_accounts_async,
+    get_weather_types_async, add_weather_type_async, remove_weather_type_async,
+    clear_server_players_async, ensure_volume_directories
 )
 from global_messages import (
     global_messages_queue,
@@ -69,7 +85,7 @@ from server_monitoring import get_system_stats
 from vm_lifecycle_manager import (
     register_vm_heartbeat, request_new_vm, get_available_vm_for_server,
     get_vm_by_server_uid, vm_lifecycle_monitor, get_vm_stats,
-    vm_registry, vm_registry_lock, create_vm
+    vm_registry, vm_registry_lock, create_vm, refresh_trusted_ips
 )
 from player_save_tracker import save_tracker, save_tracker_monitor
 from moderation_service import check_text_content, validate_username
@@ -80,7 +96,7 @@ shutdown_lock = threading.Lock()
 
 serverList = {}
 playerList = {}
-blockedIps = {}
+blockedIps = auth_utils.blockedIps
 
 message_connections = {}
 
@@ -88,6 +104,7 @@ dashboard_cache = {"timestamp": 0, "data": None}
 
 last_cleanup = 0
 dashboard_sessions = {}
+background_tasks = []
 
 def emergencyShutdown():
     with shutdown_lock:
@@ -97,53 +114,19 @@ def emergencyShutdown():
         except:
             pass
 
-atexit.register(emergencyShutdown)
-
-def checkRateLimit(clientIp):
-    return auth_utils.checkRateLimit(clientIp)
-
 def blockIp(clientIp, duration_minutes):
     blockedIps[clientIp] = time.time() + (duration_minutes * 60)
 
-def validateToken(token):
-    return auth_utils.validateToken(token)
-
-def hashPassword(password):
-    salt = secrets.token_hex(16)
-    password_hash = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000)
-    import base64
-    return salt + ":" + base64.b64encode(password_hash).decode()
-
-def verifyPassword(password, stored_hash):
-    try:
-        import base64
-        salt, hash_part = stored_hash.split(":")
-        password_hash = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000)
-        return base64.b64encode(password_hash).decode() == hash_part
-    except:
-        return False
-
-def generateToken():
-    return secrets.token_urlsafe(32)
-
-async def moderateText(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    text = requestData.get("text", "")
+@endpoint(auth=False)
+async def moderateText(httpRequest, ctx):
+    text = ctx.body.get("text", "")
 
     if not text:
-        return web.json_response({"error": "missing_text"}, status=400)
+        return json_response({"error": "missing_text"}, status=400)
 
     result = check_text_content(text)
 
-    return web.json_response({
+    return json_response({
         "success": True,
         "data": result
     })
@@ -151,133 +134,105 @@ async def moderateText(httpRequest):
 # TODO: we must not use this!!!!!!!
 # instead use registerUserWithCaptcha
 # just keeping because im a lazyass to change the client too
-async def registerUser(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "auth_rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except Exception as e:
-        print(f"[REGISTER] Error parsing JSON: {e}")
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    username = requestData.get("username", "").strip()
-    password = requestData.get("password", "")
-    gender = requestData.get("gender", "").lower()
+@endpoint(auth=False)
+async def registerUser(httpRequest, ctx):
+    username = ctx.body.get("username", "").strip()
+    password = ctx.body.get("password", "")
+    gender = ctx.body.get("gender", "").lower()
     # TODO: birthday should be implemented in the future
     #birthday = rerequestData.get("birthday", "")
 
     if not username or not password or gender not in ["male", "female", "none"]:
         print(f"[REGISTER] Invalid data")
-        return web.json_response({"error": "invalid_data"}, status=400)
+        return json_response({"error": "invalid_data"}, status=400)
 
     validation = validate_username(username)
     if not validation["valid"]:
-        return web.json_response({"error": validation["error"]}, status=400)
+        return json_response({"error": validation["error"]}, status=400)
 
     if len(password) < 6:
-        return web.json_response({"error": "password_too_short"}, status=400)
+        return json_response({"error": "password_too_short"}, status=400)
 
     try:
-        existing = get_account_by_username(username)
+        existing = await get_account_by_username_async(username)
         if existing:
-            return web.json_response({"error": "username_taken"}, status=409)
-
-        hashedPassword = hashPassword(password)
+            return json_response({"error": "username_taken"}, status=409)
 
-        token = generateToken()
+        hashedPassword = await auth_utils.hashPasswordAsync(password)
 
-        user_id = save_account(username, hashedPassword, gender)
+        user_id = await save_account_async(username, hashedPassword, gender)
 
-        save_token(token, username)
+        token = await auth_utils.issueSession(user_id, username)
 
         await createPlayerData(user_id, username)
 
-        return web.json_response({
+        return json_response({
             "status": "registered",
             "token": token,
             "username": username,
             "user_id": user_id
         })
 
+    except auth_utils.PasswordHashBusy:
+        return json_response({"error": "server_busy"}, status=503, headers={"Retry-After": "1"})
     except Exception as e:
         print(f"[REGISTER] EXCEPTION: {e}")
         import traceback
         traceback.print_exc()
-        return web.json_response({"error": "registration_failed", "details": str(e)}, status=500)
+        return json_response({"error": "registration_failed", "details": str(e)}, status=500)
 
-async def loginUser(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "auth_rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    username = requestData.get("username", "").strip()
-    password = requestData.get("password", "")
+@endpoint(auth=False)
+async def loginUser(httpRequest, ctx):
+    username = ctx.body.get("username", "").strip()
+    password = ctx.body.get("password", "")
 
     if not username or not password:
-        return web.json_response({"error": "missing_credentials"}, status=400)
+        return json_response({"error": "missing_credentials"}, status=400)
 
-    user_data = get_account_by_username(username)
+    user_data = await get_account_by_username_async(username)
     if not user_data:
-        return web.json_response({"error": "user_not_found"}, status=300)
-
-    if not verifyPassword(password, user_data["password"]):
-        return web.json_response({"error": "invalid_password"}, status=401)
+        return json_response({"error": "user_not_found"}, status=300)
 
-    token = generateToken()
-    save_token(token, username)
-
-    return web.json_response({
+    try:
+        valid, new_hash = await auth_utils.checkPasswordAsync(password, user_data.password)
+    except auth_utils.PasswordHashBusy:
+        return json_response({"error": "server_busy"}, status=503, headers={"Retry-After": "1"})
+    if not valid:
+        return json_response({"error": "invalid_password"}, status=401)
+    # stored hash used an older work factor, swap it now that we know the password
+    if new_hash:
+        await update_password_async(user_data.user_id, new_hash)
+
+    token = await auth_utils.issueSession(user_data.user_id, username)
+
+    return json_response({
         "status": "logged_in",
         "token": token,
         "username": username,
-        "user_id": user_data["user_id"]
+        "user_id": user_data.user_id
     })
 
-async def vmHeartbeat(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    vm_id = requestData.get("vm_id")
-    server_stats = requestData.get("servers", [])
+@endpoint(auth=False)
+async def vmHeartbeat(httpRequest, ctx):
+    vm_id = ctx.body.get("vm_id")
+    server_stats = ctx.body.get("servers", [])
 
     if not vm_id:
-        return web.json_response({"error": "missing_vm_id"}, status=400)
+        return json_response({"error": "missing_vm_id"}, status=400)
 
     response = await register_vm_heartbeat(vm_id, server_stats)
-    return web.json_response(response)
+    return json_response(response)
 
 async def getMaintenanceStatus(httpRequest):
     status = get_maintenance_status()
-    return web.json_response(status)
+    return json_response(status)
 
-async def getGlobalMessages(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    since_id = requestData.get("since_id", 0)
-    from global_messages import get_global_messages, get_latest_message_id
+@endpoint(auth=False)
+async def getGlobalMessages(httpRequest, ctx):
+    since_id = ctx.body.get("since_id", 0)
     messages = get_global_messages(since_id)
 
-    return web.json_response({
+    return json_response({
         "success": True,
         "data": {
             "messages": messages,
@@ -285,80 +240,46 @@ async def getGlobalMessages(httpRequest):
         }
     })
 
-async def processPurchase(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
-
-    username = auth_utils.getUsernameFromToken(token)
-    user_data = get_account_by_username(username)
-    if not user_data:
-        return web.json_response({"error": "user_not_found"}, status=404)
-
-    user_id = user_data["user_id"]
-    product_id = requestData.get("product_id")
-    purchase_token = requestData.get("purchase_token")
+@endpoint()
+async def processPurchase(httpRequest, ctx):
+    user_id = ctx.user_id
+    product_id = ctx.body.get("product_id")
+    purchase_token = ctx.body.get("purchase_token")
 
     if not product_id or not purchase_token:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
     try:
         result = await verify_google_play_purchase(user_id, product_id, purchase_token)
-        return web.json_response(result)
+        return json_response(result)
     except Exception as e:
         print(f"Purchase error: {e}")
         import traceback
         traceback.print_exc()
-        return web.json_response({"error": "internal_error", "details": str(e)}, status=500)
-
-async def processAdReward(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
+        return json_response({"error": "internal_error", "details": str(e)}, status=500)
 
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
-
-    username = auth_utils.getUsernameFromToken(token)
-    user_data = get_account_by_username(username)
-    if not user_data:
-        return web.json_response({"error": "user_not_found"}, status=404)
-
-    user_id = user_data["user_id"]
-    ad_network = requestData.get("ad_network", "admob")
-    ad_unit_id = requestData.get("ad_unit_id")
-    reward_amount = requestData.get("reward_amount", 10)
+@endpoint()
+async def processAdReward(httpRequest, ctx):
+    user_id = ctx.user_id
+    ad_network = ctx.body.get("ad_network", "admob")
+    ad_unit_id = ctx.body.get("ad_unit_id")
+    reward_amount = ctx.body.get("reward_amount", 10)
 
     if not ad_unit_id:
-        return web.json_response({"error": "missing_ad_unit_id"}, status=400)
+        return json_response({"error": "missing_ad_unit_id"}, status=400)
 
     try:
         result = await verify_ad_reward(user_id, ad_network, ad_unit_id, reward_amount)
-        return web.json_response(result)
+        return json_response(result)
     except Exception as e:
         print(f"Ad reward error: {e}")
         import traceback
         traceback.print_exc()
-        return web.json_response({"error": "internal_error", "details": str(e)}, status=500)
+        return json_response({"error": "internal_error", "details": str(e)}, status=500)
 
 async def getCurrencyPackagesEndpoint(httpRequest):
     result = get_currency_packages()
-    return web.json_response(result)
+    return json_response(result)
 
 def verify_dashboard_session(session_token):
     if not session_token or session_token not in dashboard_sessions:
@@ -371,152 +292,125 @@ def verify_dashboard_session(session_token):
 
     return True
 
-async def dashboardLogin(httpRequest):
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    password = requestData.get("password")
+@endpoint(auth=False)
+async def dashboardLogin(httpRequest, ctx):
+    password = ctx.body.get("password")
 
-    if password == DASHBOARD_PASSWORD:
+    if password == get_dashboard_password():
         session_token = secrets.token_urlsafe(32)
         dashboard_sessions[session_token] = {
             "created": time.time(),
             "ip": httpRequest.remote
         }
-        return web.json_response({"success": True, "session_token": session_token})
+        return json_response({"success": True, "session_token": session_token})
 
-    return web.json_response({"error": "invalid_password"}, status=401)
+    return json_response({"error": "invalid_password"}, status=401)
 
-async def sendGlobalMessage(httpRequest):
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    session_token = requestData.get("session_token")
+@endpoint(auth=False)
+async def sendGlobalMessage(httpRequest, ctx):
+    session_token = ctx.body.get("session_token")
     if not verify_dashboard_session(session_token):
-        return web.json_response({"error": "unauthorized"}, status=401)
+        return json_response({"error": "unauthorized"}, status=401)
 
-    message_type = requestData.get("type")
-    properties = requestData.get("properties", {})
+    message_type = ctx.body.get("type")
+    properties = ctx.body.get("properties", {})
 
     if not message_type:
-        return web.json_response({"error": "missing_type"}, status=400)
+        return json_response({"error": "missing_type"}, status=400)
 
     result = add_global_message(message_type, properties)
-    return web.json_response(result)
-
-async def setMaintenanceMode(httpRequest):
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
+    return json_response(result)
 
-    session_token = requestData.get("session_token")
+@endpoint(auth=False)
+async def setMaintenanceMode(httpRequest, ctx):
+    session_token = ctx.body.get("session_token")
     if not verify_dashboard_session(session_token):
-        return web.json_response({"error": "unauthorized"}, status=401)
+        return json_response({"error": "unauthorized"}, status=401)
 
-    enabled = requestData.get("enabled", False)
-    message = requestData.get("message", "")
+    enabled = ctx.body.get("enabled", False)
+    message = ctx.body.get("message", "")
 
     result = set_maintenance_mode(enabled, message)
-    return web.json_response(result)
-
-async def getWeatherTypes(httpRequest):
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
+    return json_response(result)
 
-    session_token = requestData.get("session_token")
+@endpoint(auth=False)
+async def getWeatherTypes(httpRequest, ctx):
+    session_token = ctx.body.get("session_token")
     if not verify_dashboard_session(session_token):
-        return web.json_response({"error": "unauthorized"}, status=401)
+        return json_response({"error": "unauthorized"}, status=401)
 
-    from game_database import get_weather_types
-    weathers = get_weather_types()
-    return web.json_response({"success": True, "data": weathers})
+    weathers = await get_weather_types_async()
+    return json_response({"success": True, "data": weathers})
 
-async def addWeatherType(httpRequest):
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    session_token = requestData.get("session_token")
+@endpoint(auth=False)
+async def addWeatherType(httpRequest, ctx):
+    session_token = ctx.body.get("session_token")
     if not verify_dashboard_session(session_token):
-        return web.json_response({"error": "unauthorized"}, status=401)
+        return json_response({"error": "unauthorized"}, status=401)
 
-    weather_name = requestData.get("weather_name")
+    weather_name = ctx.body.get("weather_name")
     if not weather_name:
-        return web.json_response({"error": "missing_weather_name"}, status=400)
+        return json_response({"error": "missing_weather_name"}, status=400)
 
-    from game_database import add_weather_type
-    success = add_weather_type(weather_name)
+    success = await add_weather_type_async(weather_name)
 
     if success:
-        return web.json_response({"success": True})
+        return json_response({"success": True})
     else:
-        return web.json_response({"error": "weather_exists"}, status=400)
-
-async def removeWeatherType(httpRequest):
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
+        return json_response({"error": "weather_exists"}, status=400)
 
-    session_token = requestData.get("session_token")
+@endpoint(auth=False)
+async def removeWeatherType(httpRequest, ctx):
+    session_token = ctx.body.get("session_token")
     if not verify_dashboard_session(session_token):
-        return web.json_response({"error": "unauthorized"}, status=401)
+        return json_response({"error": "unauthorized"}, status=401)
 
-    weather_name = requestData.get("weather_name")
+    weather_name = ctx.body.get("weather_name")
     if not weather_name:
-        return web.json_response({"error": "missing_weather_name"}, status=400)
+        return json_response({"error": "missing_weather_name"}, status=400)
 
-    from game_database import remove_weather_type
-    success = remove_weather_type(weather_name)
+    success = await remove_weather_type_async(weather_name)
 
-    return web.json_response({"success": success})
+    return json_response({"success": success})
 
 async def getDashboardData(httpRequest):
+    data = await httpRequest.read()
     try:
-        requestData = await httpRequest.json()
+        requestData = loads(data) if data else {}
     except:
-        data = await httpRequest.text()
-        if data:
-            return web.json_response({"error": "invalid_json"}, status=400)
-        requestData = {}
+        return json_response({"error": "invalid_json"}, status=400)
 
     session_token = requestData.get("session_token")
     if not verify_dashboard_session(session_token):
-        return web.json_response({"error": "unauthorized"}, status=401)
+        return json_response({"error": "unauthorized"}, status=401)
 
     current_time = time.time()
     if dashboard_cache["data"] and (current_time - dashboard_cache["timestamp"]) < DASHBOARD_CACHE_TTL:
-        return web.json_response(dashboard_cache["data"])
+        return json_response(dashboard_cache["data"])
 
     vm_stats = get_vm_stats()
     system_stats = get_system_stats()
 
+    if shared_state.enabled:
+        rate_limit_entries = await shared_state.rateLimitEntries(100)
+    else:
+        rate_limit_entries = auth_utils.get_rate_limit_entries(100)
     rate_limit_data = []
-    for ip in list(auth_utils.rateLimitDict.keys())[:100]:
-        timestamps = auth_utils.rateLimitDict[ip]
-        recent_requests = len(timestamps)
-        if recent_requests > 0:
-            rate_limit_data.append({
-                "ip": ip,
-                "requests": recent_requests,
-                "blocked": ip in blockedIps,
-                "block_expires": int(blockedIps[ip] - current_time) if ip in blockedIps else 0
-            })
+    for entry in rate_limit_entries:
+        ip = entry["key"]
+        rate_limit_data.append({
+            "ip": ip,
+            "group": entry["group"],
+            "requests": entry["requests"],
+            "blocked": ip in blockedIps,
+            "block_expires": int(blockedIps[ip] - current_time) if ip in blockedIps else 0
+        })
 
     rate_limit_data.sort(key=lambda x: x["requests"], reverse=True)
 
-    from game_database import get_weather_types
-    weather_types = get_weather_types()
+    weather_types = await get_weather_types_async()
 
-    user_count = count_accounts()
+    user_count = await count_accounts_async()
 
     pending_saves = await save_tracker.get_pending_saves()
 
@@ -533,19 +427,80 @@ async def getDashboardData(httpRequest):
         "rate_limits": rate_limit_data,
         "system": system_stats,
         "maintenance": is_maintenance_mode(),
-        "weather_types": weather_types
+        "weather_types": weather_types,
+        "backups": get_backup_stats(),
+        "requests": get_request_metrics_summary(),
+        "startup": get_startup_stats()
     }
 
     dashboard_cache["timestamp"] = current_time
     dashboard_cache["data"] = result
 
-    return web.json_response(result)
+    return json_response(result)
+
+@endpoint(auth=False)
+async def getQueryStats(httpRequest, ctx):
+    session_token = ctx.body.get("session_token")
+    if not verify_dashboard_session(session_token):
+        return json_response({"error": "unauthorized"}, status=401)
+
+    if ctx.body.get("reset"):
+        query_stats.reset_query_stats()
+
+    try:
+        limit = min(int(ctx.body.get("limit", 50)), 500)
+    except (TypeError, ValueError):
+        return json_response({"error": "invalid_limit"}, status=400)
+
+    result = query_stats.get_query_stats(ctx.body.get("sort", "total_ms"), limit)
+    result["read_pool"] = get_read_pool_stats()
+    result["group_commit"] = group_writer.get_stats()
+    result["shards"] = get_shard_stats()
+    result["password_hash"] = auth_utils.get_password_pool_stats()
+    result["sessions"] = auth_utils.get_token_cache_stats()
+    result["sessions"].update(auth_utils.get_revocation_stats())
+    result["rate_limits"] = auth_utils.get_rate_limit_stats()
+    result["static_pages"] = get_static_page_stats()
+    result["compression"] = get_compression_stats()
+
+    return json_response(result)
+
+@endpoint(auth=False)
+async def getBackups(httpRequest, ctx):
+    session_token = ctx.body.get("session_token")
+    if not verify_dashboard_session(session_token):
+        return json_response({"error": "unauthorized"}, status=401)
+
+    return json_response({"success": True, "data": get_backup_stats()})
+
+@endpoint(auth=False)
+async def runBackup(httpRequest, ctx):
+    session_token = ctx.body.get("session_token")
+    if not verify_dashboard_session(session_token):
+        return json_response({"error": "unauthorized"}, status=401)
+
+    loop = asyncio.get_event_loop()
+    result = await loop.run_in_executor(None, backup_database)
+    if result["success"]:
+        return json_response(result)
+    return json_response(result, status=409 if result["error"] == "backup_in_progress" else 500)
+
+@endpoint(auth=False)
+async def verifyBackup(httpRequest, ctx):
+    session_token = ctx.body.get("session_token")
+    if not verify_dashboard_session(session_token):
+        return json_response({"error": "unauthorized"}, status=401)
+
+    backup_file = ctx.body.get("file")
+    if not backup_file:
+        return json_response({"error": "missing_file"}, status=400)
+
+    loop = asyncio.get_event_loop()
+    result = await loop.run_in_executor(None, verify_backup, os.path.basename(backup_file))
+    return json_response(result, status=200 if result["success"] else 400)
 
 async def dashboardView(httpRequest):
-    dashboard_path = os.path.join(os.path.dirname(__file__), "dashboard.html")
-    with open(dashboard_path, "r", encoding="utf-8") as f:
-        html = f.read()
-    return web.Response(text=html, content_type="text/html")
+    return pageResponse(httpRequest, "dashboard.html")
 
 async def cleanupTask():
     global last_cleanup
@@ -553,43 +508,27 @@ async def cleanupTask():
         try:
             currentTime = time.time()
             if currentTime - last_cleanup > 60:
-                delete_old_tokens(currentTime - 2592000)
-                delete_old_datastores(currentTime - 86400)
+                # the db is shared, one worker cleans it
+                if shared_state.is_primary():
+                    await delete_old_tokens_async(currentTime - 2592000)
+                    await delete_old_datastores_async(currentTime - 86400)
+                await auth_utils.refreshRevocations()
                 clear_old_messages(300)
                 last_cleanup = currentTime
             await asyncio.sleep(10)
-        except:
+        except Exception:
             await asyncio.sleep(10)
 
-async def requestServer(httpRequest):
+@endpoint()
+async def requestServer(httpRequest, ctx):
     if is_maintenance_mode():
-        return web.json_response({"error": "maintenance_mode"}, status=503)
-
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except Exception as e:
-        print(f"Error parsing request: {e}")
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
+        return json_response({"error": "maintenance_mode"}, status=503)
 
     try:
-        username = auth_utils.getUsernameFromToken(token)
-        user_data = get_account_by_username(username)
-        userId = user_data["user_id"] if user_data else None
-
-        if not userId:
-            return web.json_response({"error": "user_not_found"}, status=404)
+        userId = ctx.user_id
 
         # check if user has an active private srv subscription
-        from player_data import getPlayerData
-        playerData = getPlayerData(userId)
+        playerData = await getPlayerDataAsync(userId)
         has_private_server = playerData.get("private_server_active", False)
 
         if has_private_server:
@@ -606,9 +545,9 @@ async def requestServer(httpRequest):
                             from player_data import setPlayerServer
                             await setPlayerServer(userId, server_uid)
 
-                            vm_ip = vm_info.get("ip", SERVER_PUBLIC_IP)
+                            vm_ip = vm_info.get("ip", get_server_public_ip())
 
-                            return web.json_response({
+                            return json_response({
                                 "uid": server_uid,
                                 "ip": vm_ip,
                                 "port": server_data["port"],
@@ -640,7 +579,7 @@ async def requestServer(httpRequest):
                     if player_count <= best_player_count-1:
                         if player_count < best_player_count:
                             best_player_count = player_count
-                            vm_ip = vm_info.get("ip", SERVER_PUBLIC_IP)
+                            vm_ip = vm_info.get("ip", get_server_public_ip())
                             best_server = {
                                 "uid": server_uid,
                                 "ip": vm_ip,
@@ -655,7 +594,7 @@ async def requestServer(httpRequest):
                 from player_data import setPlayerServer
                 await setPlayerServer(userId, best_server['uid'])
 
-                return web.json_response({
+                return json_response({
                     "uid": best_server['uid'],
                     "ip": best_server['ip'],
                     "port": best_server['port'],
@@ -665,7 +604,7 @@ async def requestServer(httpRequest):
 
         request_id = f"pending_{userId}_{int(time.time())}"
 
-        master_vm_id = f"main-{SERVER_PUBLIC_IP}"
+        master_vm_id = f"main-{get_server_public_ip()}"
         async with vm_registry_lock:
             if master_vm_id in vm_registry:
                 master_vm = vm_registry[master_vm_id]
@@ -686,9 +625,9 @@ async def requestServer(httpRequest):
                         from player_data import setPlayerServer
                         await setPlayerServer(userId, server_uid)
 
-                        return web.json_response({
+                        return json_response({
                             "uid": server_uid,
-                            "ip": SERVER_PUBLIC_IP,
+                            "ip": get_server_public_ip(),
                             "port": next_port,
                             "vm_id": master_vm_id,
                             "private": False
@@ -720,7 +659,7 @@ async def requestServer(httpRequest):
                         from player_data import setPlayerServer
                         await setPlayerServer(userId, server_uid)
 
-                        return web.json_response({
+                        return json_response({
                             "uid": server_uid,
                             "ip": vm_ip,
                             "port": next_port,
@@ -729,7 +668,7 @@ async def requestServer(httpRequest):
                         })
 
         # create new VM
-        master_url = f"http://{SERVER_PUBLIC_IP}:{BASE_PORT}"
+        master_url = f"http://{get_server_public_ip()}:{BASE_PORT}"
         print(f"creating new VM...")
 
         loop = asyncio.get_event_loop()
@@ -764,7 +703,7 @@ async def requestServer(httpRequest):
                     from player_data import setPlayerServer
                     await setPlayerServer(userId, first_server_uid)
 
-                    return web.json_response({
+                    return json_response({
                         "uid": first_server_uid,
                         "ip": vm_ip,
                         "port": first_server["port"],
@@ -777,15 +716,15 @@ async def requestServer(httpRequest):
 
             if not server_ready:
                 print(f"Timeout waiting for Godot server")
-                return web.json_response({"error": "timeout"}, status=503)
+                return json_response({"error": "timeout"}, status=503)
         else:
-            return web.json_response({"error": "failed_to_create_vm"}, status=503)
+            return json_response({"error": "failed_to_create_vm"}, status=503)
 
     except Exception as e:
         print(f"ERROR in requestServer: {e}")
         import traceback
         traceback.print_exc()
-        return web.json_response({"error": "internal_error", "message": str(e)}, status=500)
+        return json_response({"error": "internal_error", "message": str(e)}, status=500)
 
 def request_new_vm_sync(master_url: str) -> Optional[Dict]:
     vm_id = str(uuid.uuid4())
@@ -805,6 +744,7 @@ def request_new_vm_sync(master_url: str) -> Optional[Dict]:
             "created": vm_data.get("created", time.time()),
             "is_master": False
         }
+        refresh_trusted_ips()
 
         print(f"Remote VM registered: {vm_id} (IP: {vm_data.get('ip')})")
         return vm_registry[vm_id]
@@ -816,7 +756,7 @@ async def cleanup_empty_master_servers():
         try:
             await asyncio.sleep(30)
 
-            master_vm_id = f"main-{SERVER_PUBLIC_IP}"
+            master_vm_id = f"main-{get_server_public_ip()}"
             async with vm_registry_lock:
                 if master_vm_id not in vm_registry:
                     continue
@@ -866,8 +806,7 @@ async def cleanup_empty_master_servers():
                         if server_uid in servers:
                             del servers[server_uid]
 
-                query = "UPDATE player_data SET server_id = NULL WHERE server_id = ?"
-                execute_query(query, (server_uid,))
+                await clear_server_players_async(server_uid)
 
         except Exception as e:
             print(f"Error in cleanup_empty_master_servers: {e}")
@@ -897,142 +836,116 @@ async def request_vm_spawn_server(vm_ip: str, server_uid: str, port: int):
         return False
 
 async def heartbeatClient(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"status": "alive"})
     try:
-        requestData = await httpRequest.json()
+        requestData = await readBody(httpRequest)
     except:
-        return web.json_response({"status": "alive"})
-    token = requestData.get("token")
-    if not token:
-        return web.json_response({"status": "alive"})
-    if not validateToken(token):
-        return web.json_response({"status": "alive"})
-    username = auth_utils.getUsernameFromToken(token)
+        return json_response({"status": "alive"})
+    # usually already resolved by rate_limit_middleware
+    session = await requestSession(httpRequest, requestData)
+    if not session:
+        return json_response({"status": "alive"})
+    username = session.username
     if username in playerList:
         playerList[username]["last"] = time.time()
-    return web.json_response({"status": "alive"})
-
-async def validateTokenEndpoint(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except Exception as e:
-        return web.json_response({"error": "invalid_json"}, status=400)
+    return json_response({"status": "alive"})
 
-    token = requestData.get("token")
+@endpoint(auth=False)
+async def validateTokenEndpoint(httpRequest, ctx):
+    token = ctx.body.get("token")
 
     if not token:
-        return web.json_response({"error": "missing_token"}, status=400)
+        return json_response({"error": "missing_token"}, status=400)
 
     try:
-        if not validateToken(token):
-            return web.json_response({"error": "invalid_token"}, status=401)
+        session = await requestSession(httpRequest, ctx.body)
+        if not session:
+            return json_response({"error": "invalid_token"}, status=401)
 
-        username = auth_utils.getUsernameFromToken(token)
-
-        user_data = get_account_by_username(username)
-
-        if not user_data:
-            return web.json_response({"error": "user_not_found"}, status=404)
-
-        token_data = get_token(token)
-
-        if not token_data:
-            return web.json_response({"error": "token_not_found"}, status=404)
-
-        return web.json_response({
+        response = {
             "status": "valid",
-            "username": username,
-            "user_id": user_data["user_id"],
-            "expires_in": int(2592000 - (time.time() - token_data["created"]))
-        })
+            "username": session.username,
+            "user_id": session.user_id,
+            "expires_in": int(TOKEN_MAX_AGE - (time.time() - session.created))
+        }
+        # migrating to signed tokens, old opaque ones get swapped on validate
+        if SESSION_TOKEN_FORMAT == "signed" and not token.startswith(auth_utils.SIGNED_TOKEN_PREFIX):
+            response["token"] = auth_utils.signSessionToken(session.user_id, session.username, session.created)
+        return json_response(response)
 
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return web.json_response({"error": "internal_error", "details": str(e)}, status=500)
+        return json_response({"error": "internal_error", "details": str(e)}, status=500)
 
-async def getUserById(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
+@endpoint()
+async def logoutUser(httpRequest, ctx):
+    await auth_utils.revokeToken(ctx.token)
+    return json_response({"success": True})
 
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    user_id = requestData.get("user_id")
+@endpoint(auth=False)
+async def getUserById(httpRequest, ctx):
+    user_id = ctx.body.get("user_id")
 
     if not user_id:
-        return web.json_response({"error": "missing_user_id"}, status=400)
+        return json_response({"error": "missing_user_id"}, status=400)
 
-    user_data = get_account_by_id(user_id)
+    user_data = await get_account_by_id_async(user_id)
 
     if user_data:
-        return web.json_response({
-            "username": user_data["username"],
-            "user_id": user_data["user_id"],
-            "gender": user_data["gender"],
-            "created": user_data["created"]
+        return json_response({
+            "username": user_data.username,
+            "user_id": user_data.user_id,
+            "gender": user_data.gender,
+            "created": user_data.created
         })
 
-    return web.json_response({"error": "user_not_found"}, status=404)
+    return json_response({"error": "user_not_found"}, status=404)
 
-async def searchUsers(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    search_query = requestData.get("query", "").strip().lower()
-    limit = requestData.get("limit", 20)
+@endpoint(auth=False)
+async def searchUsers(httpRequest, ctx):
+    search_query = ctx.body.get("query", "").strip().lower()
+    limit = ctx.body.get("limit", 20)
 
     if not search_query:
-        return web.json_response({"error": "missing_query"}, status=400)
+        return json_response({"error": "missing_query"}, status=400)
 
     if limit > 50:
         limit = 50
 
-    query = "SELECT user_id, username FROM accounts WHERE LOWER(username) LIKE ? LIMIT ?"
-    results = execute_query(query, (f"%{search_query}%", limit), fetch_all=True)
+    # prefix matches come off idx_accounts_username_nocase, only scan for
+    # substring matches when there arent enough of them
+    pattern = search_query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    query = "SELECT user_id, username FROM accounts WHERE username LIKE ? ESCAPE '\\' LIMIT ?"
+    results = await execute_query_async(query, (f"{pattern}%", limit), fetch_all=True) or []
+
+    if len(results) < limit:
+        query = "SELECT user_id, username FROM accounts WHERE username LIKE ? ESCAPE '\\' AND username NOT LIKE ? ESCAPE '\\' LIMIT ?"
+        results += await execute_query_async(query, (f"%{pattern}%", f"{pattern}%", limit - len(results)), fetch_all=True) or []
 
-    users = [{"user_id": row[0], "username": row[1]} for row in results] if results else []
+    users = [{"user_id": row[0], "username": row[1]} for row in results]
 
-    return web.json_response({"users": users})
+    return json_response({"users": users})
 
 async def setDatastore(httpRequest):
     clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    allowed_ips = ["127.0.0.1", "::1", SERVER_PUBLIC_IP]
+    allowed_ips = ["127.0.0.1", "::1", get_server_public_ip()]
     if clientIp not in allowed_ips:
-        return web.json_response({"error": "unauthorized_ip"}, status=403)
+        return json_response({"error": "unauthorized_ip"}, status=403)
 
     try:
-        requestData = await httpRequest.json()
+        requestData = await readBody(httpRequest)
     except:
-        return web.json_response({"error": "invalid_json"}, status=400)
+        return json_response({"error": "invalid_json"}, status=400)
 
     key = requestData.get("key")
     value = requestData.get("value")
     accessKey = requestData.get("access_key")
 
     if not key or not accessKey:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
     if accessKey != DATASTORE_PASSWORD:
-        return web.json_response({"error": "invalid_access_key"}, status=403)
+        return json_response({"error": "invalid_access_key"}, status=403)
 
     datastoreKey = f"server:{key}"
 
@@ -1041,32 +954,24 @@ async def setDatastore(httpRequest):
     else:
         value_str = str(value) if value is not None else ""
 
-    save_datastore(datastoreKey, value_str)
+    await save_datastore_async(datastoreKey, value_str)
 
-    return web.json_response({"status": "success", "key": key})
+    return json_response({"status": "success", "key": key})
 
-async def getDatastore(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    key = requestData.get("key")
-    accessKey = requestData.get("access_key")
+@endpoint(auth=False)
+async def getDatastore(httpRequest, ctx):
+    key = ctx.body.get("key")
+    accessKey = ctx.body.get("access_key")
 
     if not key or not accessKey:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
     if accessKey != DATASTORE_PASSWORD:
-        return web.json_response({"error": "invalid_access_key"}, status=403)
+        return json_response({"error": "invalid_access_key"}, status=403)
 
     datastoreKey = f"server:{key}"
 
-    result = get_datastore(datastoreKey)
+    result = await get_datastore_async(datastoreKey)
 
     if result:
         value = result["value"]
@@ -1075,62 +980,51 @@ async def getDatastore(httpRequest):
         except:
             pass
 
-        return web.json_response({
+        return json_response({
             "key": key,
             "value": value,
             "timestamp": result["timestamp"]
         })
 
-    return web.json_response({"error": "key_not_found"}, status=404)
+    return json_response({"error": "key_not_found"}, status=404)
 
 async def removeDatastore(httpRequest):
     clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    allowed_ips = ["127.0.0.1", "::1", SERVER_PUBLIC_IP]
+    allowed_ips = ["127.0.0.1", "::1", get_server_public_ip()]
     if clientIp not in allowed_ips:
-        return web.json_response({"error": "unauthorized_ip"}, status=403)
+        return json_response({"error": "unauthorized_ip"}, status=403)
 
     try:
-        requestData = await httpRequest.json()
+        requestData = await readBody(httpRequest)
     except:
-        return web.json_response({"error": "invalid_json"}, status=400)
+        return json_response({"error": "invalid_json"}, status=400)
 
     key = requestData.get("key")
     accessKey = requestData.get("access_key")
 
     if not key or not accessKey:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
     if accessKey != DATASTORE_PASSWORD:
-        return web.json_response({"error": "invalid_access_key"}, status=403)
+        return json_response({"error": "invalid_access_key"}, status=403)
 
     datastoreKey = f"server:{key}"
 
-    delete_datastore(datastoreKey)
-
-    return web.json_response({"status": "removed", "key": key})
+    await delete_datastore_async(datastoreKey)
 
-async def listDatastoreKeys(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
+    return json_response({"status": "removed", "key": key})
 
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    accessKey = requestData.get("access_key")
+@endpoint(auth=False)
+async def listDatastoreKeys(httpRequest, ctx):
+    accessKey = ctx.body.get("access_key")
 
     if not accessKey:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
     if accessKey != DATASTORE_PASSWORD:
-        return web.json_response({"error": "invalid_access_key"}, status=403)
+        return json_response({"error": "invalid_access_key"}, status=403)
 
-    results = list_datastore_keys("server:")
+    results = await list_datastore_keys_async("server:")
 
     serverKeys = []
     for result in results:
@@ -1140,39 +1034,31 @@ async def listDatastoreKeys(httpRequest):
             "timestamp": result["timestamp"]
         })
 
-    return web.json_response({"keys": serverKeys})
-
-async def listAllAccessories(httpRequest):
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
+    return json_response({"keys": serverKeys})
 
-    session_token = requestData.get("session_token")
+@endpoint(auth=False)
+async def listAllAccessories(httpRequest, ctx):
+    session_token = ctx.body.get("session_token")
     if not verify_dashboard_session(session_token):
-        return web.json_response({"error": "unauthorized"}, status=401)
+        return json_response({"error": "unauthorized"}, status=401)
 
     from avatar_service import listMarketItems
-    result = listMarketItems(pagination={"page": 1, "limit": 1000})
-    return web.json_response(result)
+    result = await run_in_db(listMarketItems, pagination={"page": 1, "limit": 1000})
+    return json_response(result)
 
-async def deleteAccessoryEndpoint(httpRequest):
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    session_token = requestData.get("session_token")
+@endpoint(auth=False)
+async def deleteAccessoryEndpoint(httpRequest, ctx):
+    session_token = ctx.body.get("session_token")
     if not verify_dashboard_session(session_token):
-        return web.json_response({"error": "unauthorized"}, status=401)
+        return json_response({"error": "unauthorized"}, status=401)
 
-    accessory_id = requestData.get("accessory_id")
+    accessory_id = ctx.body.get("accessory_id")
     if not accessory_id:
-        return web.json_response({"error": "missing_accessory_id"}, status=400)
+        return json_response({"error": "missing_accessory_id"}, status=400)
 
     from avatar_service import deleteAccessory
-    result = deleteAccessory(accessory_id)
-    return web.json_response(result)
+    result = await run_in_db(deleteAccessory, accessory_id)
+    return json_response(result)
 
 async def addAccessoryEndpoint(httpRequest):
     try:
@@ -1192,22 +1078,23 @@ async def addAccessoryEndpoint(httpRequest):
                 filenames[field.name] = field.filename
 
         if not session_token or not verify_dashboard_session(session_token):
-            return web.json_response({"error": "unauthorized"}, status=401)
+            return json_response({"error": "unauthorized"}, status=401)
 
         if not all(k in fields for k in ["name", "type", "price", "equip_slot"]):
-            return web.json_response({"error": "missing_required_fields"}, status=400)
+            return json_response({"error": "missing_required_fields"}, status=400)
 
         if "model" not in files:
-            return web.json_response({"error": "model_file_required"}, status=400)
+            return json_response({"error": "model_file_required"}, status=400)
 
         try:
             price = int(fields["price"])
         except:
-            return web.json_response({"error": "invalid_price"}, status=400)
+            return json_response({"error": "invalid_price"}, status=400)
 
         from avatar_service import addAccessoryFromDashboard
 
-        result = addAccessoryFromDashboard(
+        result = await run_in_db(
+            addAccessoryFromDashboard,
             name=fields["name"],
             accessory_type=fields["type"],
             price=price,
@@ -1221,139 +1108,126 @@ async def addAccessoryEndpoint(httpRequest):
             mtl_filename=filenames.get("mtl")
         )
 
-        return web.json_response(result)
+        return json_response(result)
 
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return web.json_response({"error": str(e)}, status=400)
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
+        return json_response({"error": str(e)}, status=400)
     try:
-        requestData = await httpRequest.json()
+        requestData = loads(await httpRequest.read())
     except:
-        return web.json_response({"error": "invalid_json"}, status=400)
+        return json_response({"error": "invalid_json"}, status=400)
 
     access_key = requestData.get("access_key")
     user_id = requestData.get("user_id")
     amount = requestData.get("amount")
 
     if not access_key or not user_id or not amount:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
     if access_key != DATASTORE_PASSWORD:
-        return web.json_response({"error": "invalid_access_key"}, status=403)
+        return json_response({"error": "invalid_access_key"}, status=403)
 
     try:
         amount = int(amount)
         user_id = int(user_id)
     except:
-        return web.json_response({"error": "invalid_amount_or_user_id"}, status=400)
+        return json_response({"error": "invalid_amount_or_user_id"}, status=400)
 
     if amount <= 0:
-        return web.json_response({"error": "amount_must_be_positive"}, status=400)
+        return json_response({"error": "amount_must_be_positive"}, status=400)
 
     from currency_system import creditCurrency
     result = await creditCurrency(user_id, amount)
 
-    return web.json_response(result)
+    return json_response(result)
 
 async def generateCaptcha(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    from captcha_system import generate_puzzle_captcha
-    captcha_id, image_data = generate_puzzle_captcha()
+    from captcha_system import generate_puzzle_captcha_async
+    captcha_id, image_data = await generate_puzzle_captcha_async()
 
-    return web.json_response({
+    return json_response({
         "success": True,
         "captcha_id": captcha_id,
         "image": image_data
     })
 
-async def verifyCaptcha(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    captcha_id = requestData.get("captcha_id")
-    answer = requestData.get("answer")
+@endpoint(auth=False)
+async def verifyCaptcha(httpRequest, ctx):
+    captcha_id = ctx.body.get("captcha_id")
+    answer = ctx.body.get("answer")
 
     if not captcha_id or answer is None:
-        return web.json_response({"error": "missing_fields"}, status=400)
+        return json_response({"error": "missing_fields"}, status=400)
 
-    from captcha_system import verify_captcha
-    success, message = verify_captcha(captcha_id, answer)
+    from captcha_system import verify_captcha_async
+    success, message = await verify_captcha_async(captcha_id, answer)
 
-    return web.json_response({
+    return json_response({
         "success": success,
         "message": message
     })
 
-async def registerUserWithCaptcha(httpRequest):
+@endpoint(auth=False)
+async def registerUserWithCaptcha(httpRequest, ctx):
     clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "auth_rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    username = requestData.get("username", "").strip()
-    password = requestData.get("password", "")
-    gender = requestData.get("gender", "").lower()
+    username = ctx.body.get("username", "").strip()
+    password = ctx.body.get("password", "")
+    gender = ctx.body.get("gender", "").lower()
     # TODO: birthday should be implemented in the future
     #birthday = rerequestData.get("birthday", "")
-    captcha_id = requestData.get("captcha_id")
-    captcha_answer = requestData.get("captcha_answer")
+    captcha_id = ctx.body.get("captcha_id")
+    captcha_answer = ctx.body.get("captcha_answer")
 
     if not username or not password or gender not in ["male", "female", "none"]:
-        return web.json_response({"error": "invalid_data"}, status=400)
+        return json_response({"error": "invalid_data"}, status=400)
 
     validation = validate_username(username)
     if not validation["valid"]:
-        return web.json_response({"error": validation["error"]}, status=400)
+        return json_response({"error": validation["error"]}, status=400)
 
     if len(password) < 6:
-        return web.json_response({"error": "password_too_short"}, status=400)
+        return json_response({"error": "password_too_short"}, status=400)
 
-    from captcha_system import verify_captcha, is_first_account_from_ip, mark_ip_used
+    from captcha_system import verify_captcha_async, is_first_account_from_ip_async, mark_ip_used_async
 
-    if not is_first_account_from_ip(clientIp):
-        success, message = verify_captcha(captcha_id, captcha_answer)
+    if not await is_first_account_from_ip_async(clientIp):
+        success, message = await verify_captcha_async(captcha_id, captcha_answer)
         if not success:
-            return web.json_response({"error": "captcha_failed", "message": message}, status=400)
+            return json_response({"error": "captcha_failed", "message": message}, status=400)
 
-    existing = get_account_by_username(username)
+    existing = await get_account_by_username_async(username)
     if existing:
-        return web.json_response({"error": "username_taken"}, status=409)
-
-    hashedPassword = hashPassword(password)
-    token = generateToken()
+        return json_response({"error": "username_taken"}, status=409)
 
-    user_id = save_account(username, hashedPassword, gender)
+    try:
+        hashedPassword = await auth_utils.hashPasswordAsync(password)
+    except auth_utils.PasswordHashBusy:
+        return json_response({"error": "server_busy"}, status=503, headers={"Retry-After": "1"})
+    user_id = await save_account_async(username, hashedPassword, gender)
 
-    save_token(token, username)
+    token = await auth_utils.issueSession(user_id, username)
 
-    createPlayerData(user_id, username)
-    mark_ip_used(clientIp)
+    await createPlayerData(user_id, username)
+    await mark_ip_used_async(clientIp)
 
-    return web.json_response({
+    return json_response({
         "status": "registered",
         "token": token,
         "username": username,
         "user_id": user_id
     })
 
+# a broadcast puts the same message object in every subscriber queue,
+# encode it once instead of once per socket
+last_ws_message = [None, None]
+
+def encodeWsMessage(message):
+    if last_ws_message[0] is not message:
+        last_ws_message[:] = [message, dumps(message)]
+    return last_ws_message[1]
+
 async def websocket_messages(request):
     ws = web.WebSocketResponse()
     await ws.prepare(request)
@@ -1389,7 +1263,7 @@ async def websocket_messages(request):
                 try:
                     message = queue_task.result()
                     if not ws.closed:
-                        await ws.send_json(message)
+                        await ws.send_str(encodeWsMessage(message))
                 except Exception:
                     break
                 queue_task = asyncio.create_task(queue.get())
@@ -1420,30 +1294,13 @@ async def websocket_messages(request):
 
     return ws
 
-async def getPaymentHistory(httpRequest):
-    clientIp = httpRequest.remote
-    if not checkRateLimit(clientIp):
-        return web.json_response({"error": "rate_limit_exceeded"}, status=429)
-
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    token = requestData.get("token")
-    if not token or not validateToken(token):
-        return web.json_response({"error": "invalid_token"}, status=401)
-
-    username = auth_utils.getUsernameFromToken(token)
-    user_data = get_account_by_username(username)
-    if not user_data:
-        return web.json_response({"error": "user_not_found"}, status=404)
-
-    user_id = user_data["user_id"]
+@endpoint()
+async def getPaymentHistory(httpRequest, ctx):
+    user_id = ctx.user_id
 
     query = """SELECT payment_id, purchase_token, product_id, amount, currency_awarded, verified, created
                FROM payments WHERE user_id = ? ORDER BY created DESC LIMIT 100"""
-    payments = execute_query(query, (user_id,), fetch_all=True)
+    payments = await execute_query_async(query, (user_id,), fetch_all=True)
 
     result = []
     for p in payments:
@@ -1457,24 +1314,20 @@ async def getPaymentHistory(httpRequest):
             "created": p[6]
         })
 
-    return web.json_response({"success": True, "data": result})
-
-async def vmStartupLog(httpRequest):
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
+    return json_response({"success": True, "data": result})
 
-    access_key = requestData.get("access_key")
+@endpoint(auth=False)
+async def vmStartupLog(httpRequest, ctx):
+    access_key = ctx.body.get("access_key")
     if access_key != DATASTORE_PASSWORD:
-        return web.json_response({"error": "unauthorized"}, status=403)
+        return json_response({"error": "unauthorized"}, status=403)
 
-    vm_id = requestData.get("vm_id")
-    message = requestData.get("message")
+    vm_id = ctx.body.get("vm_id")
+    message = ctx.body.get("message")
 
     print(f"[VM {vm_id[:8]}] {message}")
 
-    return web.json_response({"success": True})
+    return json_response({"success": True})
 
 # I was bored and i did this idk
 async def middleware404(app, handler):
@@ -1482,47 +1335,41 @@ async def middleware404(app, handler):
         try:
             response = await handler(request)
             if response.status in [404]:
-                with open("404.html", "r") as f:
-                    return web.Response(text=f.read(), content_type="text/html", status=response.status)
+                return pageResponse(request, "404.html", status=response.status)
             return response
         except web.HTTPException as ex:
             if ex.status in [404]:
-                with open("404.html", "r") as f:
-                    return web.Response(text=f.read(), content_type="text/html", status=ex.status)
+                return pageResponse(request, "404.html", status=ex.status)
             raise
         except Exception:
             return web.Response(status=500, text="Internal Server Error")
     return middleware_handler
 
-async def adminCreditCurrency(httpRequest):
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    session_token = requestData.get("session_token")
+@endpoint(auth=False)
+async def adminCreditCurrency(httpRequest, ctx):
+    session_token = ctx.body.get("session_token")
     if not verify_dashboard_session(session_token):
-        return web.json_response({"error": "unauthorized"}, status=401)
+        return json_response({"error": "unauthorized"}, status=401)
 
-    user_id = requestData.get("user_id")
-    amount = requestData.get("amount")
+    user_id = ctx.body.get("user_id")
+    amount = ctx.body.get("amount")
 
     if not user_id or not amount:
-        return web.json_response({"error": "missing_required_fields"}, status=400)
+        return json_response({"error": "missing_required_fields"}, status=400)
 
     try:
         amount = int(amount)
         user_id = int(user_id)
     except:
-        return web.json_response({"error": "invalid_amount_or_user_id"}, status=400)
+        return json_response({"error": "invalid_amount_or_user_id"}, status=400)
 
     if amount <= 0:
-        return web.json_response({"error": "amount_must_be_positive"}, status=400)
+        return json_response({"error": "amount_must_be_positive"}, status=400)
 
     from currency_system import creditCurrency
     result = await creditCurrency(user_id, amount)
 
-    return web.json_response(result)
+    return json_response(result)
 
 async def updateAccessoryEndpoint(httpRequest):
     try:
@@ -1547,26 +1394,27 @@ async def updateAccessoryEndpoint(httpRequest):
                     filenames[field.name] = field.filename
 
         if not session_token or not verify_dashboard_session(session_token):
-            return web.json_response({"error": "unauthorized"}, status=401)
+            return json_response({"error": "unauthorized"}, status=401)
 
         if not accessory_id:
-            return web.json_response({"error": "missing_accessory_id"}, status=400)
+            return json_response({"error": "missing_accessory_id"}, status=400)
 
         try:
             accessory_id = int(accessory_id)
         except:
-            return web.json_response({"error": "invalid_accessory_id"}, status=400)
+            return json_response({"error": "invalid_accessory_id"}, status=400)
 
         price = None
         if "price" in fields:
             try:
                 price = int(fields["price"])
             except:
-                return web.json_response({"error": "invalid_price"}, status=400)
+                return json_response({"error": "invalid_price"}, status=400)
 
         from avatar_service import updateAccessoryFromDashboard
 
-        result = updateAccessoryFromDashboard(
+        result = await run_in_db(
+            updateAccessoryFromDashboard,
             accessory_id=accessory_id,
             name=fields.get("name"),
             accessory_type=fields.get("type"),
@@ -1581,38 +1429,34 @@ async def updateAccessoryEndpoint(httpRequest):
             mtl_filename=filenames.get("mtl")
         )
 
-        return web.json_response(result)
+        return json_response(result)
 
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return web.json_response({"error": str(e)}, status=400)
+        return json_response({"error": str(e)}, status=400)
 
 async def getServerVersion(httpRequest):
     version = get_current_binary_version()
-    return web.json_response({
+    return json_response({
         "success": True,
         "version": version,
         "required_version": CURRENT_SERVER_VERSION
     })
 
-async def checkClientVersion(httpRequest):
-    try:
-        requestData = await httpRequest.json()
-    except:
-        return web.json_response({"error": "invalid_json"}, status=400)
-
-    client_version = requestData.get("version", "")
+@endpoint(auth=False)
+async def checkClientVersion(httpRequest, ctx):
+    client_version = ctx.body.get("version", "")
 
     if client_version != CURRENT_SERVER_VERSION:
-        return web.json_response({
+        return json_response({
             "success": False,
             "update_required": True,
             "current_version": CURRENT_SERVER_VERSION,
             "client_version": client_version
         }, status=426)
 
-    return web.json_response({
+    return json_response({
         "success": True,
         "update_required": False
     })
@@ -1633,10 +1477,10 @@ async def uploadBinaryEndpoint(httpRequest):
                 binary_data = await field.read()
 
         if not session_token or not verify_dashboard_session(session_token):
-            return web.json_response({"error": "unauthorized"}, status=401)
+            return json_response({"error": "unauthorized"}, status=401)
 
         if not version or not binary_data:
-            return web.json_response({"error": "missing_required_fields"}, status=400)
+            return json_response({"error": "missing_required_fields"}, status=400)
 
         os.makedirs(BINARIES_DIR, exist_ok=True)
 
@@ -1648,28 +1492,23 @@ async def uploadBinaryEndpoint(httpRequest):
 
         set_binary_version(version)
 
-        return web.json_response({
+        return json_response({
             "success": True,
             "version": version,
             "message": "Binary uploaded successfully"
         })
 
     except Exception as e:
-        return web.json_response({"error": str(e)}, status=400)
-
-async def downloadBinary(httpRequest):
-    try:
-        requestData = await httpRequest.json()
-    except:
-        print("Download binary: Invalid JSON")
-        return web.json_response({"error": "invalid_json"}, status=400)
+        return json_response({"error": str(e)}, status=400)
 
-    access_key = requestData.get("access_key")
+@endpoint(auth=False)
+async def downloadBinary(httpRequest, ctx):
+    access_key = ctx.body.get("access_key")
     print(f"Binary download request with access_key: {access_key[:10]}... from {httpRequest.remote}")
 
     if access_key != DATASTORE_PASSWORD:
         print(f"Unauthorized binary download attempt from {httpRequest.remote}")
-        return web.json_response({"error": "unauthorized"}, status=403)
+        return json_response({"error": "unauthorized"}, status=403)
 
     binary_path = GODOT_SERVER_BIN
     if not os.path.exists(binary_path):
@@ -1678,37 +1517,31 @@ async def downloadBinary(httpRequest):
 
     if not os.path.exists(binary_path):
         print(f"Binary not found at {binary_path}")
-        return web.json_response({"error": "binary_not_found"}, status=404)
+        return json_response({"error": "binary_not_found"}, status=404)
 
     file_size = os.path.getsize(binary_path)
     print(f"Serving binary: {binary_path} ({file_size} bytes) to {httpRequest.remote}")
 
     return web.FileResponse(binary_path)
 
-def shutdownHandler(signalNum, frameObj):
-    with shutdown_lock:
-        try:
-            loop = asyncio.get_event_loop()
-            loop.run_until_complete(save_tracker.wait_for_all_saves(timeout=30.0))
-            flush_write_buffer()
-        except:
-            pass
-    os._exit(0)
-
-signal.signal(signal.SIGINT, shutdownHandler)
-signal.signal(signal.SIGTERM, shutdownHandler)
+# on_shutdown, runs when a drain starts (handoff.py). 1012 tells clients
+# to reconnect, which lands them on the new process after a reload
+async def closeMessageSockets(app):
+    for ws in list(message_connections.values()):
+        await ws.close(code=aiohttp.WSCloseCode.SERVICE_RESTART, message=b"server restarting")
 
 async def startApp():
+    ensure_volume_directories()
     os.makedirs(os.path.join(VOLUME_PATH, "pfps"), exist_ok=True)
     os.makedirs(os.path.join(VOLUME_PATH, "models"), exist_ok=True)
     os.makedirs(os.path.join(VOLUME_PATH, "accessories"), exist_ok=True)
     os.makedirs(os.path.join(VOLUME_PATH, "icons"), exist_ok=True)
 
-    master_vm_id = f"main-{SERVER_PUBLIC_IP}"
+    master_vm_id = f"main-{get_server_public_ip()}"
     async with vm_registry_lock:
         vm_registry[master_vm_id] = {
             "vm_id": master_vm_id,
-            "ip": SERVER_PUBLIC_IP,
+            "ip": get_server_public_ip(),
             "last_heartbeat": time.time(),
             "servers": {},
             "total_players": 0,
@@ -1728,11 +1561,15 @@ async def startApp():
                 return web.Response(status=500, text="Internal Server Error")
         return middleware_handler
 
-    webApp = web.Application(middlewares=[error_middleware,middleware404])
+    middlewares = [metrics_middleware,handoff.drain_middleware,error_middleware,compression_middleware,rate_limit_middleware,middleware404]
+    if shared_state.enabled:
+        middlewares.insert(2, primary_forward_middleware)
+    webApp = web.Application(middlewares=middlewares)
     webApp.add_routes([
         web.post("/auth/register", registerUser),
         web.post("/auth/login", loginUser),
         web.post("/auth/validate", validateTokenEndpoint),
+        web.post("/auth/logout", logoutUser),
         web.post("/auth/register_with_captcha", registerUserWithCaptcha),
 
         web.post("/datastore/set", setDatastore),
@@ -1758,6 +1595,10 @@ async def startApp():
 
         web.get("/dashboard", dashboardView),
         web.post("/api/dashboard", getDashboardData),
+        web.post("/api/dashboard/queries", getQueryStats),
+        web.post("/dashboard/backups", getBackups),
+        web.post("/dashboard/backups/run", runBackup),
+        web.post("/dashboard/backups/verify", verifyBackup),
         web.post("/dashboard/login", dashboardLogin),
         web.post("/dashboard/send_message", sendGlobalMessage),
         web.post("/dashboard/set_maintenance", setMaintenanceMode),
@@ -1780,10 +1621,13 @@ async def startApp():
         web.post("/vm/startup_log", vmStartupLog),
 
         web.get("/version", getServerVersion),
+        web.get("/metrics", metricsView),
         web.post("/check_version", checkClientVersion),
     ])
 
     addNewRoutes(webApp)
+    addBatchRoute(webApp)
+    webApp.on_shutdown.append(closeMessageSockets)
 
     webApp.router.add_static("/pfps/", os.path.join(VOLUME_PATH, "pfps"))
     webApp.router.add_static("/models/", os.path.join(VOLUME_PATH, "models"))
@@ -1791,10 +1635,14 @@ async def startApp():
     webApp.router.add_static("/icons/", os.path.join(VOLUME_PATH, "icons"))
     webApp.router.add_static("/public/", "./public")
 
-    asyncio.create_task(cleanupTask())
-    asyncio.create_task(vm_lifecycle_monitor())
-    asyncio.create_task(save_tracker_monitor())
-    asyncio.create_task(cleanup_empty_master_servers())
+    # cancelled when a drain starts, the next process runs its own
+    background_tasks.append(asyncio.create_task(cleanupTask()))
+    background_tasks.append(asyncio.create_task(save_tracker_monitor()))
+    background_tasks.append(asyncio.create_task(loop_lag_monitor()))
+    if shared_state.is_primary():
+        background_tasks.append(asyncio.create_task(vm_lifecycle_monitor()))
+        background_tasks.append(asyncio.create_task(cleanup_empty_master_servers()))
+        background_tasks.append(asyncio.create_task(backup_loop()))
     return webApp
 
 if __name__ == "__main__":
@@ -1803,28 +1651,35 @@ if __name__ == "__main__":
     os.makedirs("accessories", exist_ok=True)
     os.makedirs("icons", exist_ok=True)
 
+    if MASTER_WORKERS > 1 and not shared_state.enabled:
+        asyncio.run(runSupervisor(os.path.abspath(__file__)))
+        os._exit(0)
+
+    atexit.register(emergencyShutdown)
+
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
 
     async def run_server():
+        await runStartup()
+        if shared_state.enabled:
+            await shared_state.connect(COORDINATOR_SOCKET)
         app = await startApp()
-        runner = web.AppRunner(app)
+        runner = web.AppRunner(app, shutdown_timeout=RELOAD_DRAIN_TIMEOUT)
         await runner.setup()
-        site = web.TCPSite(runner, '0.0.0.0', 8080)
-        await site.start()
+        listen_sock = handoff.listeningSocket('0.0.0.0', 8080, reuse_port=shared_state.enabled)
+        await web.SockSite(runner, listen_sock).start()
+        if shared_state.enabled and shared_state.is_primary():
+            await startPrimarySocket(runner)
 
-        print(f"Server started on {get_public_ip()}:8080")
+        print(f"Server started on {get_server_public_ip()}:8080")
 
-        try:
-            while True:
-                await asyncio.sleep(3600)
-        except KeyboardInterrupt:
-            print("Shutting down...")
-            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
-            for task in tasks:
-                task.cancel()
-            await asyncio.gather(*tasks, return_exceptions=True)
-            await runner.cleanup()
+        await handoff.serve(runner, os.path.abspath(__file__), listen_sock, background_tasks)
+        print("Shutdown complete")
+        sys.stdout.flush()
+        # saves are done. skip interpreter teardown, it would kill the game
+        # servers this process started (asyncio closes their transports)
+        os._exit(0)
 
     try:
         loop.run_until_complete(run_server())
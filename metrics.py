@@ -0,0 +1,220 @@
+import hmac
+import time
+import asyncio
+from bisect import bisect_left
+from typing import Any, Dict, List, Tuple
+from aiohttp import web
+
+import auth_utils
+import static_pages
+import response_compression
+from database_manager import get_read_pool_stats, group_writer, get_shard_stats
+from config import METRICS_TOKEN, LOOP_LAG_INTERVAL
+
+# request metrics per (method, route) and a few process wide gauges, served
+# as prometheus text on /metrics and summarized in the dashboard json.
+# everything here is only touched from the event loop thread, so counters
+# are plain ints in preallocated lists, no locks on the request path
+
+# prometheus "le" bounds in seconds, the last bucket is +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# anything the router didn't match (scanners) shares one series
+UNMATCHED_ROUTE = "unmatched"
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "total", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    # upper bound of the bucket the percentile falls in, the +Inf bucket
+    # reports the largest bound
+    def percentile(self, pct: float) -> float:
+        target = self.count * pct
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= target:
+                return self.bounds[min(i, len(self.bounds) - 1)]
+        return 0.0
+
+    def samples(self, name: str, labels: str) -> List[str]:
+        lines = []
+        seen = 0
+        sep = "," if labels else ""
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {seen}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.total}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+class RouteMetrics:
+    __slots__ = ("statuses", "in_flight", "latency")
+
+    def __init__(self):
+        # 1xx..5xx
+        self.statuses = [0] * 5
+        self.in_flight = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+
+route_metrics: Dict[Tuple[str, str], RouteMetrics] = {}
+loop_lag = Histogram(LAG_BUCKETS)
+loop_lag_state = {"last": 0.0, "max": 0.0}
+started = time.time()
+
+def routeMetrics(request) -> RouteMetrics:
+    resource = request.match_info.route.resource
+    # scanners send any method they like, keep them to one series
+    key = (request.method, resource.canonical) if resource is not None else ("*", UNMATCHED_ROUTE)
+    metrics = route_metrics.get(key)
+    if metrics is None:
+        metrics = route_metrics[key] = RouteMetrics()
+    return metrics
+
+# outermost middleware, so the status is the one the client got (500s from
+# error_middleware included)
+async def metrics_middleware(app, handler):
+    async def middleware_handler(request):
+        metrics = routeMetrics(request)
+        metrics.in_flight += 1
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as ex:
+            status = ex.status
+            raise
+        finally:
+            metrics.in_flight -= 1
+            metrics.latency.observe(time.perf_counter() - start)
+            metrics.statuses[min(max(status // 100, 1), 5) - 1] += 1
+    return middleware_handler
+
+# how late a LOOP_LAG_INTERVAL sleep wakes up is how long something held the loop
+async def loop_lag_monitor():
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(loop.time() - start - LOOP_LAG_INTERVAL, 0.0)
+        loop_lag.observe(lag)
+        loop_lag_state["last"] = lag
+        loop_lag_state["max"] = max(loop_lag_state["max"], lag)
+
+def hitRatio(hits, misses) -> float:
+    total = hits + misses
+    return round(hits / total, 4) if total else 0.0
+
+# (name, type, help, value) gauges and counters pulled from the other
+# modules' stats at scrape time
+def collectorSamples() -> List[Tuple[str, str, str, float]]:
+    samples = []
+    sessions = auth_utils.get_token_cache_stats()
+    samples += [
+        ("session_cache_hits_total", "counter", "session lookups answered from memory", sessions["hits"]),
+        ("session_cache_misses_total", "counter", "session lookups that went to the db", sessions["misses"]),
+        ("session_cache_negative_hits_total", "counter", "unknown tokens answered from memory", sessions["negative_hits"]),
+        ("session_cache_size", "gauge", "sessions cached", sessions["size"]),
+        ("session_cache_hit_ratio", "gauge", "session cache hit ratio",
+         hitRatio(sessions["hits"] + sessions["negative_hits"], sessions["misses"])),
+    ]
+    pages = static_pages.static_page_stats
+    samples.append(("static_page_not_modified_total", "counter", "static page 304s", pages["not_modified"]))
+    samples.append(("static_page_reloads_total", "counter", "static pages read from disk", pages["reloads"]))
+    saved = sum(stats["bytes_in"] - stats["bytes_out"] for stats in response_compression.compression_stats.values())
+    samples.append(("compression_bytes_saved_total", "counter", "response bytes saved by compression", saved))
+    passwords = auth_utils.get_password_pool_stats()
+    samples.append(("password_hash_pending", "gauge", "password hashes queued or running", passwords["pending"]))
+    samples.append(("db_read_connections", "gauge", "sqlite read pool connections", get_read_pool_stats()["connections"]))
+    writer = group_writer.get_stats()
+    samples.append(("db_write_queue", "gauge", "writes waiting for the group commit", writer["queued"]))
+    samples.append(("db_write_batches_total", "counter", "group commit transactions", writer["batches"]))
+    samples.append(("db_write_ops_total", "counter", "writes through the group commit", writer["ops"]))
+    for shard in get_shard_stats():
+        samples.append((f'db_shard_write_queue{{shard="{shard["index"]}"}}', "gauge", "writes waiting per shard",
+                        shard["writer"]["queued"]))
+    samples.append(("event_loop_lag_seconds_max", "gauge", "worst event loop lag seen", loop_lag_state["max"]))
+    samples.append(("uptime_seconds", "gauge", "seconds since start", time.time() - started))
+    return samples
+
+def escapeLabel(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def renderMetrics() -> str:
+    lines = [
+        "# HELP http_requests_total requests by route and status class",
+        "# TYPE http_requests_total counter",
+    ]
+    routes = sorted(route_metrics.items())
+    for (method, route), metrics in routes:
+        labels = f'method="{method}",route="{escapeLabel(route)}"'
+        for i, n in enumerate(metrics.statuses):
+            if n:
+                lines.append(f'http_requests_total{{{labels},status="{i + 1}xx"}} {n}')
+    lines += ["# HELP http_requests_in_flight requests being handled", "# TYPE http_requests_in_flight gauge"]
+    for (method, route), metrics in routes:
+        lines.append(f'http_requests_in_flight{{method="{method}",route="{escapeLabel(route)}"}} {metrics.in_flight}')
+    lines += ["# HELP http_request_duration_seconds request latency", "# TYPE http_request_duration_seconds histogram"]
+    for (method, route), metrics in routes:
+        lines += metrics.latency.samples("http_request_duration_seconds", f'method="{method}",route="{escapeLabel(route)}"')
+    lines += ["# HELP event_loop_lag_seconds event loop wakeup delay", "# TYPE event_loop_lag_seconds histogram"]
+    lines += loop_lag.samples("event_loop_lag_seconds", "")
+    described = set()
+    for name, kind, description, value in collectorSamples():
+        base = name.partition("{")[0]
+        if base not in described:
+            described.add(base)
+            lines += [f"# HELP {base} {description}", f"# TYPE {base} {kind}"]
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+# loopback and our VMs can scrape, anyone else needs METRICS_TOKEN as a bearer token
+async def metricsView(request):
+    if not auth_utils.isServerIp(request.remote):
+        expected = f"Bearer {METRICS_TOKEN}"
+        if not METRICS_TOKEN or not hmac.compare_digest(request.headers.get("Authorization", ""), expected):
+            return web.Response(status=401, text="unauthorized")
+    return web.Response(text=renderMetrics(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Prometheus-Format": "0.0.4"})
+
+# dashboard json, busiest routes first
+def get_request_metrics_summary(limit: int = 50) -> Dict[str, Any]:
+    uptime = max(time.time() - started, 1.0)
+    routes = []
+    for (method, route), metrics in route_metrics.items():
+        count = metrics.latency.count
+        routes.append({
+            "method": method,
+            "route": route,
+            "count": count,
+            "rps": round(count / uptime, 3),
+            "in_flight": metrics.in_flight,
+            "status": {f"{i + 1}xx": n for i, n in enumerate(metrics.statuses) if n},
+            "error_rate": round(metrics.statuses[4] / count, 4) if count else 0.0,
+            "avg_ms": round(metrics.latency.total * 1000 / count, 3) if count else 0.0,
+            "p50_ms": metrics.latency.percentile(0.50) * 1000,
+            "p95_ms": metrics.latency.percentile(0.95) * 1000,
+            "p99_ms": metrics.latency.percentile(0.99) * 1000,
+        })
+    routes.sort(key=lambda item: item["count"], reverse=True)
+    return {
+        "uptime": round(uptime, 1),
+        "in_flight": sum(metrics.in_flight for metrics in route_metrics.values()),
+        "loop_lag_ms": {"last": round(loop_lag_state["last"] * 1000, 3), "max": round(loop_lag_state["max"] * 1000, 3),
+                        "p99": loop_lag.percentile(0.99) * 1000},
+        "routes": routes[:limit],
+    }
@@ -1,23 +1,29 @@
-import joblib
 import os
 import subprocess
 from aiohttp import web
 import pathlib
 import json
 
-print("booting moderation server")
-
 current_dir = pathlib.Path(__file__).parent.resolve()
 model_file = current_dir / "model.pkl"
 vectorized_file = current_dir / "model_vectorizer.pkl"
 
-if not model_file.exists() or not vectorized_file.exists():
-    print("training cuz we dont find ai")
-    subprocess.run(["python3", str(current_dir / "train.py")], check=True)
+# filled in by loadModeration(), startup.py runs it in a thread. until then
+# /moderation answers 503
+loaded_model = None
+vectorizer = None
+
+def loadModeration():
+    global loaded_model, vectorizer
+    import joblib
+    if not model_file.exists() or not vectorized_file.exists():
+        print("training cuz we dont find ai")
+        subprocess.run(["python3", str(current_dir / "train.py")], check=True)
 
-print("== Loading Models ==")
-loaded_model = joblib.load(model_file)
-vectorizer = joblib.load(vectorized_file)
+    print("== Loading Models ==")
+    model = joblib.load(model_file)
+    vectorizer = joblib.load(vectorized_file)
+    loaded_model = model
 
 API_KEY = ""
 
@@ -40,6 +46,9 @@ async def moderationRun(request):
 
     text = request_json['text']
 
+    if loaded_model is None:
+        return web.json_response({'error': 'Moderation model is still loading'}, status=503, headers={"Retry-After": "5"})
+
     try:
         new_data_vectorized = vectorizer.transform([text])
         probabilities = loaded_model.predict_proba(new_data_vectorized)
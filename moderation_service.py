@@ -1,6 +1,6 @@
 import re
 import requests
-from config import get_public_ip
+from config import get_server_public_ip
 from typing import Dict, Any
 
 USERNAME_PATTERN = re.compile(r'^[a-zA-Z0-9_]+$')
@@ -9,8 +9,8 @@ BLOCKED_WORDS = [
     "admin", "moderator", "support", "official", "staff"
 ]
 
-public_ip = get_public_ip()
-MODERATION_API_URL = f"http://{public_ip}:8080/moderation"
+def moderation_api_url() -> str:
+    return f"http://{get_server_public_ip()}:8080/moderation"
 
 def check_text_content(text: str) -> Dict[str, Any]:
     if not text:
@@ -44,7 +44,7 @@ def check_text_content(text: str) -> Dict[str, Any]:
 
     try:
         response = requests.post(
-            MODERATION_API_URL,
+            moderation_api_url(),
             json={"text": text},
             timeout=5
         )
@@ -3,12 +3,15 @@ import json
 import hashlib
 import time
 import asyncio
+import sqlite3
 from typing import Dict, Any, Optional
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from config import GOOGLE_PLAY_PACKAGE_NAME, GOOGLE_SERVICE_ACCOUNT_JSON
-from database_manager import execute_query
+from database_manager import execute_query_async
+from game_database import SAVE_PAYMENT_QUERY, SAVE_AD_REWARD_QUERY
 from currency_system import creditCurrency
+from player_data import invalidate_player_cache
 
 CURRENCY_PACKAGES = {
     "currency_500": {"amount": 500, "price_usd": 4.99},
@@ -57,7 +60,7 @@ async def save_pending_payment(user_id: int, product_id: str, purchase_token: st
 
         query = """INSERT INTO pending_payments (payment_id, user_id, product_id, purchase_token, attempts, created)
                    VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(payment_id) DO UPDATE SET attempts = attempts"""
-        execute_query(query, (payment_id, user_id, product_id, purchase_token, 0, time.time()))
+        await execute_query_async(query, (payment_id, user_id, product_id, purchase_token, 0, time.time()))
 
         return payment_id
 
@@ -67,11 +70,11 @@ async def remove_pending_payment(payment_id: str):
             del pending_payments[payment_id]
 
         query = "DELETE FROM pending_payments WHERE payment_id = ?"
-        execute_query(query, (payment_id,))
+        await execute_query_async(query, (payment_id,))
 
 async def load_pending_payments():
     query = "SELECT payment_id, user_id, product_id, purchase_token, attempts, created FROM pending_payments"
-    results = execute_query(query, fetch_all=True)
+    results = await execute_query_async(query, fetch_all=True)
 
     if results:
         async with pending_payments_lock:
@@ -95,7 +98,7 @@ async def verify_google_play_purchase(user_id: int, product_id: str, purchase_to
         }
 
     query = "SELECT payment_id FROM payments WHERE purchase_token = ?"
-    existing = execute_query(query, (purchase_token,), fetch_one=True)
+    existing = await execute_query_async(query, (purchase_token,), fetch_one=True)
     if existing:
         return {
             "success": False,
@@ -133,23 +136,24 @@ async def verify_google_play_purchase(user_id: int, product_id: str, purchase_to
 
         currency_amount = CURRENCY_PACKAGES[product_id]["amount"]
 
-        credit_result = await creditCurrency(user_id, currency_amount)
+        # the payment row commits with the credit, so the UNIQUE purchase_token
+        # stops a token from being credited twice (retry loop vs client resend)
+        try:
+            credit_result = await creditCurrency(user_id, currency_amount, extra_statements=[
+                (SAVE_PAYMENT_QUERY, (user_id, purchase_token, product_id,
+                                      int(CURRENCY_PACKAGES[product_id]["price_usd"] * 100),
+                                      currency_amount, True, time.time()))
+            ])
+        except sqlite3.IntegrityError:
+            invalidate_player_cache(user_id)
+            return {
+                "success": False,
+                "error": {"code": "ALREADY_PROCESSED", "message": "Purchase already processed"}
+            }
 
         if not credit_result["success"]:
             return credit_result
 
-        query = """INSERT INTO payments (user_id, purchase_token, product_id, amount, currency_awarded, verified, created)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)"""
-        execute_query(query, (
-            user_id,
-            purchase_token,
-            product_id,
-            int(CURRENCY_PACKAGES[product_id]["price_usd"] * 100),
-            currency_amount,
-            True,
-            time.time()
-        ))
-
         asyncio.create_task(consume_purchase_async(service, product_id, purchase_token))
 
         return {
@@ -218,15 +222,13 @@ async def verify_ad_reward(user_id: int, ad_network: str, ad_unit_id: str,
             "error": {"code": "INVALID_AMOUNT", "message": "Reward amount exceeds maximum"}
         }
 
-    credit_result = await creditCurrency(user_id, reward_amount)
+    credit_result = await creditCurrency(user_id, reward_amount, extra_statements=[
+        (SAVE_AD_REWARD_QUERY, (user_id, ad_network, ad_unit_id, reward_amount, True, time.time()))
+    ])
 
     if not credit_result["success"]:
         return credit_result
 
-    query = """INSERT INTO ad_rewards (user_id, ad_network, ad_unit_id, reward_amount, verified, created)
-               VALUES (?, ?, ?, ?, ?, ?)"""
-    execute_query(query, (user_id, ad_network, ad_unit_id, reward_amount, True, time.time()))
-
     ad_reward_cooldowns[user_id] = current_time
 
     return {
@@ -262,7 +264,7 @@ async def retry_pending_payments():
                     pending_payments[payment_id]["last_attempt"] = time.time()
 
                 query = "UPDATE pending_payments SET attempts = ?, last_attempt = ? WHERE payment_id = ?"
-                execute_query(query, (pending_payments[payment_id]["attempts"], time.time(), payment_id))
+                await execute_query_async(query, (pending_payments[payment_id]["attempts"], time.time(), payment_id))
 
                 result = await verify_google_play_purchase(
                     payment_data["user_id"],
@@ -6,7 +6,7 @@ import asyncio
 import platform
 from PIL import Image
 from typing import Optional, Dict, Any
-from config import SERVER_PUBLIC_IP, GODOT_SERVER_BIN, VOLUME_PATH
+from config import get_server_public_ip, GODOT_SERVER_BIN, VOLUME_PATH
 
 PFPS_DIR = os.path.join(VOLUME_PATH, "pfps")
 IS_WINDOWS = platform.system() == "Windows"
@@ -202,12 +202,14 @@ async def pfp_worker():
 
 async def updateUserPfp(userId: int, force: bool = False) -> str:
     from avatar_service import getFullAvatar
-    from player_data import getPlayerData, savePlayerData
+    from player_data import getPlayerDataAsync, savePlayerData
 
+    # warms the player cache so getFullAvatar/getPfp below stay off the db
+    await getPlayerDataAsync(userId)
     avatarData = getFullAvatar(userId)
 
     if not force:
-        playerData = getPlayerData(userId)
+        playerData = await getPlayerDataAsync(userId)
         if playerData:
             current_hash = playerData.get("avatar_hash")
             new_hash = avatar_hash(avatarData)
@@ -220,28 +222,28 @@ async def updateUserPfp(userId: int, force: bool = False) -> str:
 
     if pfp_queue.qsize() >= MAX_CONCURRENT_RENDERS * 2:
         print(f"PFP queue full, using existing PFP for user {userId}")
-        playerData = getPlayerData(userId)
+        playerData = await getPlayerDataAsync(userId)
         if playerData and playerData.get("pfp"):
             return playerData["pfp"]
 
     newPfpPath = await generatePfp(userId, avatarData)
 
-    playerData = getPlayerData(userId)
+    playerData = await getPlayerDataAsync(userId)
     if playerData:
         port = os.environ.get('PORT', 8080)
         relative_path = os.path.relpath(newPfpPath, VOLUME_PATH)
-        playerData["pfp"] = f"http://{SERVER_PUBLIC_IP}:{port}/{relative_path}"
+        playerData["pfp"] = f"http://{get_server_public_ip()}:{port}/{relative_path}"
         playerData["avatar_hash"] = avatar_hash(avatarData)
         await savePlayerData(userId, playerData)
 
     return newPfpPath
 
 def getPfp(userId: int) -> str:
-    from player_data import getPlayerData
+    from player_data import getPlayerRow
 
-    playerData = getPlayerData(userId)
-    if playerData and "pfp" in playerData:
-        return playerData["pfp"]
+    row = getPlayerRow(userId)
+    if row:
+        return row.pfp
 
     defaultPfpPath = os.path.join(PFPS_DIR, "default.png")
     if not os.path.exists(defaultPfpPath):
@@ -263,7 +265,7 @@ def getPfp(userId: int) -> str:
 
     port = os.environ.get('PORT', 8080)
     relative_path = os.path.relpath(defaultPfpPath, VOLUME_PATH)
-    return f"http://{SERVER_PUBLIC_IP}:{port}/{relative_path}"
+    return f"http://{get_server_public_ip()}:{port}/{relative_path}"
 
 def cleanupOldPfps(userId: int, keepRecent: int = 5):
     ensurePfpDirectory()
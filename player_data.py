@@ -2,20 +2,27 @@ import os
 import json
 import time
 import asyncio
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 from config import (
-    SERVER_PUBLIC_IP,
+    get_server_public_ip,
     VOLUME_PATH,
     CACHE_TTL
 )
 from game_database import (
+    PlayerRow,
     get_player_data as fb_get_player_data,
-    save_player_data as fb_save_player_data,
-    get_friends as fb_get_friends
+    get_friends as fb_get_friends,
+    get_player_data_async as fb_get_player_data_async,
+    save_player_data_async as fb_save_player_data_async,
+    set_player_server_async as fb_set_player_server_async,
+    get_friends_async as fb_get_friends_async
 )
 from player_save_tracker import save_tracker
+import shared_state
 
 player_cache = {}
+# bumped on every drop, a row read before the drop isn't cached after it
+player_cache_generation = {}
 
 DEFAULT_PLAYER_SCHEMA = {
     "schemaVersion": 1,
@@ -33,14 +40,16 @@ DEFAULT_PLAYER_SCHEMA = {
         },
         "accessories": []
     },
-    "pfp": f"http://{SERVER_PUBLIC_IP}:{os.environ.get('PORT', 8080)}/pfps/default.png",
     "serverId": None,
     "private_server_active": False,
     "private_server_expires": 0
 }
 
-def ensurePlayerDataDefaults(playerData: Dict[str, Any]) -> Dict[str, Any]:
-    result = playerData.copy()
+# not in DEFAULT_PLAYER_SCHEMA, the public ip isn't known at import
+def defaultPfpUrl() -> str:
+    return f"http://{get_server_public_ip()}:{os.environ.get('PORT', 8080)}/pfps/default.png"
+
+def _applyPlayerDefaults(result: Dict[str, Any]) -> Dict[str, Any]:
     def applyDefaults(data: Dict[str, Any], defaults: Dict[str, Any]) -> Dict[str, Any]:
         for key, defaultValue in defaults.items():
             if key not in data:
@@ -53,41 +62,87 @@ def ensurePlayerDataDefaults(playerData: Dict[str, Any]) -> Dict[str, Any]:
                 applyDefaults(data[key], defaultValue)
         return data
     result = applyDefaults(result, DEFAULT_PLAYER_SCHEMA)
+    if "pfp" not in result:
+        result["pfp"] = defaultPfpUrl()
     if result.get("schemaVersion", 0) < DEFAULT_PLAYER_SCHEMA["schemaVersion"]:
         result["schemaVersion"] = DEFAULT_PLAYER_SCHEMA["schemaVersion"]
     return result
 
-def getPlayerData(userId: int) -> Optional[Dict[str, Any]]:
-    currentTime = time.time()
+def ensurePlayerDataDefaults(playerData: Dict[str, Any]) -> Dict[str, Any]:
+    return _applyPlayerDefaults(playerData.copy())
+
+def _getCachedPlayerRow(userId: int, currentTime: float) -> Optional[PlayerRow]:
     cacheKey = f"player_{userId}"
     if cacheKey in player_cache:
-        cached_data, expiry = player_cache[cacheKey]
+        cached_row, expiry = player_cache[cacheKey]
         if currentTime < expiry:
-            return ensurePlayerDataDefaults(cached_data)
+            return cached_row
         else:
             del player_cache[cacheKey]
+    return None
 
-    data = fb_get_player_data(userId)
-
-    if data:
-        if "ownedAccessories" in data and isinstance(data["ownedAccessories"], str):
-            try:
-                data["ownedAccessories"] = json.loads(data["ownedAccessories"])
-            except:
-                data["ownedAccessories"] = []
+# the json columns are parsed once here. every reader shares the cached row,
+# so avatar_data / owned_accessories must not be modified in place, to_dict()
+# copies them
+def _cachePlayerRow(userId: int, row: PlayerRow, currentTime: float, generation: int) -> PlayerRow:
+    try:
+        ownedAccessories = json.loads(row.owned_accessories or "[]")
+    except:
+        ownedAccessories = []
 
-        if "avatar" in data and isinstance(data["avatar"], str):
-            try:
-                data["avatar"] = json.loads(data["avatar"])
-            except:
-                data["avatar"] = DEFAULT_PLAYER_SCHEMA["avatar"]
+    try:
+        avatar = json.loads(row.avatar_data or "{}")
+    except:
+        avatar = DEFAULT_PLAYER_SCHEMA["avatar"]
 
-        player_cache[cacheKey] = (data, currentTime + CACHE_TTL)
-        return ensurePlayerDataDefaults(data)
+    row = row._replace(avatar_data=avatar, owned_accessories=ownedAccessories)
+    cacheKey = f"player_{userId}"
+    # reads run on the db executor, so an invalidate (a credit, a purchase)
+    # can land while they are in flight. checked again after storing in case
+    # it lands in between
+    if player_cache_generation.get(cacheKey, 0) == generation:
+        entry = player_cache[cacheKey] = (row, currentTime + CACHE_TTL)
+        if player_cache_generation.get(cacheKey, 0) != generation and player_cache.get(cacheKey) is entry:
+            player_cache.pop(cacheKey, None)
+    return row
+
+# read only access for helpers that just want a field or two (currency, pfp...)
+def getPlayerRow(userId: int) -> Optional[PlayerRow]:
+    currentTime = time.time()
+    row = _getCachedPlayerRow(userId, currentTime)
+    if row is not None:
+        return row
+
+    generation = player_cache_generation.get(f"player_{userId}", 0)
+    row = fb_get_player_data(userId)
+    if row:
+        return _cachePlayerRow(userId, row, currentTime, generation)
+    return None
 
+async def getPlayerRowAsync(userId: int) -> Optional[PlayerRow]:
+    currentTime = time.time()
+    row = _getCachedPlayerRow(userId, currentTime)
+    if row is not None:
+        return row
+
+    generation = player_cache_generation.get(f"player_{userId}", 0)
+    row = await fb_get_player_data_async(userId)
+    if row:
+        return _cachePlayerRow(userId, row, currentTime, generation)
     return None
 
-async def savePlayerData(userId: int, data: Dict[str, Any]):
+# fresh dict per call (avatar and ownedAccessories copied out of the cache),
+# callers are free to modify it and pass it to savePlayerData (which leaves
+# currency and ownedAccessories alone, those go through currency_system and buyItem)
+def getPlayerData(userId: int) -> Optional[Dict[str, Any]]:
+    row = getPlayerRow(userId)
+    return _applyPlayerDefaults(row.to_dict()) if row else None
+
+async def getPlayerDataAsync(userId: int) -> Optional[Dict[str, Any]]:
+    row = await getPlayerRowAsync(userId)
+    return _applyPlayerDefaults(row.to_dict()) if row else None
+
+async def savePlayerData(userId: int, data: Dict[str, Any], extra_statements: Optional[List[tuple]] = None):
     save_id = await save_tracker.start_save(userId, "player_data")
 
     try:
@@ -99,11 +154,9 @@ async def savePlayerData(userId: int, data: Dict[str, Any]):
         if "avatar" in data and isinstance(data["avatar"], dict):
             data["avatar"] = json.dumps(data["avatar"])
 
-        fb_save_player_data(userId, data)
+        await fb_save_player_data_async(userId, data, extra_statements)
 
-        cacheKey = f"player_{userId}"
-        if cacheKey in player_cache:
-            del player_cache[cacheKey]
+        invalidate_player_cache(userId)
 
         await save_tracker.complete_save(save_id, success=True)
     except Exception as e:
@@ -112,31 +165,38 @@ async def savePlayerData(userId: int, data: Dict[str, Any]):
         raise
 
 async def createPlayerData(userId: int, username: str) -> Dict[str, Any]:
-    from friends import getFriends
     playerData = DEFAULT_PLAYER_SCHEMA.copy()
+    playerData["pfp"] = defaultPfpUrl()
     playerData["username"] = username
     playerData["userId"] = userId
-    playerData["friends"] = getFriends(userId)
+    playerData["friends"] = await fb_get_friends_async(userId)
 
     await savePlayerData(userId, playerData)
 
     return playerData
 
 async def updatePlayerAvatar(userId: int, avatarData: Dict[str, Any]) -> Dict[str, Any]:
-    playerData = getPlayerData(userId)
+    playerData = await getPlayerDataAsync(userId)
     if not playerData:
         return {"success": False, "error": {"code": "USER_NOT_FOUND", "message": "User not found"}}
     playerData["avatar"] = avatarData
     await savePlayerData(userId, playerData)
     return {"success": True, "data": playerData}
 
+# just the server_id column, joins and leaves come from game servers at any
+# time and a full save here would write back whatever avatar was cached
 async def setPlayerServer(userId: int, serverId: Optional[str]) -> Dict[str, Any]:
-    playerData = getPlayerData(userId)
-    if not playerData:
+    if not await getPlayerRowAsync(userId):
         return {"success": False, "error": {"code": "USER_NOT_FOUND", "message": "User not found"}}
-    
-    playerData["serverId"] = serverId
-    await savePlayerData(userId, playerData)
+
+    save_id = await save_tracker.start_save(userId, "player_server")
+    try:
+        await fb_set_player_server_async(userId, serverId)
+    except Exception:
+        await save_tracker.complete_save(save_id, success=False)
+        raise
+    invalidate_player_cache(userId)
+    await save_tracker.complete_save(save_id, success=True)
     return {"success": True, "data": {"userId": userId, "serverId": serverId}}
 
 async def clearPlayerServer(userId: int) -> Dict[str, Any]:
@@ -147,10 +207,9 @@ def getPlayerFullProfile(userId: int) -> Dict[str, Any]:
     from avatar_service import getUserAccessories
     from currency_system import getCurrency
     from pfp_service import getPfp
-    playerData = getPlayerData(userId)
-    if not playerData:
+    profile = getPlayerData(userId)
+    if not profile:
         return {"success": False, "error": {"code": "USER_NOT_FOUND", "message": "User not found"}}
-    profile = playerData.copy()
     profile["friends"] = getFriends(userId)
     profile["ownedAccessories"] = getUserAccessories(userId)
     currencyResult = getCurrency(userId)
@@ -159,6 +218,22 @@ def getPlayerFullProfile(userId: int) -> Dict[str, Any]:
     profile["pfp"] = getPfp(userId)
     return {"success": True, "data": profile}
 
+async def getPlayerFullProfileAsync(userId: int) -> Dict[str, Any]:
+    from avatar_service import getUserAccessories
+    from currency_system import getCurrency
+    from pfp_service import getPfp
+    profile = await getPlayerDataAsync(userId)
+    if not profile:
+        return {"success": False, "error": {"code": "USER_NOT_FOUND", "message": "User not found"}}
+    # player row is cached now, so the helpers below dont touch the db
+    profile["friends"] = await fb_get_friends_async(userId)
+    profile["ownedAccessories"] = getUserAccessories(userId)
+    currencyResult = getCurrency(userId)
+    if currencyResult["success"]:
+        profile["currency"] = currencyResult["data"]["balance"]
+    profile["pfp"] = getPfp(userId)
+    return {"success": True, "data": profile}
+
 def resetAllPlayerServers():
     print("Note: resetAllPlayerServers not implemented for SQLite (requires full table scan)")
 
@@ -167,6 +242,13 @@ def clear_player_cache():
     player_cache.clear()
 
 def invalidate_player_cache(userId: int):
+    _drop_player_cache(userId)
+    shared_state.publish("player_cache", userId)
+
+def _drop_player_cache(userId: int):
     cacheKey = f"player_{userId}"
-    if cacheKey in player_cache:
-        del player_cache[cacheKey]
+    player_cache_generation[cacheKey] = player_cache_generation.get(cacheKey, 0) + 1
+    player_cache.pop(cacheKey, None)
+
+# other workers saving a player
+shared_state.subscribe("player_cache", _drop_player_cache)
@@ -0,0 +1,143 @@
+import os
+import math
+import time
+import threading
+from collections import deque
+from typing import Dict, Any
+
+# per statement counters for database_manager, read by /api/dashboard/queries
+# latencies go into log buckets (~12% wide) so recording is a couple of adds,
+# percentiles are worked out from the buckets when someone asks
+
+enabled = os.environ.get("DB_QUERY_STATS", "1") != "0"
+SLOW_QUERY_MS = float(os.environ.get("DB_SLOW_QUERY_MS", "100"))
+SLOW_LOG_SIZE = 200
+# EXPLAIN once per statement per this many seconds, plans dont change often
+PLAN_TTL = 300
+
+BUCKET_BASE = 1.25
+LOG_BASE = math.log(BUCKET_BASE)
+BUCKETS = 90  # 1us * 1.25^90 ~ 500s
+
+stats_lock = threading.Lock()
+statements = {}
+normalized = {}
+slow_log = deque(maxlen=SLOW_LOG_SIZE)
+plans = {}
+
+class StatementStats:
+    __slots__ = ("statement", "count", "errors", "rows", "lock_wait", "exec_total", "exec_max", "buckets")
+
+    def __init__(self, statement: str):
+        self.statement = statement
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.lock_wait = 0.0
+        self.exec_total = 0.0
+        self.exec_max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def percentile(self, pct: float) -> float:
+        target = self.count * pct
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target and n:
+                return BUCKET_BASE ** (i + 1) / 1000.0
+        return self.exec_max * 1000.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        count = self.count or 1
+        return {
+            "statement": self.statement,
+            "count": self.count,
+            "errors": self.errors,
+            "rows": self.rows,
+            "avg_rows": round(self.rows / count, 2),
+            "total_ms": round(self.exec_total * 1000, 2),
+            "lock_wait_ms": round(self.lock_wait * 1000, 2),
+            "avg_lock_wait_ms": round(self.lock_wait * 1000 / count, 3),
+            "p50_ms": round(self.percentile(0.50), 3),
+            "p95_ms": round(self.percentile(0.95), 3),
+            "p99_ms": round(self.percentile(0.99), 3),
+            "max_ms": round(self.exec_max * 1000, 3),
+        }
+
+def normalize(query: str) -> str:
+    # queries are module constants so the same str object comes back every time
+    key = normalized.get(query)
+    if key is None:
+        key = " ".join(query.split())
+        if len(normalized) < 10000:
+            normalized[query] = key
+    return key
+
+def record(query: str, lock_wait: float, elapsed: float, rows: int, error: bool = False, conn=None, params=()):
+    key = normalize(query)
+    micros = elapsed * 1e6
+    bucket = int(math.log(micros) / LOG_BASE) if micros > 1 else 0
+    if bucket >= BUCKETS:
+        bucket = BUCKETS - 1
+
+    with stats_lock:
+        entry = statements.get(key)
+        if entry is None:
+            entry = statements[key] = StatementStats(key)
+        entry.count += 1
+        entry.rows += rows
+        entry.lock_wait += lock_wait
+        entry.exec_total += elapsed
+        entry.buckets[bucket] += 1
+        if elapsed > entry.exec_max:
+            entry.exec_max = elapsed
+        if error:
+            entry.errors += 1
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        _log_slow(key, query, params, lock_wait, elapsed, rows, conn)
+
+def _log_slow(key: str, query: str, params, lock_wait: float, elapsed: float, rows: int, conn):
+    now = time.time()
+    plan = plans.get(key)
+    if conn is not None and (plan is None or now - plan[0] > PLAN_TTL):
+        try:
+            rows_plan = conn.execute("EXPLAIN QUERY PLAN " + query, params).fetchall()
+            plan = (now, "\n".join(row[-1] for row in rows_plan))
+        except Exception as e:
+            plan = (now, f"explain failed: {e}")
+        plans[key] = plan
+
+    slow_log.append({
+        "time": now,
+        "statement": key,
+        "ms": round(elapsed * 1000, 2),
+        "lock_wait_ms": round(lock_wait * 1000, 2),
+        "rows": rows,
+        "plan": plan[1] if plan else None
+    })
+    print(f"[slow query] {elapsed * 1000:.1f}ms (lock {lock_wait * 1000:.1f}ms): {key[:200]}")
+
+def get_query_stats(sort: str = "total_ms", limit: int = 50) -> Dict[str, Any]:
+    with stats_lock:
+        rows = [entry.to_dict() for entry in statements.values()]
+    if rows and sort not in rows[0]:
+        sort = "total_ms"
+    rows.sort(key=lambda r: r[sort], reverse=True)
+    return {
+        "enabled": enabled,
+        "slow_query_ms": SLOW_QUERY_MS,
+        "statements": rows[:limit],
+        "statement_count": len(rows),
+        "slow_queries": list(slow_log)[::-1]
+    }
+
+def reset_query_stats():
+    with stats_lock:
+        statements.clear()
+    slow_log.clear()
+    plans.clear()
+
+def set_enabled(value: bool):
+    global enabled
+    enabled = value
@@ -0,0 +1,160 @@
+import math
+import asyncio
+import functools
+from typing import Any, Dict, NamedTuple, Optional
+from aiohttp import web
+
+import auth_utils
+import shared_state
+from json_codec import json_response, dumps_bytes, loads
+from config import RATE_LIMITS, RATE_LIMIT_ROUTES, BATCH_ROUTES, BATCH_MAX_OPERATIONS
+
+# the bits every handler used to redo by hand: parse the json body, resolve
+# the token. the body is parsed once per request and kept on the request
+# (request["body"]), a session found by the rate limiter is reused
+class RequestContext(NamedTuple):
+    body: Dict[str, Any]
+    user_id: Optional[int]
+    username: Optional[str]
+
+    @property
+    def token(self):
+        return self.body.get("token")
+
+# parsed json body, ValueError if it isn't a json object
+async def readBody(request) -> Dict[str, Any]:
+    body = request.get("body")
+    if body is None:
+        body = loads(await request.read())
+        if not isinstance(body, dict):
+            raise ValueError("body is not an object")
+        request["body"] = body
+    return body
+
+async def requestSession(request, body):
+    session = request.get("session")
+    if session is None:
+        session = await auth_utils.getSessionAsync(body.get("token"))
+        request["session"] = session
+    return session
+
+# @endpoint() handlers take (request, ctx) and only run with a valid token,
+# @endpoint(auth=False) just gets the parsed body
+def endpoint(auth=True):
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            try:
+                body = await readBody(request)
+            except Exception:
+                return json_response({"error": "invalid_json"}, status=400)
+            if not auth:
+                return await handler(request, RequestContext(body, None, None))
+            session = await requestSession(request, body)
+            if not session:
+                return json_response({"error": "invalid_token"}, status=401)
+            return await handler(request, RequestContext(body, session.user_id, session.username))
+        wrapper.endpoint_auth = auth
+        return wrapper
+    return decorator
+
+# every request takes a token from its route's bucket (RATE_LIMIT_ROUTES),
+# keyed by ip or, for "user" groups, by a session we can check without the db
+# (no such session: the ip's "default" bucket).
+# with several workers the buckets live in the shared_state coordinator
+async def rate_limit_middleware(app, handler):
+    async def middleware_handler(request):
+        clientIp = request.remote
+        if auth_utils.isServerIp(clientIp):
+            return await handler(request)
+        group = RATE_LIMIT_ROUTES.get(request.path, "default")
+        key = clientIp
+        if RATE_LIMITS[group][2] == "user":
+            session = None
+            if request.can_read_body:
+                try:
+                    session = auth_utils.peekSession((await readBody(request)).get("token"))
+                except Exception:
+                    pass
+            if session:
+                request["session"] = session
+                key = f"user:{session.user_id}"
+            else:
+                # a per user limit would be far too tight for a whole NAT
+                group = "default"
+        if shared_state.enabled:
+            wait = await shared_state.rateLimitWait(key, group)
+        else:
+            wait = auth_utils.rateLimitWait(key, group)
+        if wait:
+            error = "auth_rate_limit_exceeded" if group == "auth" else "rate_limit_exceeded"
+            return json_response({"error": error}, status=429, headers={"Retry-After": str(math.ceil(wait))})
+        return await handler(request)
+    return middleware_handler
+
+# POST /batch {"token": ..., "operations": [{"path": "/currency/get", "body": {...}}, ...]}
+# the client startup reads in one round trip: one rate limit token, one body
+# parse and one session lookup, then the BATCH_ROUTES handlers run
+# concurrently. answers {"results": [{"path", "status", "body"}, ...]} in order
+async def runOperation(request, handler, body, session):
+    auth = getattr(handler, "endpoint_auth", None)
+    if auth is None:
+        # plain handler, doesn't read a body
+        return await handler(request)
+    if not auth:
+        return await handler.__wrapped__(request, RequestContext(body, None, None))
+    if not session:
+        return json_response({"error": "invalid_token"}, status=401)
+    return await handler.__wrapped__(request, RequestContext(body, session.user_id, session.username))
+
+async def operationResult(request, handlers, operation, session, token) -> bytes:
+    path = operation.get("path") if isinstance(operation, dict) else None
+    handler = handlers.get(path)
+    body = operation.get("body") if handler else None
+    body = dict(body) if isinstance(body, dict) else {}
+    # every operation runs as the batch's session
+    body.pop("token", None)
+    if token:
+        body["token"] = token
+    if handler is None:
+        response = json_response({"error": "unknown_operation"}, status=404)
+    else:
+        try:
+            response = await runOperation(request, handler, body, session)
+        except web.HTTPException as ex:
+            response = json_response({"error": ex.reason}, status=ex.status)
+        except Exception:
+            response = json_response({"error": "internal_error"}, status=500)
+    # handlers already produced json bytes, splice them in as they are
+    if response.content_type == "application/json" and isinstance(response.body, (bytes, bytearray)):
+        payload = bytes(response.body)
+    else:
+        payload = dumps_bytes(response.text or "")
+    return b'{"path":' + dumps_bytes(path) + b',"status":' + str(response.status).encode() + b',"body":' + payload + b"}"
+
+def batchHandler(handlers):
+    @endpoint(auth=False)
+    async def batchView(request, ctx):
+        operations = ctx.body.get("operations")
+        if not isinstance(operations, list) or not operations:
+            return json_response({"error": "missing_operations"}, status=400)
+        if len(operations) > BATCH_MAX_OPERATIONS:
+            return json_response({"error": "too_many_operations", "max": BATCH_MAX_OPERATIONS}, status=400)
+        token = ctx.token
+        session = await requestSession(request, ctx.body) if token else None
+        results = await asyncio.gather(*(operationResult(request, handlers, operation, session, token)
+                                         for operation in operations))
+        return web.Response(body=b'{"results":[' + b",".join(results) + b"]}", content_type="application/json")
+    return batchView
+
+# call once every other route is on the app
+def addBatchRoute(app):
+    handlers = {}
+    for route in app.router.routes():
+        resource = route.resource
+        if resource is not None and resource.canonical in BATCH_ROUTES and route.method in ("GET", "POST"):
+            handlers[resource.canonical] = route.handler
+    missing = set(BATCH_ROUTES) - set(handlers)
+    if missing:
+        raise ValueError(f"BATCH_ROUTES not registered on the app: {sorted(missing)}")
+    app.router.add_post("/batch", batchHandler(handlers))
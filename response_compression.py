@@ -0,0 +1,105 @@
+import time
+import zlib
+import asyncio
+from typing import Dict, Set
+from aiohttp import web, hdrs
+
+from config import COMPRESS_MIN_SIZE, COMPRESS_THREAD_SIZE, COMPRESS_GZIP_LEVEL, COMPRESS_BROTLI_QUALITY
+
+# gzip/brotli for the big json bodies (market pages, full profiles, the
+# dashboard snapshot). anything under COMPRESS_MIN_SIZE goes out as is, the
+# header and cpu cost isn't worth it. bodies over COMPRESS_THREAD_SIZE are
+# compressed in the default executor so the loop keeps serving
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/html", "text/plain", "text/css", "application/javascript")
+
+# route -> {"responses", "bytes_in", "bytes_out", "ms"}
+compression_stats: Dict[str, Dict[str, float]] = {}
+
+# codings the client takes, q=0 ones left out
+def acceptedEncodings(accept: str) -> Set[str]:
+    accepted = set()
+    for item in accept.split(","):
+        coding, _, params = item.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q=") and params[2:].strip("0.") == "":
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+def pickEncoding(accept: str) -> str:
+    accepted = acceptedEncodings(accept)
+    if brotli is not None and ("br" in accepted or "*" in accepted):
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return "identity"
+
+def compressBody(body: bytes, coding: str) -> bytes:
+    if coding == "br":
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    # gzip wrapper via wbits, same output as gzip.compress without the mtime
+    compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+def routeName(request) -> str:
+    resource = request.match_info.route.resource
+    return resource.canonical if resource is not None else request.path
+
+def recordCompression(route: str, size: int, compressed: int, elapsed: float):
+    stats = compression_stats.get(route)
+    if stats is None:
+        stats = compression_stats[route] = {"responses": 0, "bytes_in": 0, "bytes_out": 0, "ms": 0.0}
+    stats["responses"] += 1
+    stats["bytes_in"] += size
+    stats["bytes_out"] += compressed
+    stats["ms"] += elapsed * 1000
+
+async def compression_middleware(app, handler):
+    async def middleware_handler(request):
+        response = await handler(request)
+        # file/stream/websocket responses and bodies that are already encoded
+        # (static_pages) are left alone
+        if type(response) is not web.Response or hdrs.CONTENT_ENCODING in response.headers:
+            return response
+        body = response.body
+        if not isinstance(body, (bytes, bytearray)) or len(body) < COMPRESS_MIN_SIZE:
+            return response
+        if response.content_type not in COMPRESSIBLE_TYPES:
+            return response
+        coding = pickEncoding(request.headers.get(hdrs.ACCEPT_ENCODING, ""))
+        if coding == "identity":
+            return response
+        start = time.perf_counter()
+        if len(body) >= COMPRESS_THREAD_SIZE:
+            compressed = await asyncio.get_running_loop().run_in_executor(None, compressBody, body, coding)
+        else:
+            compressed = compressBody(body, coding)
+        recordCompression(routeName(request), len(body), len(compressed), time.perf_counter() - start)
+        response.body = compressed
+        response.headers[hdrs.CONTENT_ENCODING] = coding
+        response.headers.popall(hdrs.CONTENT_LENGTH, None)
+        vary = response.headers.get(hdrs.VARY)
+        if not vary:
+            response.headers[hdrs.VARY] = "Accept-Encoding"
+        elif "accept-encoding" not in vary.lower():
+            response.headers[hdrs.VARY] = vary + ", Accept-Encoding"
+        return response
+    return middleware_handler
+
+def get_compression_stats():
+    routes = {}
+    for route, stats in sorted(compression_stats.items(), key=lambda item: item[1]["bytes_out"] - item[1]["bytes_in"]):
+        routes[route] = {
+            "responses": stats["responses"],
+            "bytes_in": stats["bytes_in"],
+            "bytes_out": stats["bytes_out"],
+            "bytes_saved": stats["bytes_in"] - stats["bytes_out"],
+            "ratio": round(stats["bytes_out"] / stats["bytes_in"], 3),
+            "avg_ms": round(stats["ms"] / stats["responses"], 3),
+        }
+    return {"brotli": brotli is not None, "min_size": COMPRESS_MIN_SIZE, "routes": routes}
@@ -0,0 +1,233 @@
+import os
+import time
+import asyncio
+import threading
+from collections import defaultdict, deque
+from typing import Any, Callable, Dict, List, Optional
+
+from json_codec import dumps_bytes, loads
+
+# state the master's worker processes share (MASTER_WORKERS > 1). the
+# supervisor runs a Coordinator on a unix socket, every worker keeps one
+# connection to it:
+#   - rate limit buckets live in the coordinator, one "rate" call per request
+#   - a small key/value store with ttls (captchas, first account ips)
+#   - pub/sub so a worker can tell the others to drop a cache entry, pick up
+#     new trusted ips or push a global message to its websockets
+# frames are a 4 byte length and a json array: [id, op, *args] to the
+# coordinator, [id, result] or [id, None, error] back, [0, "msg", channel,
+# message] for published messages. id 0 means no reply wanted
+#
+# with a single process (the default) enabled is False, publish() does
+# nothing and callers keep using their local state
+
+WORKER_ID = int(os.environ["MASTER_WORKER_ID"]) if os.environ.get("MASTER_WORKER_ID") else None
+enabled = WORKER_ID is not None
+
+subscribers: Dict[str, List[Callable[[Any], None]]] = defaultdict(list)
+
+def is_primary() -> bool:
+    # worker 0 runs the background tasks and owns vm_registry, see workers.py
+    return not enabled or WORKER_ID == 0
+
+def encodeFrame(frame) -> bytes:
+    payload = dumps_bytes(frame)
+    return len(payload).to_bytes(4, "big") + payload
+
+async def readFrame(reader):
+    header = await reader.readexactly(4)
+    return loads(await reader.readexactly(int.from_bytes(header, "big")))
+
+class CoordinatorClient:
+    def __init__(self):
+        self.writer = None
+        self.loop = None
+        self.loop_thread = None
+        self.next_id = 1
+        self.pending: Dict[int, asyncio.Future] = {}
+        # frames published before connect (module imports) go out once connected
+        self.backlog: List[bytes] = []
+
+    async def connect(self, path: str):
+        reader, self.writer = await asyncio.open_unix_connection(path)
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.loop.create_task(self.readLoop(reader))
+        for channel in subscribers:
+            self.writer.write(encodeFrame([0, "sub", channel]))
+        for frame in self.backlog:
+            self.writer.write(frame)
+        self.backlog.clear()
+
+    async def readLoop(self, reader):
+        try:
+            while True:
+                frame = await readFrame(reader)
+                if frame[0] == 0:
+                    for callback in subscribers.get(frame[2], ()):
+                        try:
+                            callback(frame[3])
+                        except Exception as e:
+                            print(f"shared_state: {frame[2]} subscriber failed: {e}")
+                    continue
+                future = self.pending.pop(frame[0], None)
+                if future is None or future.done():
+                    continue
+                if len(frame) > 2:
+                    future.set_exception(RuntimeError(frame[2]))
+                else:
+                    future.set_result(frame[1])
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            error = e
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("coordinator went away"))
+        self.pending.clear()
+        # the supervisor is gone too, nothing sensible left to serve
+        print(f"shared_state: lost the coordinator ({error!r}), exiting")
+        os.kill(os.getpid(), 15)
+
+    # from any thread, invalidations come from run_in_db workers too
+    def send(self, frame: bytes):
+        if self.writer is None:
+            self.backlog.append(frame)
+        elif threading.get_ident() == self.loop_thread:
+            self.writer.write(frame)
+        else:
+            self.loop.call_soon_threadsafe(self.writer.write, frame)
+
+    async def call(self, op: str, *args):
+        request_id = self.next_id
+        self.next_id += 1
+        future = self.loop.create_future()
+        self.pending[request_id] = future
+        self.writer.write(encodeFrame([request_id, op, *args]))
+        return await future
+
+client = CoordinatorClient()
+
+async def connect(path: str):
+    await client.connect(path)
+
+# callback(message) for messages other workers publish on channel
+def subscribe(channel: str, callback: Callable[[Any], None]):
+    subscribers[channel].append(callback)
+    if client.writer is not None:
+        client.send(encodeFrame([0, "sub", channel]))
+
+# the coordinator keeps the last `retain` messages and replays them to
+# workers that subscribe later (a restarted worker catching up)
+def publish(channel: str, message: Any, retain: int = 0):
+    if enabled:
+        client.send(encodeFrame([0, "pub", channel, message, retain]))
+
+async def rateLimitWait(key: str, group: str) -> float:
+    return await client.call("rate", key, group)
+
+async def rateLimitEntries(limit: int = 100) -> List[Dict[str, Any]]:
+    return await client.call("rate_entries", limit)
+
+async def kv_get(namespace: str, key: str):
+    return await client.call("get", namespace, key)
+
+async def kv_set(namespace: str, key: str, value, ttl: Optional[float] = None):
+    return await client.call("set", namespace, key, value, ttl)
+
+async def kv_pop(namespace: str, key: str):
+    return await client.call("pop", namespace, key)
+
+class Coordinator:
+    SWEEP_INTERVAL = 60
+
+    def __init__(self):
+        # namespace -> key -> (value, expires or None)
+        self.kv: Dict[str, Dict[str, tuple]] = defaultdict(dict)
+        self.channels: Dict[str, set] = defaultdict(set)
+        self.retained: Dict[str, deque] = {}
+        self.stats = {"calls": 0, "published": 0, "connections": 0}
+
+    async def serve(self, path: str):
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(self.handle, path)
+        asyncio.get_running_loop().create_task(self.sweepLoop())
+        return server
+
+    async def handle(self, reader, writer):
+        self.stats["connections"] += 1
+        try:
+            while True:
+                frame = await readFrame(reader)
+                request_id, op, args = frame[0], frame[1], frame[2:]
+                self.stats["calls"] += 1
+                try:
+                    result = self.dispatch(writer, op, args)
+                except Exception as e:
+                    if request_id:
+                        writer.write(encodeFrame([request_id, None, f"{type(e).__name__}: {e}"]))
+                    continue
+                if request_id:
+                    writer.write(encodeFrame([request_id, result]))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.stats["connections"] -= 1
+            for members in self.channels.values():
+                members.discard(writer)
+            writer.close()
+
+    def dispatch(self, writer, op: str, args: list):
+        if op == "rate":
+            import auth_utils
+            return auth_utils.rateLimitWait(args[0], args[1])
+        if op == "rate_entries":
+            import auth_utils
+            return auth_utils.get_rate_limit_entries(args[0])
+        if op == "get":
+            return self.get(args[0], args[1])
+        if op == "set":
+            namespace, key, value, ttl = args
+            self.kv[namespace][key] = (value, time.time() + ttl if ttl else None)
+            return True
+        if op == "pop":
+            value = self.get(args[0], args[1])
+            self.kv[args[0]].pop(args[1], None)
+            return value
+        if op == "sub":
+            self.channels[args[0]].add(writer)
+            for message in self.retained.get(args[0], ()):
+                writer.write(encodeFrame([0, "msg", args[0], message]))
+            return True
+        if op == "pub":
+            channel, message, retain = args
+            self.stats["published"] += 1
+            frame = encodeFrame([0, "msg", channel, message])
+            for member in self.channels.get(channel, ()):
+                if member is not writer:
+                    member.write(frame)
+            if retain:
+                retained = self.retained.get(channel)
+                if retained is None or retained.maxlen != retain:
+                    retained = self.retained[channel] = deque(retained or (), maxlen=retain)
+                retained.append(message)
+            return True
+        if op == "stats":
+            return {**self.stats, "keys": {namespace: len(entries) for namespace, entries in self.kv.items()}}
+        raise ValueError(f"unknown op {op}")
+
+    def get(self, namespace: str, key: str):
+        entry = self.kv[namespace].get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and time.time() >= entry[1]:
+            del self.kv[namespace][key]
+            return None
+        return entry[0]
+
+    async def sweepLoop(self):
+        while True:
+            await asyncio.sleep(self.SWEEP_INTERVAL)
+            now = time.time()
+            for entries in self.kv.values():
+                for key in [key for key, (_, expires) in entries.items() if expires is not None and now >= expires]:
+                    del entries[key]
@@ -0,0 +1,93 @@
+import os
+import time
+import asyncio
+from typing import Any, Dict
+
+import auth_utils
+from database_manager import get_connection, get_cipher, get_shards
+from moderation.ModServer import loadModeration
+from config import (
+    get_server_public_ip,
+    get_dashboard_password,
+    BASE_PORT,
+    GODOT_SERVER_BIN,
+    VERSION_FILE,
+    STARTUP_BUDGET,
+)
+
+# everything that used to happen at import (public ip lookup, db open, key
+# files, the moderation model) runs here instead, once, before the server
+# listens. the steps don't depend on each other so they run side by side in
+# the default executor and the slowest one sets the startup time
+#
+# the moderation model can take minutes the first time (train.py), the
+# server doesn't wait for it and /moderation answers 503 until it's loaded
+
+startup_stats: Dict[str, Any] = {"started": None, "seconds": None, "budget": STARTUP_BUDGET, "steps": {}}
+
+def resolveServerIp():
+    ip = get_server_public_ip()
+    auth_utils.refreshTrustedIps(publish=False)
+    return ip
+
+def openDatabase():
+    get_connection()
+    get_shards()
+    get_cipher()
+
+def loadKeys():
+    get_dashboard_password()
+    auth_utils.get_signing_keys()
+
+# name -> (function, wait for it before listening)
+STARTUP_STEPS = {
+    "server_ip": (resolveServerIp, True),
+    "database": (openDatabase, True),
+    "keys": (loadKeys, True),
+    "moderation": (loadModeration, False),
+}
+
+async def runStep(name: str, func):
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    step = startup_stats["steps"][name] = {"seconds": None, "error": None}
+    try:
+        return await loop.run_in_executor(None, func)
+    except Exception as e:
+        step["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        step["seconds"] = round(time.perf_counter() - start, 4)
+        print(f"Startup: {name} {'failed' if step['error'] else 'done'} in {step['seconds'] * 1000:.0f} ms")
+
+async def runBackgroundStep(name: str, func):
+    try:
+        await runStep(name, func)
+    except Exception as e:
+        print(f"Startup: {name} failed, continuing without it: {e}")
+
+async def runStartup(steps: Dict[str, tuple] = STARTUP_STEPS):
+    startup_stats["started"] = time.time()
+    start = time.perf_counter()
+    waited = {}
+    for name, (func, wait) in steps.items():
+        if wait:
+            waited[name] = asyncio.create_task(runStep(name, func))
+        else:
+            asyncio.create_task(runBackgroundStep(name, func))
+    results = await asyncio.gather(*waited.values())
+    elapsed = startup_stats["seconds"] = round(time.perf_counter() - start, 4)
+
+    results = dict(zip(waited, results))
+    print(f"Server configured with IP: {results.get('server_ip')}")
+    print(f"Server configured with PORT: {BASE_PORT}")
+    print(f"Godot binary path: {GODOT_SERVER_BIN}")
+    if not os.path.exists(VERSION_FILE):
+        print("[WARNING] version file does not exist, this can be ignored")
+    if elapsed > STARTUP_BUDGET:
+        slowest = max(waited, key=lambda name: startup_stats["steps"][name]["seconds"])
+        print(f"[WARNING] startup took {elapsed:.2f}s, over the {STARTUP_BUDGET}s budget (slowest: {slowest})")
+    return results
+
+def get_startup_stats() -> Dict[str, Any]:
+    return startup_stats
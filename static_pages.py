@@ -0,0 +1,103 @@
+import os
+import gzip
+import time
+import hashlib
+from typing import Dict, Optional
+from aiohttp import web
+
+from config import STATIC_PAGE_CHECK_INTERVAL
+from response_compression import acceptedEncodings
+
+# the html pages we serve ourselves (dashboard, 404) kept in memory with
+# their etag and compressed variants. the file is stat()ed at most once per
+# STATIC_PAGE_CHECK_INTERVAL and only re-read when its mtime/size changes,
+# so a scanner walking random paths never touches the disk
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PAGES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class StaticPage:
+    __slots__ = ("path", "stamp", "checked", "etag", "variants")
+
+    def __init__(self, path):
+        self.path = path
+        self.stamp = None
+        self.checked = 0.0
+        self.etag = ""
+        self.variants: Dict[str, bytes] = {}
+
+    def load(self, stamp):
+        with open(self.path, "rb") as f:
+            body = f.read()
+        variants = {"identity": body}
+        # only keep an encoding when it actually saves bytes
+        compressed = gzip.compress(body, 9, mtime=0)
+        if len(compressed) < len(body):
+            variants["gzip"] = compressed
+        if brotli is not None:
+            compressed = brotli.compress(body)
+            if len(compressed) < len(body):
+                variants["br"] = compressed
+        self.variants = variants
+        self.etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        self.stamp = stamp
+
+static_pages: Dict[str, StaticPage] = {}
+static_page_stats = {"hits": 0, "reloads": 0, "not_modified": 0}
+
+def getPage(name: str) -> StaticPage:
+    page = static_pages.get(name)
+    if page is None:
+        page = static_pages[name] = StaticPage(os.path.join(PAGES_DIR, name))
+    now = time.monotonic()
+    if page.stamp is None or now - page.checked >= STATIC_PAGE_CHECK_INTERVAL:
+        st = os.stat(page.path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp != page.stamp:
+            page.load(stamp)
+            static_page_stats["reloads"] += 1
+        page.checked = now
+    static_page_stats["hits"] += 1
+    return page
+
+# best encoding the client accepts (q=0 means no), br over gzip
+def pickEncoding(page: StaticPage, accept: str) -> str:
+    accepted = acceptedEncodings(accept)
+    for coding in ("br", "gzip"):
+        if coding in page.variants and (coding in accepted or "*" in accepted):
+            return coding
+    return "identity"
+
+def etagMatches(page: StaticPage, header: Optional[str]) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # weak/strong doesn't matter for a GET revalidation
+    return any(tag.strip().removeprefix("W/") == page.etag for tag in header.split(","))
+
+def pageResponse(request, name: str, status: int = 200) -> web.Response:
+    page = getPage(name)
+    headers = {"Vary": "Accept-Encoding"}
+    if status == 200:
+        headers["ETag"] = page.etag
+        headers["Cache-Control"] = "no-cache"
+        if etagMatches(page, request.headers.get("If-None-Match")):
+            static_page_stats["not_modified"] += 1
+            return web.Response(status=304, headers=headers)
+    coding = pickEncoding(page, request.headers.get("Accept-Encoding", ""))
+    if coding != "identity":
+        headers["Content-Encoding"] = coding
+    return web.Response(body=page.variants[coding], status=status, headers=headers,
+                        content_type="text/html", charset="utf-8")
+
+def get_static_page_stats():
+    return {
+        **static_page_stats,
+        "pages": {name: {"bytes": {coding: len(body) for coding, body in page.variants.items()}, "etag": page.etag}
+                  for name, page in static_pages.items()},
+        "brotli": brotli is not None,
+    }
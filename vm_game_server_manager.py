@@ -7,15 +7,22 @@ import signal
 import subprocess
 from typing import Dict, Set
 from aiohttp import web
-from config import get_public_ip, GODOT_SERVER_BIN, MAX_SERVERS_PER_VM
+from config import get_server_public_ip, GODOT_SERVER_BIN, MAX_SERVERS_PER_VM
+from json_codec import json_response, loads
 import requests
 import traceback
 
-MASTER_SERVER_URL = os.environ.get("MASTER_SERVER_URL", f"http://{get_public_ip()}:8080") #os.environ.get("MASTER_SERVER_URL", "http://localhost:8080")
+MASTER_SERVER_URL = os.environ.get("MASTER_SERVER_URL") #os.environ.get("MASTER_SERVER_URL", "http://localhost:8080")
 VM_ID = os.environ.get("VM_ID", str(uuid.uuid4()))
 BASE_PORT = 9000
+# godot's output goes to a file per server, not a pipe: nobody reads the
+# pipe so it fills up and blocks the server, and on the master it would
+# close under the server when handoff.py replaces the process
+GAME_LOG_DIR = os.environ.get("GAME_LOG_DIR", "game_logs")
 
-print("VM GAME SERVER MANAGER BIN: " + GODOT_SERVER_BIN)
+# on the master the default is our own public ip, looked up on first use
+def master_server_url() -> str:
+    return MASTER_SERVER_URL or f"http://{get_server_public_ip()}:8080"
 
 game_server_processes = {}
 game_server_info = {}
@@ -28,7 +35,7 @@ def log_to_master(message: str):
     try:
         access_key = os.environ.get("DATASTORE_PASSWORD", "@MEOW")
         requests.post(
-            f"{MASTER_SERVER_URL}/vm/startup_log",
+            f"{master_server_url()}/vm/startup_log",
             json={"vm_id": VM_ID, "message": message, "access_key": access_key},
             timeout=3
         )
@@ -75,7 +82,7 @@ async def spawn_game_server(server_uid: str = None, port: int = None, owner_id:
             "--headless",
             "--server",
             "--port", str(port),
-            "--master", MASTER_SERVER_URL,
+            "--master", master_server_url(),
             "--uid", server_uid,
         ]
 
@@ -84,11 +91,14 @@ async def spawn_game_server(server_uid: str = None, port: int = None, owner_id:
 
         log_to_master(f"Executing command: {' '.join(cmd)}")
 
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        os.makedirs(GAME_LOG_DIR, exist_ok=True)
+        log_path = os.path.join(GAME_LOG_DIR, f"{server_uid}.log")
+        with open(log_path, "ab") as log_file:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=log_file,
+                stderr=asyncio.subprocess.STDOUT
+            )
 
         game_server_processes[server_uid] = proc
         game_server_info[server_uid] = {
@@ -105,10 +115,10 @@ async def spawn_game_server(server_uid: str = None, port: int = None, owner_id:
         if proc.returncode is not None:
             log_to_master(f"ERROR: Process exited immediately with code {proc.returncode}")
             try:
-                stdout_data = await asyncio.wait_for(proc.stdout.read(4096), timeout=2)
-                stderr_data = await asyncio.wait_for(proc.stderr.read(4096), timeout=2)
-                log_to_master(f"STDOUT: {stdout_data.decode() if stdout_data else 'empty'}")
-                log_to_master(f"STDERR: {stderr_data.decode() if stderr_data else 'empty'}")
+                with open(log_path, "rb") as log_file:
+                    log_file.seek(max(os.path.getsize(log_path) - 4096, 0))
+                    output = log_file.read()
+                log_to_master(f"OUTPUT: {output.decode(errors='replace') if output else 'empty'}")
             except Exception as e:
                 log_to_master(f"Could not read process output: {e}")
             
@@ -130,6 +140,59 @@ async def spawn_game_server(server_uid: str = None, port: int = None, owner_id:
             release_port(port)
         return False
 
+# a game server started by the master process this one replaced (handoff.py),
+# it isn't our child so this is just enough of asyncio.subprocess.Process
+# for stop_game_server
+class AdoptedProcess:
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, 0)
+            except ProcessLookupError:
+                self.returncode = -1
+        return self.returncode
+
+    def send_signal(self, signum):
+        if self.poll() is None:
+            try:
+                os.kill(self.pid, signum)
+            except ProcessLookupError:
+                self.returncode = -1
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    async def wait(self):
+        while self.poll() is None:
+            await asyncio.sleep(0.2)
+        return self.returncode
+
+def export_game_servers() -> Dict[str, Dict]:
+    servers = {}
+    for server_uid, info in game_server_info.items():
+        proc = game_server_processes.get(server_uid)
+        if proc is not None and proc.returncode is None:
+            servers[server_uid] = dict(info, players=list(info["players"]), pid=proc.pid)
+    return servers
+
+def adopt_game_servers(saved: Dict[str, Dict]):
+    for server_uid, info in saved.items():
+        proc = AdoptedProcess(info.pop("pid"))
+        if proc.poll() is not None:
+            continue
+        info["players"] = set(info["players"])
+        game_server_processes[server_uid] = proc
+        game_server_info[server_uid] = info
+        used_ports.add(info["port"])
+        print(f"Adopted game server {server_uid} (pid {proc.pid})")
+
 async def stop_game_server(server_uid: str, graceful: bool = True):
     if server_uid not in game_server_processes:
         return False
@@ -182,7 +245,7 @@ async def heartbeat_to_master():
             }
 
             response = requests.post(
-                f"{MASTER_SERVER_URL}/vm/heartbeat",
+                f"{master_server_url()}/vm/heartbeat",
                 json=payload,
                 timeout=10
             )
@@ -209,7 +272,7 @@ async def heartbeat_to_master():
 
 async def update_server_players(request):
     try:
-        data = await request.json()
+        data = loads(await request.read())
         server_uid = data.get("server_uid")
         players = set(data.get("players", []))
 
@@ -217,15 +280,15 @@ async def update_server_players(request):
             game_server_info[server_uid]["players"] = players
             game_server_info[server_uid]["last_heartbeat"] = time.time()
 
-            return web.json_response({"success": True})
+            return json_response({"success": True})
 
-        return web.json_response({"error": "server_not_found"}, status=404)
+        return json_response({"error": "server_not_found"}, status=404)
     except Exception as e:
-        return web.json_response({"error": str(e)}, status=400)
+        return json_response({"error": str(e)}, status=400)
 
 async def track_player_save(request):
     try:
-        data = await request.json()
+        data = loads(await request.read())
         save_id = data.get("save_id")
         status = data.get("status")
 
@@ -235,25 +298,25 @@ async def track_player_save(request):
             elif status == "complete" or status == "failed":
                 pending_saves.discard(save_id)
 
-        return web.json_response({"success": True})
+        return json_response({"success": True})
     except Exception as e:
-        return web.json_response({"error": str(e)}, status=400)
+        return json_response({"error": str(e)}, status=400)
 
 async def shutdown_endpoint(request):
     try:
-        data = await request.json()
+        data = loads(await request.read())
         graceful = data.get("graceful", True)
         if graceful:
             asyncio.create_task(graceful_shutdown())
         else:
             asyncio.create_task(force_shutdown())
 
-        return web.json_response({"success": True, "message": "Shutdown initiated"})
+        return json_response({"success": True, "message": "Shutdown initiated"})
     except Exception as e:
-        return web.json_response({"error": str(e)}, status=400)
+        return json_response({"error": str(e)}, status=400)
 
 async def status_endpoint(request):
-    return web.json_response({
+    return json_response({
         "vm_id": VM_ID,
         "server_count": len(game_server_processes),
         "max_servers": MAX_SERVERS_PER_VM,
@@ -315,22 +378,22 @@ def signal_handler(sig, frame):
 
 async def spawn_server_endpoint(request):
     try:
-        data = await request.json()
+        data = loads(await request.read())
         server_uid = data.get("server_uid")
         port = data.get("port")
 
         if len(game_server_processes) >= MAX_SERVERS_PER_VM:
-            return web.json_response({"error": "max_servers_reached"}, status=503)
+            return json_response({"error": "max_servers_reached"}, status=503)
 
         success = await spawn_game_server(server_uid, port)
 
         if success:
-            return web.json_response({"success": True, "server_uid": server_uid or f"{VM_ID}-{port}", "port": port})
+            return json_response({"success": True, "server_uid": server_uid or f"{VM_ID}-{port}", "port": port})
         else:
-            return web.json_response({"error": "spawn_failed"}, status=500)
+            return json_response({"error": "spawn_failed"}, status=500)
 
     except Exception as e:
-        return web.json_response({"error": str(e)}, status=500)
+        return json_response({"error": str(e)}, status=500)
 
 async def initial_server_spawn():
     log_to_master("Waiting 5 seconds before spawning initial server...")
@@ -360,6 +423,7 @@ async def initial_server_spawn():
         log_to_master(f"No available port for initial server")
 
 async def start_vm_manager():
+    print("VM GAME SERVER MANAGER BIN: " + GODOT_SERVER_BIN)
     app = web.Application()
     app.add_routes([
         web.post("/update_players", update_server_players),
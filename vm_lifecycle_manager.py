@@ -5,6 +5,7 @@ import asyncio
 import requests
 from typing import Dict, List, Optional
 from config import DATASTORE_PASSWORD
+import auth_utils
 
 HETZNER_API_TOKEN = os.environ.get("HETZNER_API_TOKEN", "")
 HETZNER_API_BASE = "https://api.hetzner.cloud/v1"
@@ -17,6 +18,11 @@ INACTIVE_TIME = 15 # just 15 secs to shutdown server instance if no plrs in, we
 vm_registry = {}
 vm_registry_lock = asyncio.Lock()
 
+# call after adding or removing a registry entry that has an "ip"
+# heartbeats dont carry a trusted ip, so they never change the set
+def refresh_trusted_ips():
+    auth_utils.refreshTrustedIps(vm.get("ip") for vm in vm_registry.values())
+
 def get_vm_manager_script():
     try:
         with open("vm_game_server_manager.py", "r") as f:
@@ -458,6 +464,26 @@ def get_vm_metrics(server_id: int, metric_type: str = "cpu", start: str = None,
         print(f"Error getting VM metrics: {e}")
         return None
 
+# vm_registry only lives in memory, a graceful restart (handoff.py) writes
+# it out from the old process and merges it into the new one. entries the
+# new process already built from heartbeats win, the saved ones bring back
+# what heartbeats don't carry (ip, server_id, servers still starting)
+def export_vm_registry() -> Dict:
+    return {vm_id: dict(vm_info, servers=dict(vm_info.get("servers", {}))) for vm_id, vm_info in vm_registry.items()}
+
+async def merge_vm_registry(saved: Dict):
+    async with vm_registry_lock:
+        for vm_id, saved_info in saved.items():
+            current = vm_registry.get(vm_id)
+            if current is None:
+                vm_registry[vm_id] = saved_info
+                continue
+            servers = dict(saved_info.get("servers", {}))
+            servers.update(current.get("servers", {}))
+            current.update({key: value for key, value in saved_info.items() if key not in current})
+            current["servers"] = servers
+        refresh_trusted_ips()
+
 async def register_vm_heartbeat(vm_id: str, server_stats: List[Dict]) -> Dict:
     async with vm_registry_lock:
         if vm_id not in vm_registry:
@@ -503,9 +529,8 @@ async def register_vm_heartbeat(vm_id: str, server_stats: List[Dict]) -> Dict:
             print(f"Server {server_uid} removed from VM {vm_id[:8]}")
             del vm_info["servers"][server_uid]
 
-            from database_manager import execute_query
-            query = "UPDATE player_data SET server_id = NULL WHERE server_id = ?"
-            execute_query(query, (server_uid,))
+            from game_database import clear_server_players_async
+            await clear_server_players_async(server_uid)
 
         vm_info["total_players"] = total_players
 
@@ -533,6 +558,7 @@ async def request_new_vm(master_url: str) -> Optional[Dict]:
                 "status": "provisioning",
                 "created": vm_data.get("created", time.time())
             }
+            refresh_trusted_ips()
 
         print(f"VM registered: {vm_id} (IP: {vm_data.get('ip')})")
         return vm_registry[vm_id]
@@ -564,6 +590,7 @@ async def cleanup_failed_vm(vm_id: str):
             if "server_id" in vm_info:
                 delete_vm(vm_info["server_id"])
             del vm_registry[vm_id]
+            refresh_trusted_ips()
 
 async def shutdown_vm_gracefully(vm_ip: str, server_id: int) -> bool:
     try:
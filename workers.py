@@ -0,0 +1,162 @@
+import os
+import sys
+import signal
+import asyncio
+import aiohttp
+from aiohttp import web, hdrs
+
+import shared_state
+import handoff
+from database_manager import DATA_DIR, storage
+from config import MASTER_WORKERS, PRIMARY_ROUTES, PRIMARY_ROUTE_PREFIXES
+
+# MASTER_WORKERS > 1: `python main.py` becomes a supervisor that runs the
+# shared_state coordinator and MASTER_WORKERS copies of main.py, each
+# bound to port 8080 with SO_REUSEPORT so the kernel spreads connections
+# over them. a worker that dies is started again
+#
+# worker 0 is the primary: it runs the background tasks (vm lifecycle,
+# backups, token cleanup) and owns vm_registry, game server processes and
+# the dashboard. it also listens on PRIMARY_SOCKET and the other workers
+# hand it the PRIMARY_ROUTES requests over that socket
+#
+# SIGHUP to the supervisor replaces the workers one at a time: a new worker
+# with the same id starts next to the old one (SO_REUSEPORT, no socket to
+# pass), once it is ready the old one gets SIGTERM and drains (handoff.py).
+# the supervisor and coordinator themselves keep running
+COORDINATOR_SOCKET = os.path.join(DATA_DIR, "coordinator.sock")
+PRIMARY_SOCKET = os.path.join(DATA_DIR, "primary.sock")
+RESTART_DELAY = 1.0
+
+# not forwarded as is, aiohttp sets its own
+HOP_HEADERS = frozenset(h.lower() for h in (
+    hdrs.CONNECTION, hdrs.KEEP_ALIVE, hdrs.TRANSFER_ENCODING, hdrs.CONTENT_LENGTH, hdrs.HOST,
+    hdrs.UPGRADE, hdrs.TE, hdrs.TRAILER, hdrs.PROXY_AUTHORIZATION, hdrs.PROXY_AUTHENTICATE,
+))
+FORWARDED_FOR = "X-Worker-Forwarded-For"
+
+primary_session = None
+
+def isPrimaryRoute(path: str) -> bool:
+    return path in PRIMARY_ROUTES or path.startswith(PRIMARY_ROUTE_PREFIXES)
+
+async def forwardToPrimary(request):
+    global primary_session
+    if primary_session is None:
+        primary_session = aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=PRIMARY_SOCKET),
+                                                auto_decompress=False)
+    headers = {name: value for name, value in request.headers.items() if name.lower() not in HOP_HEADERS}
+    headers[FORWARDED_FOR] = request.remote or ""
+    body = await request.read() if request.can_read_body else None
+    async with primary_session.request(request.method, f"http://primary{request.path_qs}", headers=headers,
+                                       data=body, allow_redirects=False) as upstream:
+        payload = await upstream.read()
+        response_headers = [(name, value) for name, value in upstream.headers.items()
+                            if name.lower() not in HOP_HEADERS]
+        return web.Response(status=upstream.status, body=payload, headers=response_headers)
+
+# first thing after metrics and the drain middleware in worker mode. on the
+# primary, requests that came over PRIMARY_SOCKET get the client's address
+# back as request.remote so rate limits and isServerIp see the real caller
+async def primary_forward_middleware(app, handler):
+    async def middleware_handler(request):
+        if shared_state.is_primary():
+            forwarded = request.headers.get(FORWARDED_FOR)
+            if forwarded is not None and not isinstance(request.transport.get_extra_info("peername"), tuple):
+                request = request.clone(remote=forwarded)
+            return await handler(request)
+        if isPrimaryRoute(request.path):
+            try:
+                return await forwardToPrimary(request)
+            except aiohttp.ClientError:
+                return web.Response(status=503, text="Service Unavailable", headers={"Retry-After": "1"})
+        return await handler(request)
+    return middleware_handler
+
+async def startPrimarySocket(runner):
+    if os.path.exists(PRIMARY_SOCKET):
+        os.unlink(PRIMARY_SOCKET)
+    await web.UnixSite(runner, PRIMARY_SOCKET).start()
+
+async def startWorker(worker_id: int, main_path: str, pass_fds=(), **env):
+    env = dict(os.environ, MASTER_WORKER_ID=str(worker_id), **env)
+    process = await asyncio.create_subprocess_exec(sys.executable, main_path, env=env, pass_fds=pass_fds)
+    print(f"Worker {worker_id} started (pid {process.pid})")
+    return process
+
+async def superviseWorker(worker_id: int, main_path: str, stopping: asyncio.Event, processes: dict):
+    while not stopping.is_set():
+        process = processes.get(worker_id)
+        if process is None or process.returncode is not None:
+            process = processes[worker_id] = await startWorker(worker_id, main_path)
+        code = await process.wait()
+        if stopping.is_set():
+            break
+        # replaced by reloadWorkers, watch the new one
+        if processes[worker_id] is not process:
+            continue
+        print(f"Worker {worker_id} exited with {code}, restarting")
+        await asyncio.sleep(RESTART_DELAY)
+
+async def reloadWorker(worker_id: int, main_path: str, processes: dict) -> bool:
+    ours, theirs = handoff.controlPair()
+    process = await startWorker(worker_id, main_path, pass_fds=(theirs.fileno(),),
+                                **{handoff.CONTROL_FD_ENV: str(theirs.fileno())})
+    theirs.close()
+    if not await handoff.waitReady(ours):
+        print(f"Reload: worker {worker_id} (pid {process.pid}) didn't get ready, keeping the old one")
+        if process.returncode is None:
+            process.kill()
+        ours.close()
+        return False
+    old = processes[worker_id]
+    processes[worker_id] = process
+    if old.returncode is None:
+        old.send_signal(signal.SIGTERM)
+        await old.wait()
+    # the new worker picks up the old one's state once this closes
+    ours.close()
+    return True
+
+async def reloadWorkers(main_path: str, processes: dict, state: dict):
+    if state.get("reloading"):
+        return
+    state["reloading"] = True
+    try:
+        # the primary last, the others keep forwarding to the old one meanwhile
+        for worker_id in sorted(processes, reverse=True):
+            if not await reloadWorker(worker_id, main_path, processes):
+                break
+        else:
+            print("Reload: all workers replaced")
+    finally:
+        state["reloading"] = False
+
+async def runSupervisor(main_path: str, count: int = MASTER_WORKERS):
+    if not storage.persistent:
+        raise ValueError("MASTER_WORKERS > 1 needs a database on disk, not DB_BACKEND=memory")
+    # made once here, otherwise every worker would create its own key file
+    import auth_utils
+    auth_utils.get_signing_keys()
+    os.makedirs(DATA_DIR, exist_ok=True)
+    coordinator = shared_state.Coordinator()
+    server = await coordinator.serve(COORDINATOR_SOCKET)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+    processes = {}
+    reload_state = {}
+    loop.add_signal_handler(signal.SIGHUP, lambda: loop.create_task(reloadWorkers(main_path, processes, reload_state)))
+    handoff.writePidFile()
+    tasks = [asyncio.create_task(superviseWorker(i, main_path, stopping, processes)) for i in range(count)]
+    print(f"Supervisor running {count} workers on :8080")
+    await stopping.wait()
+    handoff.removePidFile()
+    print("Stopping workers...")
+    for process in processes.values():
+        if process.returncode is None:
+            process.send_signal(signal.SIGTERM)
+    await asyncio.gather(*tasks, return_exceptions=True)
+    server.close()
+    await server.wait_closed()